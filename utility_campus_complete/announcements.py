@@ -0,0 +1,254 @@
+import click
+from flask.cli import AppGroup
+
+import db
+from db import after_commit
+from pubsub import broker
+
+# Campus-wide announcements.
+#
+# An announcement is one row plus a row per audience ('all', a role, a room
+# or a bus route); nothing is written per recipient, so sending to every
+# student costs the same as sending to one. A user's audiences are resolved
+# when their inbox is read: their role, the rooms they have upcoming
+# bookings in and the routes they subscribe to.
+#
+# Read state is one announcement_reads row per user: read_through says every
+# announcement up to that id is read, and read_bits is a little-endian bitmap
+# of the ones read above it (bit 0 = read_through + 1). Marking one read sets
+# its bit, then moves read_through up to just below the oldest announcement
+# the user can still see unread, so the bitmap stays a few bytes long.
+
+CHANNEL = 'announcements'
+AUDIENCE_KINDS = ('all', 'role', 'room', 'route')
+ID_PREFIX = 'announcement-'
+SCAN_LIMIT = 500
+
+
+def item_id(announcement_id):
+    """Id used for announcements in merged notification lists."""
+    return f'{ID_PREFIX}{announcement_id}'
+
+
+def parse_item_id(value):
+    """Announcement id from an item id, or None for a personal notification id."""
+    if isinstance(value, str) and value.startswith(ID_PREFIX) and value[len(ID_PREFIX):].isdigit():
+        return int(value[len(ID_PREFIX):])
+    return None
+
+
+def create(conn, title, message, audiences, created_by=None, category='announcement', expires_at=None):
+    """Insert an announcement for [(kind, value)] audiences inside the caller's transaction."""
+    audiences = sorted({(kind, '' if kind == 'all' else str(value)) for kind, value in audiences})
+    if not audiences:
+        raise ValueError('An announcement needs at least one audience')
+    for kind, _ in audiences:
+        if kind not in AUDIENCE_KINDS:
+            raise ValueError(f'Unknown audience: {kind}')
+    cursor = conn.execute('''
+        INSERT INTO announcements (title, message, category, created_by, expires_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (title, message, category, created_by, expires_at))
+    announcement_id = cursor.lastrowid
+    conn.executemany('INSERT INTO announcement_audiences (announcement_id, kind, value) VALUES (?, ?, ?)',
+                     [(announcement_id, kind, value) for kind, value in audiences])
+    row = conn.execute('SELECT * FROM announcements WHERE id = ?', (announcement_id,)).fetchone()
+    announcement = as_item(row, read=False)
+    event = {'audiences': audiences, 'item': announcement}
+    after_commit(lambda: broker.publish(CHANNEL, event))
+    return announcement
+
+
+def audience_keys(conn, user_id, user=None):
+    """(since, [(kind, value)]) for a user; since is when the account was created.
+
+    user, when the caller already has it (sessions.current_user()), saves the users lookup.
+    """
+    if user is None:
+        user = conn.execute('SELECT role, created_at FROM users WHERE id = ?', (user_id,)).fetchone()
+    if user is None:
+        return None, []
+    keys = [('all', ''), ('role', user['role'] or '')]
+    keys += [('room', str(row[0])) for row in conn.execute('''
+        SELECT DISTINCT room_id FROM bookings
+        WHERE user_id = ? AND booking_date >= date('now') AND status != 'cancelled'
+    ''', (user_id,))]
+    keys += [('route', str(row[0])) for row in conn.execute(
+        'SELECT route_id FROM route_subscriptions WHERE user_id = ?', (user_id,))]
+    return user['created_at'], keys
+
+
+def matches(keys, audiences):
+    return any(tuple(audience) in keys for audience in audiences)
+
+
+def visible(conn, since, keys, after_id=0, limit=SCAN_LIMIT, oldest_first=False):
+    """Unexpired announcements for the audience keys with id > after_id, newest first."""
+    if not keys:
+        return []
+    audience_match = ' OR '.join('(kind = ? AND value = ?)' for _ in keys)
+    params = [part for key in keys for part in key]
+    return conn.execute(f'''
+        SELECT * FROM announcements
+        WHERE id IN (SELECT announcement_id FROM announcement_audiences WHERE {audience_match})
+        AND id > ? AND created_at >= ?
+        AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+        ORDER BY id {'ASC' if oldest_first else 'DESC'} LIMIT ?
+    ''', params + [after_id, since or '', limit]).fetchall()
+
+
+class ReadState:
+    def __init__(self, read_through=0, bits=0):
+        self.read_through = read_through
+        self.bits = bits
+
+    @classmethod
+    def load(cls, conn, user_id):
+        row = conn.execute('SELECT read_through, read_bits FROM announcement_reads WHERE user_id = ?',
+                           (user_id,)).fetchone()
+        if row is None:
+            return cls()
+        return cls(row['read_through'], int.from_bytes(row['read_bits'] or b'', 'little'))
+
+    def is_read(self, announcement_id):
+        offset = announcement_id - self.read_through - 1
+        return offset < 0 or bool(self.bits >> offset & 1)
+
+    def read_ids(self):
+        ids, bits, announcement_id = [], self.bits, self.read_through + 1
+        while bits:
+            if bits & 1:
+                ids.append(announcement_id)
+            bits >>= 1
+            announcement_id += 1
+        return ids
+
+    def rebase(self, read_through, read_ids):
+        self.read_through = read_through
+        self.bits = 0
+        for announcement_id in read_ids:
+            if announcement_id > read_through:
+                self.bits |= 1 << (announcement_id - read_through - 1)
+
+    def save(self, conn, user_id):
+        conn.execute('''
+            INSERT INTO announcement_reads (user_id, read_through, read_bits) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET read_through = excluded.read_through, read_bits = excluded.read_bits
+        ''', (user_id, self.read_through, self.bits.to_bytes((self.bits.bit_length() + 7) // 8, 'little')))
+
+    def etag(self):
+        return f'{self.read_through}.{self.bits:x}'
+
+
+def as_item(row, read):
+    """Announcement row in the shape of a notifications row."""
+    return {
+        'id': item_id(row['id']),
+        'announcement_id': row['id'],
+        'kind': 'announcement',
+        'title': row['title'],
+        'message': row['message'],
+        'category': row['category'],
+        'read_status': 1 if read else 0,
+        'created_at': row['created_at'],
+    }
+
+
+def inbox(conn, user_id, limit=10, unread_only=False, user=None):
+    """Personal notifications merged with announcements, newest first."""
+    unread_clause = 'AND read_status = 0' if unread_only else ''
+    personal = [dict(row, kind='personal') for row in conn.execute(f'''
+        SELECT * FROM notifications WHERE user_id = ? {unread_clause}
+        ORDER BY created_at DESC LIMIT ?
+    ''', (user_id, limit))]
+    since, keys = audience_keys(conn, user_id, user)
+    state = ReadState.load(conn, user_id)
+    if unread_only:
+        # Everything at or below the watermark is read, so only scan above it
+        rows = [row for row in visible(conn, since, keys, state.read_through) if not state.is_read(row['id'])]
+    else:
+        rows = visible(conn, since, keys, limit=limit)
+    broadcast = [as_item(row, state.is_read(row['id'])) for row in rows[:limit]]
+    merged = sorted(personal + broadcast, key=lambda item: item['created_at'] or '', reverse=True)
+    return merged[:limit]
+
+
+def unread_etag(conn, user_id):
+    """Changes whenever an announcement visible to the user is added or read."""
+    since, keys = audience_keys(conn, user_id)
+    newest = visible(conn, since, keys, limit=1)
+    return f'{newest[0]["id"] if newest else 0}-{ReadState.load(conn, user_id).etag()}'
+
+
+def mark_read(conn, user_id, announcement_ids):
+    """Mark announcements read inside the caller's transaction; returns how many changed."""
+    state = ReadState.load(conn, user_id)
+    new = {i for i in announcement_ids if not state.is_read(i)}
+    if not new:
+        return 0
+    since, keys = audience_keys(conn, user_id)
+    rows = visible(conn, since, keys, state.read_through)
+    # When the newest SCAN_LIMIT stop short of the watermark, the oldest ones
+    # above it are scanned too, so the watermark never passes ids left unseen
+    oldest = visible(conn, since, keys, state.read_through, oldest_first=True) if len(rows) == SCAN_LIMIT else []
+    shown = {row['id'] for row in rows} | {row['id'] for row in oldest}
+    new &= shown
+    if not new:
+        return 0
+    read = set(state.read_ids()) | new
+    unread = sorted(shown - read)
+    # Everything below the oldest unread announcement counts as read, including
+    # ids the user was never shown
+    read_through = unread[0] - 1 if unread else max(read | shown)
+    if oldest and rows[-1]['id'] > oldest[-1]['id'] and all(row['id'] in read for row in oldest):
+        # All of the oldest window is read, but the gap up to the newest one was never scanned
+        read_through = min(read_through, oldest[-1]['id'])
+    state.rebase(max(read_through, state.read_through), read)
+    state.save(conn, user_id)
+    return len(new)
+
+
+def newest_id(conn):
+    return conn.execute('SELECT MAX(id) FROM announcements').fetchone()[0] or 0
+
+
+def mark_all_read(conn, user_id, through=None):
+    """Move the watermark to through (default: the newest announcement); returns the new watermark."""
+    if through is None:
+        through = newest_id(conn)
+    state = ReadState.load(conn, user_id)
+    state.rebase(max(through, state.read_through), state.read_ids())
+    state.save(conn, user_id)
+    return state.read_through
+
+
+def parse_audience(value):
+    """'all', 'role:student', 'room:3' or 'route:2' -> (kind, value)."""
+    kind, _, target = value.partition(':')
+    if kind not in AUDIENCE_KINDS or (kind != 'all' and not target):
+        raise ValueError(f'Invalid audience: {value!r}')
+    return kind, target
+
+
+announce_cli = AppGroup('announcements', help='Campus-wide announcement commands.')
+
+
+@announce_cli.command('send')
+@click.argument('title')
+@click.argument('message')
+@click.option('--to', 'audiences', multiple=True, default=['all'], show_default=True,
+              help="Audience: all, role:<role>, room:<room id> or route:<route id>; repeatable.")
+@click.option('--expires', help='Hide after this timestamp (YYYY-MM-DD HH:MM:SS).')
+def send_command(title, message, audiences, expires):
+    """Send an announcement to one or more audiences."""
+    try:
+        parsed = [parse_audience(audience) for audience in audiences]
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    with db.transaction() as conn:
+        announcement = create(conn, title, message, parsed, expires_at=expires)
+    click.echo(f'Sent announcement {announcement["announcement_id"]} to {", ".join(audiences)}.')
+
+
+def init_app(app):
+    app.cli.add_command(announce_cli)
@@ -1,293 +1,99 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, current_app, render_template, request, redirect, url_for, flash, session, jsonify, Response, send_from_directory, abort
 import sqlite3
 import os
 from datetime import datetime, timedelta
 import json
-from werkzeug.security import generate_password_hash, check_password_hash
+import mimetypes
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from werkzeug.utils import secure_filename
+from flask.cli import with_appcontext
 import base64
-
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-here'
+import announcements
+import assets
+import availability
+import backup
+import bookings
+import bulk
+import cache
+import click
+import db
+import instrumentation
+import issue_queue
+import listing
+import migrations
+import noise
+import notifications
+import occupancy
+import receipts
+import retention
+import search
+import sessions
+import stats
+import timetable
+import uploads
+from db import get_db, get_pool, transaction
+from seed import seed_db
 
 # Configure upload folder for photos
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Create upload folder if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Views in this module are collected here and registered by create_app()
+ROUTES = []
+
+def route(rule, **options):
+    def decorator(view):
+        ROUTES.append((rule, view, options))
+        return view
+    return decorator
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # Database initialization
-def init_db():
-    conn = sqlite3.connect('campus.db')
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            role TEXT NOT NULL,
-            email TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Rooms table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS rooms (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            room_name TEXT NOT NULL,
-            capacity INTEGER,
-            room_type TEXT,
-            status TEXT DEFAULT 'available'
-        )
-    ''')
-    
-    # Bookings table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS bookings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            room_id INTEGER,
-            user_id INTEGER,
-            booking_date DATE,
-            start_time TIME,
-            end_time TIME,
-            purpose TEXT,
-            status TEXT DEFAULT 'confirmed',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (room_id) REFERENCES rooms (id),
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Issues table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS issues (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            category TEXT,
-            description TEXT,
-            location TEXT,
-            priority TEXT DEFAULT 'medium',
-            status TEXT DEFAULT 'open',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Teacher availability table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS teacher_availability (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            teacher_id INTEGER,
-            day_of_week TEXT,
-            start_time TIME,
-            end_time TIME,
-            status TEXT DEFAULT 'available',
-            FOREIGN KEY (teacher_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Bus routes table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS bus_routes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            route_name TEXT,
-            departure_time TIME,
-            destination TEXT,
-            status TEXT DEFAULT 'active'
-        )
-    ''')
-    
-    # Canteen menu table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS canteen_menu (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            day_of_week TEXT,
-            meal_type TEXT,
-            item_name TEXT,
-            price REAL,
-            available BOOLEAN DEFAULT 1
-        )
-    ''')
-    
-    # Notifications table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            title TEXT,
-            message TEXT,
-            category TEXT,
-            read_status BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Washroom status table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS washroom_status (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            location TEXT,
-            status TEXT DEFAULT 'clean',
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Events table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT,
-            description TEXT,
-            event_date DATE,
-            event_time TIME,
-            location TEXT,
-            created_by INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (created_by) REFERENCES users (id)
-        )
-    ''')
-    
-    # Camera feeds table for seat availability
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS camera_feeds (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            location TEXT NOT NULL,
-            feed_url TEXT,
-            status TEXT DEFAULT 'active',
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # AI voice alerts table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS ai_alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            location TEXT NOT NULL,
-            alert_type TEXT NOT NULL,
-            threshold DECIMAL(5,2),
-            status TEXT DEFAULT 'active',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Maintenance photos table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS maintenance_photos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            issue_id INTEGER,
-            photo_path TEXT NOT NULL,
-            uploaded_by INTEGER,
-            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (issue_id) REFERENCES issues (id),
-            FOREIGN KEY (uploaded_by) REFERENCES users (id)
-        )
-    ''')
-    
-    # Insert sample data
-    cursor.execute('INSERT OR IGNORE INTO users (username, password, role, email) VALUES (?, ?, ?, ?)',
-                  ('admin', generate_password_hash('admin123'), 'admin', 'admin@campus.com'))
-    cursor.execute('INSERT OR IGNORE INTO users (username, password, role, email) VALUES (?, ?, ?, ?)',
-                  ('student1', generate_password_hash('student123'), 'student', 'student1@campus.com'))
-    cursor.execute('INSERT OR IGNORE INTO users (username, password, role, email) VALUES (?, ?, ?, ?)',
-                  ('faculty1', generate_password_hash('faculty123'), 'faculty', 'faculty1@campus.com'))
-    cursor.execute('INSERT OR IGNORE INTO users (username, password, role, email) VALUES (?, ?, ?, ?)',
-                  ('chef1', generate_password_hash('chef123'), 'chef', 'chef1@campus.com'))
-    cursor.execute('INSERT OR IGNORE INTO users (username, password, role, email) VALUES (?, ?, ?, ?)',
-                  ('buscoord1', generate_password_hash('bus123'), 'buscoordinator', 'buscoord1@campus.com'))
-    
-    # Insert sample rooms
-    rooms_data = [
-        ('Room 101', 30, 'classroom', 'available'),
-        ('Room 102', 25, 'classroom', 'available'),
-        ('Lab A', 20, 'laboratory', 'available'),
-        ('Library', 50, 'library', 'available'),
-        ('Conference Room', 15, 'conference', 'available')
-    ]
-    cursor.executemany('INSERT OR IGNORE INTO rooms (room_name, capacity, room_type, status) VALUES (?, ?, ?, ?)', rooms_data)
-    
-    # Insert sample bus routes
-    bus_routes = [
-        ('Route 1', '08:00', 'Downtown', 'active'),
-        ('Route 2', '08:30', 'Suburb', 'active'),
-        ('Route 3', '17:00', 'Downtown', 'active')
-    ]
-    cursor.executemany('INSERT OR IGNORE INTO bus_routes (route_name, departure_time, destination, status) VALUES (?, ?, ?, ?)', bus_routes)
-    
-    # Insert sample washroom status
-    washrooms = [
-        ('Block A - Ground Floor', 'clean'),
-        ('Block B - First Floor', 'clean'),
-        ('Library', 'clean')
-    ]
-    cursor.executemany('INSERT OR IGNORE INTO washroom_status (location, status) VALUES (?, ?)', washrooms)
-    
-    # Insert sample canteen menu
-    menu_items = [
-        ('Monday', 'lunch', 'Vegetable Biryani', 120.0),
-        ('Monday', 'dinner', 'Chicken Curry', 150.0),
-        ('Tuesday', 'lunch', 'Masala Dosa', 80.0),
-        ('Tuesday', 'dinner', 'Paneer Tikka', 130.0)
-    ]
-    cursor.executemany('INSERT OR IGNORE INTO canteen_menu (day_of_week, meal_type, item_name, price) VALUES (?, ?, ?, ?)', menu_items)
-    
-    # Insert sample issues
-    sample_issues = [
-        (1, 'washroom', 'Block A washroom needs cleaning', 'Block A', 'high'),
-        (2, 'classroom', 'Projector not working in Room 101', 'Room 101', 'medium'),
-        (3, 'food', 'Canteen food quality issue', 'Canteen', 'low'),
-        (4, 'bus', 'Bus route 1 delayed', 'Bus Stop', 'high')
-    ]
-    cursor.executemany('INSERT OR IGNORE INTO issues (user_id, category, description, location, priority) VALUES (?, ?, ?, ?, ?)', sample_issues)
-    
-    # Insert sample bookings
-    sample_bookings = [
-        (1, 1, '2024-01-15', '09:00', '11:00', 'Class meeting'),
-        (2, 2, '2024-01-16', '14:00', '16:00', 'Study group'),
-        (3, 3, '2024-01-17', '10:00', '12:00', 'Lab session')
-    ]
-    cursor.executemany('INSERT OR IGNORE INTO bookings (room_id, user_id, booking_date, start_time, end_time, purpose) VALUES (?, ?, ?, ?, ?, ?)', sample_bookings)
-    
-    # Insert sample notifications
-    sample_notifications = [
-        (1, 'System Alert', 'Library maintenance scheduled for tomorrow', 'system', 0),
-        (2, 'Room Booking', 'Your room booking for Room 101 is confirmed', 'booking', 0),
-        (3, 'Issue Update', 'Your reported issue has been resolved', 'issue', 0)
-    ]
-    cursor.executemany('INSERT OR IGNORE INTO notifications (user_id, title, message, category, read_status) VALUES (?, ?, ?, ?, ?)', sample_notifications)
-    
-    conn.commit()
-    conn.close()
-
-# Initialize database
-init_db()
-
-def get_db_connection():
-    conn = sqlite3.connect('campus.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-@app.route('/')
+def init_db(with_seed=True):
+    conn = db.connect(current_app.config['DATABASE'])
+    try:
+        applied = migrations.upgrade(conn)
+    finally:
+        conn.close()
+    inserted = {}
+    if with_seed:
+        with transaction() as conn:
+            inserted = seed_db(conn)
+    return applied, inserted
+
+@click.command('init-db')
+@click.option('--no-seed', is_flag=True, help='Only create the schema, skip sample data.')
+@with_appcontext
+def init_db_command(no_seed):
+    """Create or upgrade the schema and load the sample data."""
+    applied, inserted = init_db(with_seed=not no_seed)
+    click.echo(f'Schema at version {migrations.LATEST_VERSION} ({len(applied)} migrations applied).')
+    if inserted:
+        click.echo(f'Seeded {sum(inserted.values())} rows.')
+
+@click.command('seed')
+@with_appcontext
+def seed_command():
+    """Load the sample data. Safe to run repeatedly."""
+    with transaction() as conn:
+        inserted = seed_db(conn)
+    for table, count in inserted.items():
+        click.echo(f'{table}: {count} inserted')
+
+@route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         
-        conn = get_db_connection()
+        conn = get_db()
         user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-        conn.close()
         
         if user and check_password_hash(user['password'], password):
             session['user_id'] = user['id']
@@ -300,17 +106,15 @@ def login():
     
     return render_template('login.html')
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     session.clear()
     flash('Logged out successfully!', 'success')
     return redirect(url_for('index'))
 
-@app.route('/dashboard')
+@route('/dashboard')
+@sessions.login_required()
 def dashboard():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     role = session['role']
     if role == 'admin':
         return redirect(url_for('admin_dashboard'))
@@ -325,107 +129,149 @@ def dashboard():
     
     return redirect(url_for('login'))
 
-@app.route('/admin/dashboard')
+@route('/admin/dashboard')
+@sessions.login_required('admin')
 def admin_dashboard():
-    if 'user_id' not in session or session['role'] != 'admin':
-        return redirect(url_for('login'))
-    
-    conn = get_db_connection()
-    users = conn.execute('SELECT * FROM users').fetchall()
-    
-    # Handle empty tables with LEFT JOIN to avoid errors
+    conn = get_db()
     try:
-        issues = conn.execute('SELECT i.*, u.username FROM issues i LEFT JOIN users u ON i.user_id = u.id').fetchall()
-    except:
-        issues = []
-    
+        users_cursor = listing.parse_cursor(request.args.get('users_cursor'))
+    except listing.InvalidCursor:
+        users_cursor = None
+    users, next_users_cursor = listing.page(conn, 'users', {'role': request.args.get('role')}, users_cursor)
+    issues, _ = listing.page(conn, 'issues', {'status': request.args.get('issue_status')}, limit=5)
+    bookings, _ = listing.page(conn, 'bookings', {'date': request.args.get('booking_date')}, limit=5)
+    
+    today = datetime.now().strftime('%Y-%m-%d')
+    summary = stats.summary(conn, today)
+    counts = {
+        'users': summary['users']['total'],
+        'issues': summary['issues']['total'],
+        'open_issues': summary['issues']['by_status'].get('open', 0),
+        'bookings': summary['bookings']['total'],
+        'bookings_today': summary['bookings']['on_date'],
+    }
+    
+    return render_template('admin_dashboard.html', users=users, issues=issues, bookings=bookings,
+                           counts=counts, next_users_cursor=next_users_cursor, today=today,
+                           audience_kinds=announcements.AUDIENCE_KINDS)
+
+# Paginated admin lists and streaming exports
+@route('/api/admin/<any(users, issues, bookings):list_name>')
+@sessions.login_required('admin', api=True)
+def admin_list(list_name):
     try:
-        bookings = conn.execute('SELECT b.*, r.room_name, u.username FROM bookings b LEFT JOIN rooms r ON b.room_id = r.id LEFT JOIN users u ON b.user_id = u.id').fetchall()
-    except:
-        bookings = []
-    
-    conn.close()
-    
-    return render_template('admin_dashboard.html', users=users, issues=issues, bookings=bookings, today=datetime.now().strftime('%Y-%m-%d'))
-
-@app.route('/student/dashboard')
+        cursor = listing.parse_cursor(request.args.get('cursor'))
+    except listing.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    
+    rows, next_cursor = listing.page(get_db(), list_name, request.args, cursor,
+                                     listing.parse_limit(request.args.get('limit')))
+    columns = listing.LISTS[list_name]['columns']
+    return jsonify({'items': [{col: row[col] for col in columns} for row in rows],
+                    'next_cursor': next_cursor})
+
+@route('/api/admin/<any(users, issues, bookings):list_name>/export')
+@sessions.login_required('admin', api=True)
+def admin_export(list_name):
+    export_format = request.args.get('format', 'json')
+    if export_format not in ('json', 'csv'):
+        return jsonify({'error': 'format must be json or csv'}), 400
+    
+    filters = request.args.to_dict()
+    columns = listing.LISTS[list_name]['columns']
+    # Reads the reporting snapshot when there is one, so long exports stay off the live file
+    reader = backup.export_reader()
+    
+    def generate():
+        # Runs after the view returns, so it holds its own connection
+        with reader as conn:
+            rows = listing.iter_rows(conn, list_name, filters)
+            if export_format == 'csv':
+                yield from listing.export_csv(rows, columns)
+            else:
+                yield from listing.export_json(rows, columns)
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/json'
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={list_name}.{export_format}',
+                             **reader.headers()})
+
+@route('/student/dashboard')
+@sessions.login_required('student')
 def student_dashboard():
-    if 'user_id' not in session or session['role'] != 'student':
-        return redirect(url_for('login'))
-    
-    conn = get_db_connection()
-    available_rooms = conn.execute('SELECT * FROM rooms WHERE status = "available"').fetchall()
+    conn = get_db()
+    available_rooms = cache.query(conn, 'rooms', 'SELECT * FROM rooms WHERE status = "available"')
     
     try:
-        notifications = conn.execute('SELECT * FROM notifications WHERE user_id = ? ORDER BY created_at DESC LIMIT 10', (session['user_id'],)).fetchall()
+        notifications = announcements.inbox(conn, session['user_id'], user=sessions.current_user())
     except:
         notifications = []
     
-    bus_routes = conn.execute('SELECT * FROM bus_routes WHERE status = "active"').fetchall()
+    bus_departures = timetable.next_departures(conn, limit=6)
+    bus_route_count = timetable.get_timetable(conn).active_route_count()
+    subscribed_routes = {row[0] for row in conn.execute('SELECT route_id FROM route_subscriptions WHERE user_id = ?',
+                                                        (session['user_id'],))}
     
     try:
-        canteen_menu = conn.execute('SELECT * FROM canteen_menu WHERE day_of_week = ? AND available = 1', (datetime.now().strftime('%A'),)).fetchall()
+        canteen_menu = cache.query(conn, 'canteen_menu', 'SELECT * FROM canteen_menu WHERE day_of_week = ? AND available = 1', (datetime.now().strftime('%A'),))
     except:
         canteen_menu = []
     
-    conn.close()
     
     return render_template('student_dashboard.html', 
                          available_rooms=available_rooms, 
                          notifications=notifications,
-                         bus_routes=bus_routes,
+                         bus_departures=bus_departures,
+                         bus_route_count=bus_route_count,
+                         today=datetime.now().strftime('%Y-%m-%d'),
+                         subscribed_routes=subscribed_routes,
                          canteen_menu=canteen_menu)
 
-@app.route('/faculty/dashboard')
+@route('/faculty/dashboard')
+@sessions.login_required('faculty')
 def faculty_dashboard():
-    if 'user_id' not in session or session['role'] != 'faculty':
-        return redirect(url_for('login'))
-    
-    conn = get_db_connection()
-    teacher_availability = conn.execute('SELECT * FROM teacher_availability WHERE teacher_id = ?', (session['user_id'],)).fetchall()
-    notifications = conn.execute('SELECT * FROM notifications WHERE user_id = ? ORDER BY created_at DESC LIMIT 10', (session['user_id'],)).fetchall()
-    conn.close()
+    conn = get_db()
+    teacher_availability = availability.week(conn, session['user_id'])
+    notifications = announcements.inbox(conn, session['user_id'], user=sessions.current_user())
     
     return render_template('faculty_dashboard.html', 
                          teacher_availability=teacher_availability,
                          notifications=notifications)
 
-@app.route('/chef/dashboard')
+@route('/chef/dashboard')
+@sessions.login_required('chef')
 def chef_dashboard():
-    if 'user_id' not in session or session['role'] != 'chef':
-        return redirect(url_for('login'))
-    
-    conn = get_db_connection()
-    canteen_menu = conn.execute('SELECT * FROM canteen_menu ORDER BY day_of_week, meal_type').fetchall()
-    notifications = conn.execute('SELECT * FROM notifications WHERE user_id = ? ORDER BY created_at DESC LIMIT 10', (session['user_id'],)).fetchall()
-    conn.close()
+    conn = get_db()
+    canteen_menu = cache.query(conn, 'canteen_menu', 'SELECT * FROM canteen_menu ORDER BY day_of_week, meal_type')
+    notifications = announcements.inbox(conn, session['user_id'], user=sessions.current_user())
     
     return render_template('chef_dashboard.html', 
                          canteen_menu=canteen_menu,
                          notifications=notifications)
 
-@app.route('/buscoordinator/dashboard')
+@route('/buscoordinator/dashboard')
+@sessions.login_required('buscoordinator')
 def buscoordinator_dashboard():
-    if 'user_id' not in session or session['role'] != 'buscoordinator':
-        return redirect(url_for('login'))
-    
-    conn = get_db_connection()
-    bus_routes = conn.execute('SELECT * FROM bus_routes').fetchall()
-    issues = conn.execute('SELECT i.*, u.username FROM issues i JOIN users u ON i.user_id = u.id WHERE i.category = "bus"').fetchall()
-    notifications = conn.execute('SELECT * FROM notifications WHERE user_id = ? ORDER BY created_at DESC LIMIT 10', (session['user_id'],)).fetchall()
-    conn.close()
+    conn = get_db()
+    bus_timetable = timetable.get_timetable(conn)
+    # Issues this coordinator is working on, then the unclaimed bus queue
+    _, categories = issue_queue.staff_categories(session['role'])
+    issues = issue_queue.assigned(conn, session['user_id']) + issue_queue.queue(conn, categories, limit=20)
+    open_bus_issues = stats.counter(conn, 'issues.category_status', 'bus:open')
+    notifications = announcements.inbox(conn, session['user_id'], user=sessions.current_user())
     
     return render_template('buscoordinator_dashboard.html', 
-                         bus_routes=bus_routes,
+                         bus_routes=bus_timetable.route_list(),
+                         active_route_count=bus_timetable.active_route_count(),
+                         bus_departures=timetable.next_departures(conn, limit=10),
                          issues=issues,
+                         open_bus_issues=open_bus_issues,
                          notifications=notifications)
 
 # Room booking routes
-@app.route('/book_room', methods=['GET', 'POST'])
+@route('/book_room', methods=['GET', 'POST'])
+@sessions.login_required()
 def book_room():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     if request.method == 'POST':
         room_id = request.form['room_id']
         booking_date = request.form['booking_date']
@@ -433,300 +279,358 @@ def book_room():
         end_time = request.form['end_time']
         purpose = request.form['purpose']
         
-        conn = get_db_connection()
-        
-        # Check for booking conflicts
-        existing_booking = conn.execute('''
-            SELECT * FROM bookings 
-            WHERE room_id = ? AND booking_date = ? 
-            AND ((start_time <= ? AND end_time > ?) OR (start_time < ? AND end_time >= ?))
-        ''', (room_id, booking_date, start_time, start_time, end_time, end_time)).fetchone()
-        
-        if existing_booking:
-            flash('Room is already booked for this time slot!', 'error')
-        else:
-            conn.execute('''
-                INSERT INTO bookings (room_id, user_id, booking_date, start_time, end_time, purpose)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (room_id, session['user_id'], booking_date, start_time, end_time, purpose))
-            conn.commit()
+        try:
+            with transaction() as conn:
+                bookings.book(conn, room_id, session['user_id'], booking_date, start_time, end_time, purpose)
+                room = conn.execute('SELECT room_name FROM rooms WHERE id = ?', (room_id,)).fetchone()
+                notifications.notify(conn, session['user_id'], 'Room Booking',
+                                     f'Your room booking for {room["room_name"] if room else "the room"} '
+                                     f'on {booking_date} is confirmed', 'booking')
             flash('Room booked successfully!', 'success')
+        except bookings.BookingConflict as e:
+            flash(f'Room is already booked from {e.booking["start_time"]} to {e.booking["end_time"]}!', 'error')
+        except bookings.InvalidBooking as e:
+            flash(str(e), 'error')
         
-        conn.close()
         return redirect(url_for('book_room'))
     
-    conn = get_db_connection()
-    rooms = conn.execute('SELECT * FROM rooms WHERE status = "available"').fetchall()
+    conn = get_db()
+    rooms = cache.query(conn, 'rooms', 'SELECT * FROM rooms WHERE status = "available"')
     my_bookings = conn.execute('''
         SELECT b.*, r.room_name FROM bookings b 
         JOIN rooms r ON b.room_id = r.id 
         WHERE b.user_id = ? ORDER BY b.booking_date DESC
     ''', (session['user_id'],)).fetchall()
-    conn.close()
     
     return render_template('book_room.html', rooms=rooms, my_bookings=my_bookings)
 
+@route('/api/rooms/free')
+@sessions.login_required(api=401)
+def free_rooms():
+    try:
+        rooms = bookings.free_rooms(get_db(), request.args['date'], request.args['start'], request.args['end'])
+    except KeyError as e:
+        return jsonify({'error': f'Missing parameter: {e.args[0]}'}), 400
+    except bookings.InvalidBooking as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify([dict(room) for room in rooms])
+
 # Issue reporting routes
-@app.route('/report_issue', methods=['GET', 'POST'])
+@route('/report_issue', methods=['GET', 'POST'])
+@sessions.login_required()
 def report_issue():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     if request.method == 'POST':
         category = request.form['category']
         description = request.form['description']
         location = request.form['location']
         priority = request.form['priority']
         
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO issues (user_id, category, description, location, priority)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (session['user_id'], category, description, location, priority))
-        conn.commit()
-        conn.close()
+        try:
+            with transaction() as conn:
+                issue_queue.report(conn, session['user_id'], category, description, location, priority)
+        except issue_queue.InvalidIssue as e:
+            flash(str(e), 'error')
+            return redirect(url_for('report_issue'))
         
         flash('Issue reported successfully!', 'success')
         return redirect(url_for('report_issue'))
     
-    conn = get_db_connection()
+    conn = get_db()
     my_issues = conn.execute('''
         SELECT * FROM issues WHERE user_id = ? ORDER BY created_at DESC
     ''', (session['user_id'],)).fetchall()
-    conn.close()
     
     return render_template('report_issue.html', my_issues=my_issues)
 
 # Teacher availability routes
-@app.route('/teacher_availability', methods=['GET', 'POST'])
+@route('/teacher_availability', methods=['GET', 'POST'])
+@sessions.login_required('faculty', 'student', 'admin')
 def teacher_availability():
-    if 'user_id' not in session or session['role'] not in ['faculty', 'student', 'admin']:
-        return redirect(url_for('login'))
-    
     if request.method == 'POST' and session['role'] == 'faculty':
         day_of_week = request.form['day_of_week']
         start_time = request.form['start_time']
         end_time = request.form['end_time']
         status = request.form['status']
         
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT OR REPLACE INTO teacher_availability (teacher_id, day_of_week, start_time, end_time, status)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (session['user_id'], day_of_week, start_time, end_time, status))
-        conn.commit()
-        conn.close()
+        # Saving the same day and start time again updates that slot
+        try:
+            with transaction() as conn:
+                availability.save(conn, session['user_id'], day_of_week, start_time, end_time, status)
+        except availability.InvalidAvailability as e:
+            flash(str(e), 'error')
+            return redirect(url_for('teacher_availability'))
         
         flash('Availability updated successfully!', 'success')
         return redirect(url_for('teacher_availability'))
     
-    conn = get_db_connection()
+    conn = get_db()
     if session['role'] == 'faculty':
         # Faculty can see their own availability
-        availability = conn.execute('''
-            SELECT * FROM teacher_availability WHERE teacher_id = ? ORDER BY day_of_week
-        ''', (session['user_id'],)).fetchall()
+        rows = availability.week(conn, session['user_id'])
     else:
         # Students and admin can see all faculty availability
-        availability = conn.execute('''
-            SELECT ta.*, u.username FROM teacher_availability ta 
-            JOIN users u ON ta.teacher_id = u.id 
-            WHERE u.role = 'faculty' 
-            ORDER BY u.username, ta.day_of_week
-        ''').fetchall()
-    conn.close()
+        rows = availability.week(conn)
     
-    return render_template('teacher_availability.html', availability=availability)
+    return render_template('teacher_availability.html', availability=rows, days=availability.DAYS)
 
 # Canteen menu routes
-@app.route('/canteen_menu', methods=['GET', 'POST'])
+@route('/canteen_menu', methods=['GET', 'POST'])
+@sessions.login_required('chef', 'admin')
 def canteen_menu():
-    if 'user_id' not in session or session['role'] not in ['chef', 'admin']:
-        return redirect(url_for('login'))
-    
     if request.method == 'POST':
         day_of_week = request.form['day_of_week']
         meal_type = request.form['meal_type']
         item_name = request.form['item_name']
         price = request.form['price']
         
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO canteen_menu (day_of_week, meal_type, item_name, price)
-            VALUES (?, ?, ?, ?)
-        ''', (day_of_week, meal_type, item_name, price))
-        conn.commit()
-        conn.close()
+        with transaction() as conn:
+            conn.execute('''
+                INSERT INTO canteen_menu (day_of_week, meal_type, item_name, price)
+                VALUES (?, ?, ?, ?)
+            ''', (day_of_week, meal_type, item_name, price))
+            cache.invalidate('canteen_menu')
         
         flash('Menu item added successfully!', 'success')
         return redirect(url_for('canteen_menu'))
     
-    conn = get_db_connection()
-    menu_items = conn.execute('SELECT * FROM canteen_menu ORDER BY day_of_week, meal_type').fetchall()
-    conn.close()
+    conn = get_db()
+    menu_items = cache.query(conn, 'canteen_menu', 'SELECT * FROM canteen_menu ORDER BY day_of_week, meal_type')
     
     return render_template('canteen_menu.html', menu_items=menu_items)
 
 # Bus routes routes
-@app.route('/bus_routes', methods=['GET', 'POST'])
+@route('/bus_routes', methods=['GET', 'POST'])
+@sessions.login_required('buscoordinator')
 def bus_routes():
-    if 'user_id' not in session or session['role'] != 'buscoordinator':
-        return redirect(url_for('login'))
-    
     if request.method == 'POST':
         route_name = request.form['route_name']
         departure_time = request.form['departure_time']
         destination = request.form['destination']
         
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO bus_routes (route_name, departure_time, destination)
-            VALUES (?, ?, ?)
-        ''', (route_name, departure_time, destination))
-        conn.commit()
-        conn.close()
+        with transaction() as conn:
+            conn.execute('''
+                INSERT INTO bus_routes (route_name, departure_time, destination)
+                VALUES (?, ?, ?)
+            ''', (route_name, departure_time, destination))
+            cache.invalidate('bus_routes')
         
         flash('Bus route added successfully!', 'success')
         return redirect(url_for('bus_routes'))
     
-    conn = get_db_connection()
-    routes = conn.execute('SELECT * FROM bus_routes ORDER BY departure_time').fetchall()
-    conn.close()
+    conn = get_db()
+    routes = cache.query(conn, 'bus_routes', 'SELECT * FROM bus_routes ORDER BY departure_time')
     
-    return render_template('bus_routes.html', routes=routes)
+    return render_template('bus_routes.html', routes=routes, timetable_routes=timetable.get_timetable(conn).route_list(),
+                           days=availability.DAYS)
 
 # Washroom status routes
-@app.route('/washroom_status', methods=['GET', 'POST'])
+@route('/washroom_status', methods=['GET', 'POST'])
+@sessions.login_required()
 def washroom_status():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     if request.method == 'POST':
         location = request.form['location']
         status = request.form['status']
         
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT OR REPLACE INTO washroom_status (location, status)
-            VALUES (?, ?)
-        ''', (location, status))
-        conn.commit()
-        conn.close()
+        with transaction() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO washroom_status (location, status)
+                VALUES (?, ?)
+            ''', (location, status))
+            cache.invalidate('washroom_status')
         
         flash('Washroom status updated successfully!', 'success')
         return redirect(url_for('washroom_status'))
     
-    conn = get_db_connection()
-    washrooms = conn.execute('SELECT * FROM washroom_status ORDER BY location').fetchall()
-    conn.close()
+    conn = get_db()
+    washrooms = cache.query(conn, 'washroom_status', 'SELECT * FROM washroom_status ORDER BY location')
     
     return render_template('washroom_status.html', washrooms=washrooms)
 
 # API routes for AJAX calls
-@app.route('/api/notifications')
+@route('/api/stats')
+@sessions.login_required(api=401)
+def api_stats():
+    day = request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+    return jsonify(stats.summary(get_db(), day))
+
+@route('/api/notifications')
+@sessions.login_required(denied=lambda: jsonify([]))
 def get_notifications():
-    if 'user_id' not in session:
-        return jsonify([])
-    
-    conn = get_db_connection()
-    notifications = conn.execute('''
-        SELECT * FROM notifications WHERE user_id = ? AND read_status = 0 
-        ORDER BY created_at DESC LIMIT 5
-    ''', (session['user_id'],)).fetchall()
-    conn.close()
-    
-    return jsonify([dict(n) for n in notifications])
-
-@app.route('/api/mark_notification_read/<int:notification_id>')
+    # Cheap check on the unread index and announcement cursor first so
+    # unchanged polls get a 304
+    etag, load = receipts.poll(get_db(), session['user_id'])
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(load())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@route('/api/notifications/stream')
+@sessions.login_required(api=401)
+def notification_stream():
+    if not current_app.config['NOTIFY_STREAM']:
+        # 204 tells EventSource clients to stop reconnecting
+        return '', 204
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    stream = notifications.stream(
+        get_pool(), session['user_id'],
+        last_event_id=int(last_event_id) if last_event_id and last_event_id.isdigit() else None,
+        heartbeat=current_app.config['NOTIFY_STREAM_HEARTBEAT'],
+        resync_interval=current_app.config['NOTIFY_STREAM_RESYNC'],
+    )
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@route('/api/mark_notification_read/<notification_id>')
+@sessions.login_required(denied=lambda: jsonify({'success': False}))
 def mark_notification_read(notification_id):
-    if 'user_id' not in session:
-        return jsonify({'success': False})
-    
-    conn = get_db_connection()
-    conn.execute('UPDATE notifications SET read_status = 1 WHERE id = ? AND user_id = ?', 
-                (notification_id, session['user_id']))
-    conn.commit()
-    conn.close()
+    # Announcements come through as 'announcement-<id>', personal rows by number
+    try:
+        receipts.record(session['user_id'], [notification_id])
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Unknown notification'}), 404
     
     return jsonify({'success': True})
 
+# Mark many notifications read at once: {"ids": [...]}, {"up_to": <id>} or
+# {"all": true}; "sync": true skips the write-behind buffer
+@route('/api/notifications/read', methods=['POST'])
+@sessions.login_required(api=401)
+def mark_notifications_read():
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Send a JSON object'}), 400
+    ids = data.get('ids') or []
+    up_to = data.get('up_to')
+    if not isinstance(ids, list) or (up_to is not None and (not isinstance(up_to, int) or isinstance(up_to, bool))):
+        return jsonify({'success': False, 'error': 'ids must be a list and up_to a notification id'}), 400
+    try:
+        queued, updated = receipts.record(session['user_id'], ids, up_to=up_to,
+                                          everything=bool(data.get('all')), sync=bool(data.get('sync')))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({'success': True, 'queued': queued, 'updated': updated})
+
+# Campus-wide announcements (bus coordinators may only address route riders)
+@route('/announcements', methods=['POST'])
+@sessions.login_required('admin', 'buscoordinator')
+def send_announcement():
+    dashboard = url_for('admin_dashboard' if session['role'] == 'admin' else 'buscoordinator_dashboard')
+    title = request.form.get('title', '').strip()
+    message = request.form.get('message', '').strip()
+    kind = request.form.get('audience', 'all')
+    value = request.form.get('audience_value', '').strip()
+    if not title or not message:
+        flash('An announcement needs a title and a message.', 'error')
+        return redirect(dashboard)
+    if session['role'] != 'admin' and kind != 'route':
+        flash('Bus coordinators can only send announcements to a route.', 'error')
+        return redirect(dashboard)
+    if kind not in announcements.AUDIENCE_KINDS or (kind != 'all' and not value):
+        flash('Choose who the announcement is for.', 'error')
+        return redirect(dashboard)
+    
+    with transaction() as conn:
+        announcements.create(conn, title, message, [(kind, value)], created_by=session['user_id'])
+    
+    flash('Announcement sent.', 'success')
+    return redirect(dashboard)
+
+@route('/api/bus_routes/<int:route_id>/subscription', methods=['POST', 'DELETE'])
+@sessions.login_required(api=401)
+def route_subscription(route_id):
+    with transaction() as conn:
+        if request.method == 'POST':
+            if conn.execute('SELECT 1 FROM bus_routes WHERE id = ?', (route_id,)).fetchone() is None:
+                return jsonify({'error': 'Unknown route'}), 404
+            conn.execute('INSERT OR IGNORE INTO route_subscriptions (user_id, route_id) VALUES (?, ?)',
+                         (session['user_id'], route_id))
+        else:
+            conn.execute('DELETE FROM route_subscriptions WHERE user_id = ? AND route_id = ?',
+                         (session['user_id'], route_id))
+    
+    return jsonify({'success': True, 'subscribed': request.method == 'POST'})
+
 # Camera access for seat availability
-@app.route('/camera_access')
+@route('/camera_access')
+@sessions.login_required('student', 'faculty', 'admin')
 def camera_access():
-    if 'user_id' not in session or session['role'] not in ['student', 'faculty', 'admin']:
-        return redirect(url_for('login'))
-    
-    conn = get_db_connection()
+    conn = get_db()
     camera_feeds = conn.execute('SELECT * FROM camera_feeds WHERE status = "active"').fetchall()
-    conn.close()
+    occupancy_by_feed = {feed['id']: feed for feed in occupancy.get_monitor().snapshot()}
     
-    return render_template('camera_access.html', camera_feeds=camera_feeds)
+    return render_template('camera_access.html', camera_feeds=camera_feeds, occupancy=occupancy_by_feed)
 
 # Clear all menu items
-@app.route('/clear_all_menu', methods=['POST'])
+@route('/clear_all_menu', methods=['POST'])
+@sessions.login_required('chef', 'admin', api=True)
 def clear_all_menu():
-    if 'user_id' not in session or session['role'] not in ['chef', 'admin']:
-        return jsonify({'success': False, 'error': 'Access denied'})
-    
     try:
-        conn = get_db_connection()
-        conn.execute('DELETE FROM canteen_menu')
-        conn.commit()
-        conn.close()
+        with transaction() as conn:
+            conn.execute('DELETE FROM canteen_menu')
+            cache.invalidate('canteen_menu')
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
 # AI voice alerts for library silence
-@app.route('/ai_alerts')
+@route('/ai_alerts')
+@sessions.login_required('admin', 'faculty')
 def ai_alerts():
-    if 'user_id' not in session or session['role'] not in ['admin', 'faculty']:
-        return redirect(url_for('login'))
-    
-    conn = get_db_connection()
+    conn = get_db()
     alerts = conn.execute('SELECT * FROM ai_alerts ORDER BY created_at DESC').fetchall()
-    conn.close()
+    noise_status = noise.current_status()
     
-    return render_template('ai_alerts.html', alerts=alerts)
+    return render_template('ai_alerts.html', alerts=alerts, noise_status=noise_status)
 
 # Delete functionality for all items
-@app.route('/delete/<item_type>/<int:item_id>')
+@route('/delete/<item_type>/<int:item_id>')
+@sessions.login_required('admin')
 def delete_item(item_type, item_id):
-    if 'user_id' not in session or session['role'] != 'admin':
-        flash('Access denied!', 'error')
-        return redirect(url_for('dashboard'))
-    
-    conn = get_db_connection()
-    
     try:
-        if item_type == 'user':
-            conn.execute('DELETE FROM users WHERE id = ?', (item_id,))
-        elif item_type == 'issue':
-            conn.execute('DELETE FROM issues WHERE id = ?', (item_id,))
-        elif item_type == 'booking':
-            conn.execute('DELETE FROM bookings WHERE id = ?', (item_id,))
-        elif item_type == 'menu':
-            conn.execute('DELETE FROM canteen_menu WHERE id = ?', (item_id,))
-        elif item_type == 'route':
-            conn.execute('DELETE FROM bus_routes WHERE id = ?', (item_id,))
-        elif item_type == 'washroom':
-            conn.execute('DELETE FROM washroom_status WHERE id = ?', (item_id,))
+        with transaction() as conn:
+            if item_type == 'user':
+                conn.execute('DELETE FROM users WHERE id = ?', (item_id,))
+                # Signed out everywhere as of this commit, not when the cookie expires
+                sessions.revoke_user(conn, item_id)
+            elif item_type == 'issue':
+                issue = conn.execute('SELECT user_id, location FROM issues WHERE id = ?', (item_id,)).fetchone()
+                conn.execute('DELETE FROM issues WHERE id = ?', (item_id,))
+                # The files go with the next retention sweep once nothing refers to them
+                conn.execute('DELETE FROM maintenance_photos WHERE issue_id = ?', (item_id,))
+                if issue:
+                    notifications.notify(conn, issue['user_id'], 'Issue Update',
+                                         f'Your issue at {issue["location"]} was closed by an administrator', 'issue')
+            elif item_type == 'booking':
+                booking = conn.execute('SELECT user_id, booking_date FROM bookings WHERE id = ?', (item_id,)).fetchone()
+                conn.execute('DELETE FROM bookings WHERE id = ?', (item_id,))
+                if booking:
+                    notifications.notify(conn, booking['user_id'], 'Room Booking',
+                                         f'Your room booking on {booking["booking_date"]} was cancelled', 'booking')
+            elif item_type == 'menu':
+                conn.execute('DELETE FROM canteen_menu WHERE id = ?', (item_id,))
+                cache.invalidate('canteen_menu')
+            elif item_type == 'route':
+                conn.execute('DELETE FROM bus_routes WHERE id = ?', (item_id,))
+                cache.invalidate('bus_routes')
+            elif item_type == 'washroom':
+                conn.execute('DELETE FROM washroom_status WHERE id = ?', (item_id,))
+                cache.invalidate('washroom_status')
         
-        conn.commit()
         flash(f'{item_type.title()} deleted successfully!', 'success')
     except Exception as e:
         flash(f'Error deleting {item_type}: {str(e)}', 'error')
-    finally:
-        conn.close()
     
     return redirect(request.referrer or url_for('dashboard'))
 
 # Photo upload for washroom maintenance
-@app.route('/upload_photo/<int:issue_id>', methods=['GET', 'POST'])
+@route('/upload_photo/<int:issue_id>', methods=['GET', 'POST'])
+@sessions.login_required()
 def upload_photo(issue_id):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
     if request.method == 'POST':
         if 'photo' not in request.files:
             flash('No file selected', 'error')
@@ -738,51 +642,130 @@ def upload_photo(issue_id):
             return redirect(request.url)
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(f"maintenance_{issue_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}")
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            extension = file.filename.rsplit('.', 1)[1].lower()
+            try:
+                filename, digest, size, _ = uploads.save_stream(
+                    file.stream, current_app.config['UPLOAD_FOLDER'], extension, current_app.config['UPLOAD_MAX_BYTES'])
+            except uploads.UploadTooLarge as e:
+                flash(str(e), 'error')
+                return redirect(request.url)
             
-            conn = get_db_connection()
-            conn.execute('''
-                INSERT INTO maintenance_photos (issue_id, photo_path, uploaded_by)
-                VALUES (?, ?, ?)
-            ''', (issue_id, filename, session['user_id']))
-            conn.commit()
-            conn.close()
+            with transaction() as conn:
+                # The same image uploaded before already has its thumbnails
+                done = conn.execute('''
+                    SELECT width, height, thumb_path, preview_path FROM maintenance_photos
+                    WHERE content_hash = ? AND thumb_status = 'ready' LIMIT 1
+                ''', (digest,)).fetchone()
+                if done:
+                    derived = (done['width'], done['height'], done['thumb_path'], done['preview_path'], 'ready')
+                elif uploads.Image is not None:
+                    derived = (None, None, None, None, 'pending')
+                else:
+                    derived = (None, None, None, None, 'unavailable')
+                conn.execute('''
+                    INSERT INTO maintenance_photos (issue_id, photo_path, uploaded_by, content_hash, size_bytes,
+                                                    width, height, thumb_path, preview_path, thumb_status)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (issue_id, filename, session['user_id'], digest, size) + derived)
+            
+            if derived[-1] == 'pending':
+                uploads.schedule_derivatives(current_app.config['DATABASE'], current_app.config['UPLOAD_FOLDER'], filename, digest,
+                                             workers=current_app.config['THUMBNAIL_WORKERS'])
             
             flash('Photo uploaded successfully!', 'success')
             return redirect(url_for('report_issue'))
     
-    conn = get_db_connection()
+    conn = get_db()
     issue = conn.execute('SELECT * FROM issues WHERE id = ?', (issue_id,)).fetchone()
     photos = conn.execute('SELECT * FROM maintenance_photos WHERE issue_id = ?', (issue_id,)).fetchall()
-    conn.close()
     
     return render_template('upload_photo.html', issue=issue, photos=photos)
 
-# API for camera feed status
-@app.route('/api/camera_status')
-def camera_status():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'})
-    
-    conn = get_db_connection()
-    feeds = conn.execute('SELECT * FROM camera_feeds WHERE status = "active"').fetchall()
-    conn.close()
-    
-    return jsonify([dict(feed) for feed in feeds])
-
-# API for AI alert status
-@app.route('/api/ai_alert_status')
-def ai_alert_status():
-    if 'user_id' not in session:
-        return jsonify({'error': 'Unauthorized'})
-    
-    conn = get_db_connection()
-    alerts = conn.execute('SELECT * FROM ai_alerts WHERE status = "active"').fetchall()
-    conn.close()
-    
-    return jsonify([dict(alert) for alert in alerts])
+# Uploaded photos and thumbnails. File names are content hashes (or carry an
+# upload timestamp for older photos), so they never change and can be cached
+# by browsers for a year.
+@route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    upload_dir = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+    accel_prefix = current_app.config['UPLOAD_ACCEL_REDIRECT']
+    if accel_prefix:
+        # nginx serves the body (and any Range request) from its internal location
+        path = safe_join(upload_dir, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + filename
+        response.cache_control.max_age = 31536000
+    else:
+        # Honours USE_X_SENDFILE, conditional GETs and Range requests
+        response = send_from_directory(upload_dir, filename, max_age=31536000)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def request_too_large(e):
+    flash('Upload is too large.', 'error')
+    return redirect(request.url)
+
+def create_app(config=None):
+    """Build and configure the application. Nothing here touches the database:
+    use `flask init-db` (or `flask db upgrade` + `flask seed`) to prepare it.
+    """
+    app = Flask(__name__)
+    app.secret_key = 'your-secret-key-here'
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    # Requests larger than this are rejected before the body is read
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    app.config['UPLOAD_MAX_BYTES'] = 5 * 1024 * 1024
+    app.config['THUMBNAIL_WORKERS'] = 2
+    # Let the front-end server send upload files: Apache/lighttpd read X-Sendfile,
+    # nginx reads X-Accel-Redirect and needs an internal location for the prefix,
+    # e.g. CAMPUS_UPLOADS_ACCEL=/protected-uploads/
+    app.config['USE_X_SENDFILE'] = os.environ.get('CAMPUS_X_SENDFILE') == '1'
+    app.config['UPLOAD_ACCEL_REDIRECT'] = os.environ.get('CAMPUS_UPLOADS_ACCEL')
+    # Server-sent notification stream timing (seconds). Pages only open the stream
+    # when NOTIFY_STREAM is on, which asgi.py does: under a WSGI server every open
+    # stream holds a worker thread, so pages poll /api/notifications instead
+    app.config['NOTIFY_STREAM'] = False
+    app.config['NOTIFY_STREAM_HEARTBEAT'] = 15
+    app.config['NOTIFY_STREAM_RESYNC'] = 60
+    # Before the subsystems fill in their defaults, so they see the overrides
+    if config:
+        app.config.update(config)
+
+    db.init_app(app)
+    instrumentation.init_app(app)
+    cache.init_app(app)
+    migrations.init_app(app)
+    stats.init_app(app)
+    assets.init_app(app)
+    occupancy.init_app(app)
+    noise.init_app(app)
+    bulk.init_app(app)
+    announcements.init_app(app)
+    availability.init_app(app)
+    receipts.init_app(app)
+    timetable.init_app(app)
+    issue_queue.init_app(app)
+    search.init_app(app)
+    retention.init_app(app)
+    backup.init_app(app)
+    sessions.init_app(app)
+
+    for rule, view, options in ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    app.register_error_handler(413, request_too_large)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(seed_command)
+
+    # Create upload folder if it doesn't exist
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    return app
 
 if __name__ == '__main__':
+    app = create_app()
+    # The development server prepares its own database; production workers
+    # expect `flask init-db` to have been run once beforehand.
+    with app.app_context():
+        init_db()
     app.run(debug=True) 
\ No newline at end of file
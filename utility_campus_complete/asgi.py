@@ -0,0 +1,263 @@
+import argparse
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from werkzeug.http import parse_etags, quote_etag
+from werkzeug.wrappers import Request
+
+import noise
+import notifications
+import occupancy
+import receipts
+from app import create_app
+from db import get_db
+
+# Optional: ASGI deployments need a2wsgi (WSGI fallback) and uvicorn (server)
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    WSGIMiddleware = None
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+# ASGI serving mode.
+#
+# One event loop per worker process serves the notification stream and the
+# polling endpoints directly:
+#
+#   /api/notifications/stream  server-sent events, an asyncio task per client
+#   /api/notifications         unread list with ETag/304
+#   /api/camera_status         seat occupancy snapshot
+#   /api/ai_alert_status       noise levels and alerts
+#
+# An idle stream is a suspended coroutine plus its broker subscription: no
+# thread and no database connection, so a worker can hold tens of thousands.
+# Database work (stream start and resync, unread lists) runs inside an app
+# context on a bounded thread pool (CAMPUS_ASGI_DB_THREADS, default
+# DB_POOL_SIZE), never on the loop. The camera and noise payloads are
+# prebuilt bytes in this process's monitors and are sent straight from the
+# loop.
+#
+# Every other path goes to the Flask app through a2wsgi on its own pool of
+# CAMPUS_WSGI_THREADS (default 16) threads, so pages, forms and the admin API
+# behave exactly as under a WSGI server, instrumentation included. The paths
+# served here skip Flask's request hooks but open the same sessions, on the
+# database pool since a session cache miss reads user_sessions.
+#
+# Workers are separate processes, each with its own loop, thread pools,
+# connection pool, monitors and pub/sub broker; streams pick up rows written
+# by other workers on their NOTIFY_STREAM_RESYNC check.
+#
+#   python asgi.py --workers 4 --port 8000
+#   gunicorn asgi:application -k uvicorn.workers.UvicornWorker -w 4 -b 0.0.0.0:8000
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def send_response(send, status, body=b'', content_type='application/json', headers=()):
+    raw_headers = [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]
+    raw_headers += [(key.encode(), value.encode()) for key, value in headers]
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class CampusASGI:
+    def __init__(self, flask_app, db_threads=None, wsgi_threads=None):
+        if WSGIMiddleware is None:
+            raise RuntimeError('ASGI mode needs a2wsgi and uvicorn: pip install a2wsgi uvicorn')
+        self.flask_app = flask_app
+        # Streams are cheap here, so pages may open them
+        flask_app.config['NOTIFY_STREAM'] = True
+        self.db_threads = db_threads or flask_app.config['DB_POOL_SIZE']
+        self.wsgi = WSGIMiddleware(flask_app, workers=wsgi_threads or 16)
+        self.routes = {
+            '/api/notifications/stream': self.notification_stream,
+            '/api/notifications': self.notifications,
+            '/api/camera_status': self.camera_status,
+            '/api/ai_alert_status': self.ai_alert_status,
+        }
+        self._executor = None
+        self._executor_pid = None
+
+    @property
+    def executor(self):
+        # Created in the worker process, after any fork
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.db_threads, thread_name_prefix='asgi-db')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        route = self.routes.get(scope['path']) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+        if route is None:
+            await self.wsgi(scope, receive, send)
+            return
+        await route(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    # Start this worker's monitors before the first poll needs them
+                    await self.run(self.start_monitors)
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def start_monitors(self):
+        occupancy.get_monitor()
+        noise.start_monitor()
+
+    def _call(self, fn, args):
+        with self.flask_app.app_context():
+            return fn(*args)
+
+    async def run(self, fn, *args):
+        """Call fn(*args) inside an app context on the database thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, fn, args)
+
+    async def run_with_db(self, fn):
+        return await self.run(lambda: fn(get_db()))
+
+    def load_session(self, scope):
+        # The app's own session interface, so the cookie is read exactly as Flask reads it;
+        # call through run(), it may query user_sessions
+        environ = {'REQUEST_METHOD': 'GET', 'SERVER_NAME': 'asgi', 'SERVER_PORT': '0', 'wsgi.url_scheme': 'http'}
+        cookie = header(scope, b'cookie')
+        if cookie:
+            environ['HTTP_COOKIE'] = cookie
+        return self.flask_app.session_interface.open_session(self.flask_app, Request(environ)) or {}
+
+    def unauthorized(self, send, status=401):
+        return send_response(send, status, b'{"error":"Unauthorized"}\n')
+
+    async def notifications(self, scope, receive, send):
+        session = await self.run(self.load_session, scope)
+        if 'user_id' not in session:
+            await send_response(send, 200, b'[]\n')
+            return
+        if_none_match = parse_etags(header(scope, b'if-none-match'))
+
+        def unread():
+            etag, load = receipts.poll(get_db(), session['user_id'])
+            if if_none_match.contains(etag):
+                return etag, None
+            return etag, self.flask_app.json.dumps(load()).encode() + b'\n'
+
+        etag, body = await self.run(unread)
+        headers = (('etag', quote_etag(etag)), ('cache-control', 'private, no-cache'))
+        if body is None:
+            await send({'type': 'http.response.start', 'status': 304,
+                        'headers': [(key.encode(), value.encode()) for key, value in headers]})
+            await send({'type': 'http.response.body', 'body': b''})
+        else:
+            await send_response(send, 200, body, headers=headers)
+
+    async def notification_stream(self, scope, receive, send):
+        session = await self.run(self.load_session, scope)
+        if 'user_id' not in session:
+            await self.unauthorized(send)
+            return
+        last_event_id = header(scope, b'last-event-id') or \
+            parse_qs(scope['query_string'].decode('latin-1')).get('last_event_id', [None])[0]
+        chunks = notifications.astream(
+            self.run_with_db, session['user_id'],
+            last_event_id=int(last_event_id) if last_event_id and last_event_id.isdigit() else None,
+            heartbeat=self.flask_app.config['NOTIFY_STREAM_HEARTBEAT'],
+            resync_interval=self.flask_app.config['NOTIFY_STREAM_RESYNC'],
+        )
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+
+        async def pump():
+            async for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+
+        # End the stream as soon as the client goes away, not at the next heartbeat
+        streaming = asyncio.ensure_future(pump())
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        done = ()
+        try:
+            done, _ = await asyncio.wait((streaming, disconnected), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            streaming.cancel()
+            disconnected.cancel()
+            await asyncio.gather(streaming, disconnected, return_exceptions=True)
+            await chunks.aclose()
+        if streaming in done:
+            # The stream ended on its own (slow subscriber dropped); the client reconnects
+            streaming.result()
+            await send({'type': 'http.response.body', 'body': b''})
+
+    async def camera_status(self, scope, receive, send):
+        if 'user_id' not in await self.run(self.load_session, scope):
+            await self.unauthorized(send)
+            return
+        with self.flask_app.app_context():
+            body = occupancy.get_monitor().payload()
+        await send_response(send, 200, body)
+
+    async def ai_alert_status(self, scope, receive, send):
+        if 'user_id' not in await self.run(self.load_session, scope):
+            await self.unauthorized(send)
+            return
+        with self.flask_app.app_context():
+            body = noise.get_monitor().payload() if noise.enabled() else None
+        if body is None:
+            await send_response(send, 503, b'{"error":"Noise monitoring is not running"}\n')
+            return
+        await send_response(send, 200, body)
+
+
+application = CampusASGI(
+    create_app(),
+    db_threads=int(os.environ.get('CAMPUS_ASGI_DB_THREADS', 0)) or None,
+    wsgi_threads=int(os.environ.get('CAMPUS_WSGI_THREADS', 0)) or None,
+) if WSGIMiddleware is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the campus app with uvicorn.')
+    parser.add_argument('--host', default=os.environ.get('CAMPUS_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('CAMPUS_PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('CAMPUS_WORKERS', 1)))
+    args = parser.parse_args()
+    if uvicorn is None or application is None:
+        sys.exit('ASGI mode needs a2wsgi and uvicorn: pip install a2wsgi uvicorn')
+    # Worker processes import asgi:application themselves
+    uvicorn.run('asgi:application', app_dir=APP_DIR, host=args.host, port=args.port, workers=args.workers,
+                lifespan='on', proxy_headers=True, backlog=4096, timeout_graceful_shutdown=5)
+
+
+if __name__ == '__main__':
+    main()
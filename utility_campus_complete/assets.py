@@ -0,0 +1,241 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import urllib.request
+from urllib.parse import urljoin
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip variants are always written
+    brotli = None
+
+# Static asset pipeline.
+#
+# Third-party CSS/JS is vendored under static/vendor/ instead of being loaded
+# from CDNs the campus network cannot reach. `flask assets build` concatenates
+# each bundle, names it by a hash of its contents (app.3f9c1e2a.css), copies
+# the fonts and images its CSS refers to under hashed names too, and writes
+# gzip (and brotli, when available) variants next to it. Templates call
+# asset_url('app.css'); since a changed file gets a new name, /assets/ can tell
+# browsers to cache everything for a year.
+
+# static/vendor path -> upstream URL; CSS url() references are fetched as well
+VENDOR_FILES = {
+    'bootstrap/bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css',
+    'bootstrap/bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js',
+    'fontawesome/css/all.min.css': 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css',
+}
+
+# bundle name -> files under static/, in order
+BUNDLES = {
+    'app.css': ['vendor/bootstrap/bootstrap.min.css', 'vendor/fontawesome/css/all.min.css', 'css/campus.css'],
+    'app.js': ['vendor/bootstrap/bootstrap.bundle.min.js'],
+}
+
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 10
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ttf', '.eot', '.json')
+MAX_AGE = 365 * 24 * 3600
+
+CSS_URL_RE = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+SOURCE_MAP_RE = re.compile(r'/[*/]# sourceMappingURL=[^\n]*')
+
+_manifest = None
+_manifest_mtime = None
+
+
+def is_relative(url):
+    return not url.startswith(('data:', 'http:', 'https:', '//', '#', '/'))
+
+
+def css_references(css):
+    return [url for _, url in CSS_URL_RE.findall(css) if is_relative(url)]
+
+
+def split_url(url):
+    """Return (path, suffix) where suffix is any ?query or #fragment."""
+    cut = min([i for i in (url.find('?'), url.find('#')) if i >= 0], default=len(url))
+    return url[:cut], url[cut:]
+
+
+def fingerprint(name, content):
+    root, ext = posixpath.splitext(posixpath.basename(name))
+    return f'{root}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.part'
+    with open(temp_path, 'wb') as out:
+        out.write(content)
+    os.replace(temp_path, path)
+
+
+def write_compressed(path, content):
+    write_file(path, content)
+    if not path.endswith(COMPRESSIBLE):
+        return
+    write_file(path + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_file(path + '.br', brotli.compress(content))
+
+
+def fetch(url, source_dir=None, relative=None):
+    if source_dir is not None:
+        with open(os.path.join(source_dir, relative), 'rb') as f:
+            return f.read()
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.read()
+
+
+def vendor(static_dir, source_dir=None):
+    """Fetch VENDOR_FILES (and the files their CSS references) into static/vendor.
+
+    With source_dir the files are copied from a local mirror laid out like
+    static/vendor instead of being downloaded. Returns the paths written.
+    """
+    written = []
+    vendor_dir = os.path.join(static_dir, 'vendor')
+    for relative, url in VENDOR_FILES.items():
+        content = fetch(url, source_dir, relative)
+        write_file(os.path.join(vendor_dir, relative), content)
+        written.append(relative)
+        if not relative.endswith('.css'):
+            continue
+        for reference in sorted(set(css_references(content.decode('utf-8')))):
+            path, _ = split_url(reference)
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(relative), path))
+            if target in written:
+                continue
+            write_file(os.path.join(vendor_dir, target),
+                       fetch(urljoin(url, path), source_dir, target))
+            written.append(target)
+    return written
+
+
+def rewrite_css(css, css_path, static_dir, dist_dir, copied):
+    """Point url() references at fingerprinted copies in dist_dir."""
+    def replace(match):
+        quote, url = match.groups()
+        if not is_relative(url):
+            return match.group(0)
+        path, suffix = split_url(url)
+        source = os.path.normpath(os.path.join(static_dir, os.path.dirname(css_path), path))
+        if source not in copied:
+            with open(source, 'rb') as f:
+                content = f.read()
+            name = fingerprint(path, content)
+            write_compressed(os.path.join(dist_dir, name), content)
+            copied[source] = name
+        return f'url({quote}{copied[source]}{suffix}{quote})'
+    return CSS_URL_RE.sub(replace, css)
+
+
+def build(static_dir, dist_dir):
+    """Build every bundle into dist_dir; returns the manifest."""
+    manifest = {}
+    copied = {}
+    for bundle, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(static_dir, source), encoding='utf-8') as f:
+                text = SOURCE_MAP_RE.sub('', f.read())
+            if bundle.endswith('.css'):
+                text = rewrite_css(text, source, static_dir, dist_dir, copied)
+            parts.append(f'/* {source} */\n{text.strip()}\n')
+        content = '\n'.join(parts).encode('utf-8')
+        name = fingerprint(bundle, content)
+        write_compressed(os.path.join(dist_dir, name), content)
+        manifest[bundle] = name
+    write_file(os.path.join(dist_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def dist_dir():
+    return os.path.join(current_app.static_folder, 'dist')
+
+
+def load_manifest():
+    global _manifest, _manifest_mtime
+    path = os.path.join(dist_dir(), MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        _manifest, _manifest_mtime = {}, None
+        return _manifest
+    # Re-read only when a build replaced the file
+    if mtime != _manifest_mtime:
+        with open(path, encoding='utf-8') as f:
+            _manifest = json.load(f)
+        _manifest_mtime = mtime
+    return _manifest
+
+
+def asset_url(name):
+    """URL of the built bundle for name, or None if `flask assets build` has not run."""
+    built = load_manifest().get(name)
+    if built is None:
+        return None
+    return f'{current_app.config["ASSETS_URL"]}/{built}'
+
+
+def serve_asset(filename):
+    directory = dist_dir()
+    mimetype = mimetypes.guess_type(filename)[0]
+    encodings = request.accept_encodings
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encodings[encoding] and os.path.isfile(os.path.join(directory, filename + suffix)):
+            response = send_from_directory(directory, filename + suffix, mimetype=mimetype, max_age=MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(directory, filename, mimetype=mimetype, max_age=MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+assets_cli = AppGroup('assets', help='Static asset commands.')
+
+
+@assets_cli.command('vendor')
+@click.option('--source', type=click.Path(exists=True, file_okay=False),
+              help='Copy from a local mirror of static/vendor instead of downloading.')
+def vendor_command(source):
+    """Fetch third-party CSS, JS and fonts into static/vendor."""
+    for relative in vendor(current_app.static_folder, source):
+        click.echo(f'vendor/{relative}')
+
+
+@assets_cli.command('build')
+@click.option('--clean', is_flag=True, help='Remove files from earlier builds.')
+def build_command(clean):
+    """Bundle, fingerprint and precompress static assets into static/dist."""
+    target = dist_dir()
+    if clean and os.path.isdir(target):
+        shutil.rmtree(target)
+    try:
+        manifest = build(current_app.static_folder, target)
+    except FileNotFoundError as exc:
+        raise click.ClickException(f'{exc.filename} is missing; run `flask assets vendor` first.')
+    for bundle, name in sorted(manifest.items()):
+        click.echo(f'{bundle} -> dist/{name}')
+    if brotli is None:
+        click.echo('brotli is not installed; only gzip variants were written.')
+
+
+def init_app(app):
+    app.config.setdefault('ASSETS_URL', '/assets')
+    app.add_url_rule(f'{app.config["ASSETS_URL"]}/<path:filename>', 'asset', serve_asset)
+    app.add_template_global(asset_url)
+    app.cli.add_command(assets_cli)
@@ -0,0 +1,231 @@
+from datetime import datetime
+
+from flask import jsonify, request
+
+import bookings
+import cache
+import sessions
+from db import get_db
+
+# Faculty availability engine.
+#
+# teacher_availability holds one row per (teacher, day, start) (schema
+# version 10), with day_ordinal/start_min/end_min generated columns so a
+# week lists Monday to Sunday in time order. For "who is free" lookups the
+# rows are folded into an in-memory bitmap index of 15-minute slots: each
+# teacher gets a 672-bit weekly bitmap of the slots they are free in
+# (covered by an 'available' row and not by a 'busy' or 'unavailable' one),
+# and each slot gets a bitset of the teachers free in it. A query ANDs the
+# bitsets of the slots in its window, so its cost depends on the window
+# length, not on how many rows or teachers there are.
+#
+# The index is kept in the reference cache under the teacher_availability
+# table version, so saving a slot in any worker rebuilds it on next use.
+
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+STATUSES = ('available', 'busy', 'unavailable')
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+SLOTS_PER_WEEK = 7 * SLOTS_PER_DAY
+
+
+class InvalidAvailability(ValueError):
+    pass
+
+
+def day_ordinal(day):
+    for i, name in enumerate(DAYS):
+        if name.lower() == (day or '').strip().lower():
+            return i
+    raise InvalidAvailability(f'Unknown day: {day!r}')
+
+
+def parse_window(day, start_time, end_time):
+    """(day ordinal, start minute, end minute) from form or query values."""
+    try:
+        start, end = bookings.to_interval(start_time, end_time)
+    except bookings.InvalidBooking as e:
+        raise InvalidAvailability(str(e))
+    return day_ordinal(day), start, end
+
+
+def slot_range(day, start, end, inner):
+    """Week slot indexes for a day's [start, end) minutes.
+
+    inner=True keeps only slots the interval covers completely (used for
+    availability), inner=False every slot it touches (used for busy rows
+    and query windows).
+    """
+    if inner:
+        first, last = -(-start // SLOT_MINUTES), end // SLOT_MINUTES
+    else:
+        first, last = start // SLOT_MINUTES, -(-end // SLOT_MINUTES)
+    base = day * SLOTS_PER_DAY
+    return range(base + first, base + max(first, last))
+
+
+def mask(slots):
+    if not slots:
+        return 0
+    return ((1 << len(slots)) - 1) << slots.start
+
+
+class AvailabilityIndex:
+    def __init__(self, rows):
+        free, blocked = {}, {}
+        for row in rows:
+            target = free if row['status'] == 'available' else blocked
+            slots = slot_range(row['day_ordinal'], row['start_min'], row['end_min'], inner=target is free)
+            target[row['teacher_id']] = target.get(row['teacher_id'], 0) | mask(slots)
+        self.weekly = {teacher: bits & ~blocked.get(teacher, 0) for teacher, bits in free.items()}
+        self.teachers = sorted(self.weekly)
+        self.by_slot = [0] * SLOTS_PER_WEEK
+        for position, teacher in enumerate(self.teachers):
+            bits = self.weekly[teacher]
+            while bits:
+                low = bits & -bits
+                self.by_slot[low.bit_length() - 1] |= 1 << position
+                bits ^= low
+
+    def free(self, day, start, end):
+        """Teacher ids free for the whole of [start, end) on day."""
+        slots = slot_range(day, start, end, inner=False)
+        if not slots:
+            return []
+        matched = -1
+        for slot in slots:
+            matched &= self.by_slot[slot]
+            if not matched:
+                return []
+        found = []
+        while matched:
+            low = matched & -matched
+            found.append(self.teachers[low.bit_length() - 1])
+            matched ^= low
+        return found
+
+    def free_until(self, teacher, day, start):
+        """Minute of the day the teacher stops being free, from start."""
+        bits = self.weekly.get(teacher, 0)
+        slot = day * SLOTS_PER_DAY + start // SLOT_MINUTES
+        end_of_day = (day + 1) * SLOTS_PER_DAY
+        while slot < end_of_day and bits >> slot & 1:
+            slot += 1
+        return (slot - day * SLOTS_PER_DAY) * SLOT_MINUTES
+
+    def schedule(self, teacher):
+        """[(day ordinal, start minute, end minute)] free intervals in week order."""
+        bits = self.weekly.get(teacher, 0)
+        intervals = []
+        slot = 0
+        while bits >> slot:
+            if bits >> slot & 1:
+                first = slot
+                while bits >> slot & 1 and slot < (first // SLOTS_PER_DAY + 1) * SLOTS_PER_DAY:
+                    slot += 1
+                day = first // SLOTS_PER_DAY
+                intervals.append((day, (first % SLOTS_PER_DAY) * SLOT_MINUTES,
+                                  (slot - day * SLOTS_PER_DAY) * SLOT_MINUTES))
+            else:
+                slot += 1
+        return intervals
+
+
+def load_index(conn):
+    rows = conn.execute('''
+        SELECT teacher_id, day_ordinal, start_min, end_min, status FROM teacher_availability
+        WHERE day_ordinal IS NOT NULL AND end_min > start_min
+    ''').fetchall()
+    return AvailabilityIndex(rows)
+
+
+def get_index(conn):
+    return cache.get_cache().get_or_load(('availability-index',), ('teacher_availability',),
+                                         lambda: load_index(conn))
+
+
+def save(conn, teacher_id, day, start_time, end_time, status):
+    """Insert or update the teacher's slot starting at start_time, inside the caller's transaction."""
+    day_number, start, end = parse_window(day, start_time, end_time)
+    if status not in STATUSES:
+        raise InvalidAvailability(f'Unknown status: {status!r}')
+    conn.execute('''
+        INSERT INTO teacher_availability (teacher_id, day_of_week, start_time, end_time, status)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (teacher_id, day_of_week, start_time)
+        DO UPDATE SET end_time = excluded.end_time, status = excluded.status
+    ''', (teacher_id, DAYS[day_number], bookings.format_minutes(start), bookings.format_minutes(end), status))
+    cache.invalidate('teacher_availability')
+
+
+def week(conn, teacher_id=None):
+    """Availability rows Monday to Sunday; every faculty member's when teacher_id is None."""
+    if teacher_id is not None:
+        return conn.execute('''
+            SELECT * FROM teacher_availability WHERE teacher_id = ?
+            ORDER BY day_ordinal, start_min
+        ''', (teacher_id,)).fetchall()
+    return conn.execute('''
+        SELECT ta.*, u.username FROM teacher_availability ta
+        JOIN users u ON ta.teacher_id = u.id
+        WHERE u.role = 'faculty'
+        ORDER BY u.username, ta.day_ordinal, ta.start_min
+    ''').fetchall()
+
+
+def faculty_names(conn, teacher_ids):
+    if not teacher_ids:
+        return {}
+    placeholders = ', '.join('?' for _ in teacher_ids)
+    return {row['id']: row['username'] for row in conn.execute(
+        f"SELECT id, username FROM users WHERE role = 'faculty' AND id IN ({placeholders})", teacher_ids)}
+
+
+@sessions.login_required('faculty', 'student', 'admin', api=True)
+def free_faculty():
+
+    # Default: the current 15-minute slot
+    now = datetime.now()
+    now_min = now.hour * 60 + now.minute
+    day = request.args.get('day') or DAYS[now.weekday()]
+    start_time = request.args.get('start') or bookings.format_minutes(now_min)
+    end_time = request.args.get('end') or bookings.format_minutes(
+        min(24 * 60, (now_min // SLOT_MINUTES + 1) * SLOT_MINUTES))
+    try:
+        day_number, start, end = parse_window(day, start_time, end_time)
+    except InvalidAvailability as e:
+        return jsonify({'error': str(e)}), 400
+
+    conn = get_db()
+    index = get_index(conn)
+    teacher_ids = index.free(day_number, start, end)
+    names = faculty_names(conn, teacher_ids)
+    faculty = sorted(({'id': teacher_id, 'username': names[teacher_id],
+                       'free_until': bookings.format_minutes(index.free_until(teacher_id, day_number, start))}
+                      for teacher_id in teacher_ids if teacher_id in names),
+                     key=lambda item: item['username'])
+    return jsonify({
+        'day': DAYS[day_number],
+        'start': bookings.format_minutes(start),
+        'end': bookings.format_minutes(end),
+        'count': len(faculty),
+        'faculty': faculty,
+    })
+
+
+@sessions.login_required('faculty', 'student', 'admin', api=True)
+def faculty_schedule(teacher_id):
+    conn = get_db()
+    if not faculty_names(conn, [teacher_id]):
+        return jsonify({'error': 'Unknown faculty member'}), 404
+    intervals = get_index(conn).schedule(teacher_id)
+    return jsonify({
+        'teacher_id': teacher_id,
+        'free': [{'day': DAYS[day], 'start': bookings.format_minutes(start), 'end': bookings.format_minutes(end)}
+                 for day, start, end in intervals],
+    })
+
+
+def init_app(app):
+    app.add_url_rule('/api/faculty/free', 'free_faculty', free_faculty)
+    app.add_url_rule('/api/faculty/<int:teacher_id>/availability', 'faculty_schedule', faculty_schedule)
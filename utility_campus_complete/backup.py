@@ -0,0 +1,404 @@
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+import db
+import migrations
+import stats
+
+try:
+    import fcntl
+except ImportError:  # Windows: every worker refreshes the snapshot on its own schedule
+    fcntl = None
+
+# Online backups and the read-only reporting snapshot.
+#
+# copy_database() copies campus.db with the SQLite backup API,
+# BACKUP_PAGES pages per step (sleeping BACKUP_PAUSE seconds between steps
+# to leave disk bandwidth to requests). The source connection holds one
+# read transaction for the whole copy: in WAL mode that never blocks
+# writers, and it pins the copy to a single point in time. Without it the
+# backup API restarts from the first page whenever another connection
+# commits, which under steady writes means it never finishes. The WAL
+# cannot be checkpointed past that point until the copy ends, so it grows
+# by whatever is written meanwhile. The copy is written to <path>.part,
+# switched to rollback journaling, synced and renamed into place, with a
+# <path>.json manifest of the schema version, size and row count of every
+# table as of the snapshot.
+#
+# verify() is the restore check: it opens a copy read-only and runs
+# integrity_check (quick_check with quick=True), then compares the schema
+# version and row counts with the manifest and recounts the dashboard
+# counters. `flask backup restore` only copies a backup over the database
+# after it passes, and verifies the result again.
+#
+# With SNAPSHOT_PATH set, one worker at a time (a lock file next to the
+# snapshot) refreshes it every SNAPSHOT_INTERVAL seconds the same way.
+# Exports read from it through export_reader(): the file is replaced by a
+# rename, never changed in place, so readers open it immutable, without
+# locks or a shared-memory file, and keep reading the copy they opened.
+# A snapshot older than SNAPSHOT_MAX_AGE, or at another schema version
+# than the code, is skipped in favour of the live database.
+
+MANIFEST_SUFFIX = '.json'
+SNAPSHOT_PRAGMAS = tuple((name, value) for name, value in db.CONNECTION_PRAGMAS
+                         if name in ('mmap_size', 'cache_size', 'temp_store'))
+POLL_SECONDS = 30.0
+
+logger = logging.getLogger(__name__)
+
+
+class BackupFailed(Exception):
+    pass
+
+
+def table_counts(conn):
+    # Virtual tables are skipped: an FTS index counts its content table's rows
+    tables = [row[0] for row in conn.execute('''
+        SELECT name FROM sqlite_master
+        WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND sql NOT LIKE 'CREATE VIRTUAL TABLE%'
+        ORDER BY name
+    ''')]
+    return {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+
+
+def manifest_path(path):
+    return path + MANIFEST_SUFFIX
+
+
+def read_manifest(path):
+    try:
+        with open(manifest_path(path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def sync_rename(source, target):
+    with open(source, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(source, target)
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(os.path.dirname(os.path.abspath(target)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def copy_database(database, path, pages=4096, pause=0.0, counts=True, progress=None):
+    """Copy database to path online, as of one point in time; returns the manifest."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    part = path + '.part'
+    for leftover in (part, part + '-journal', part + '-wal', part + '-shm'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    started = time.perf_counter()
+    source = db.connect(database)
+    try:
+        # The read transaction starts with the first read and lasts until COMMIT
+        source.execute('BEGIN')
+        manifest = {
+            'created_at': db.utc_timestamp(),
+            'source': os.path.abspath(database),
+            'user_version': source.execute('PRAGMA user_version').fetchone()[0],
+            'page_size': source.execute('PRAGMA page_size').fetchone()[0],
+            'pages': source.execute('PRAGMA page_count').fetchone()[0],
+        }
+        if counts:
+            manifest['tables'] = table_counts(source)
+        target = sqlite3.connect(part, isolation_level=None)
+        try:
+            def step(status, remaining, total):
+                if progress is not None:
+                    progress(total - remaining, total)
+                if pause and remaining:
+                    time.sleep(pause)
+            source.backup(target, pages=pages, progress=step)
+            # The copied header says WAL; a standalone file is easier to ship and to open read-only
+            target.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            target.close()
+        source.execute('COMMIT')
+    finally:
+        source.close()
+    sync_rename(part, path)
+    manifest['bytes'] = os.path.getsize(path)
+    manifest['seconds'] = round(time.perf_counter() - started, 3)
+    with open(manifest_path(path), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def open_readonly(path, immutable=False):
+    mode = 'immutable=1' if immutable else 'mode=ro'
+    return db.connect(f'file:{quote(os.path.abspath(path))}?{mode}', SNAPSHOT_PRAGMAS, uri=True)
+
+
+def verify(path, manifest=None, quick=False):
+    """Check a copy against its manifest; returns a list of problems (empty when it is sound)."""
+    if manifest is None:
+        manifest = read_manifest(path)
+    if not os.path.isfile(path):
+        return [f'{path} does not exist']
+    problems = []
+    conn = open_readonly(path)
+    try:
+        try:
+            result = [row[0] for row in conn.execute('PRAGMA quick_check' if quick else 'PRAGMA integrity_check')]
+        except sqlite3.DatabaseError as e:
+            return [f'not a readable database: {e}']
+        if result != ['ok']:
+            return [f'integrity: {line}' for line in result[:20]]
+        if manifest is None:
+            problems.append('no manifest; only the file structure was checked')
+        else:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != manifest['user_version']:
+                problems.append(f"schema version {version}, manifest says {manifest['user_version']}")
+            if 'tables' in manifest:
+                actual = table_counts(conn)
+                for table in sorted(set(actual) | set(manifest['tables'])):
+                    have, want = actual.get(table), manifest['tables'].get(table)
+                    if have != want:
+                        problems.append(f'{table}: {have} rows, manifest says {want}')
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'stats_counters'").fetchone():
+            for scope, key, stored, actual in stats.check(conn):
+                problems.append(f'counter {scope} [{key}]: stored {stored}, actual {actual}')
+    finally:
+        conn.close()
+    return problems
+
+
+def restore(path, database, pages=4096):
+    """Copy a verified backup over database, then verify the result; returns the manifest."""
+    manifest = read_manifest(path)
+    problems = verify(path, manifest)
+    if problems:
+        raise BackupFailed('; '.join(problems))
+    source = open_readonly(path)
+    target = db.connect(database)
+    try:
+        # Writers of the live database wait while the pages are replaced
+        source.backup(target, pages=pages)
+    finally:
+        source.close()
+        target.close()
+    problems = verify(database, manifest)
+    if problems:
+        raise BackupFailed('restored database failed verification: ' + '; '.join(problems))
+    return manifest
+
+
+def backup_name(directory, at=None):
+    return os.path.join(directory, f"campus-{(at or datetime.now(timezone.utc)).strftime('%Y%m%d-%H%M%S')}.db")
+
+
+def snapshot_age(path):
+    try:
+        return time.time() - os.path.getmtime(path)
+    except FileNotFoundError:
+        return None
+
+
+def refresh_snapshot(config, force=False):
+    """Rebuild the snapshot if it is due and no other worker is on it; returns the manifest, or None."""
+    path = config['SNAPSHOT_PATH']
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.lock', 'a') as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+        # Checked under the lock: another worker may have just finished one
+        age = snapshot_age(path)
+        if not force and age is not None and age < config['SNAPSHOT_INTERVAL']:
+            return None
+        return copy_database(config['DATABASE'], path, config['BACKUP_PAGES'], config['BACKUP_PAUSE'], counts=False)
+
+
+def open_snapshot(config):
+    """A read-only connection to a fresh enough snapshot, or None."""
+    path = config['SNAPSHOT_PATH']
+    if not path:
+        return None
+    age = snapshot_age(path)
+    if age is None or age > config['SNAPSHOT_MAX_AGE']:
+        return None
+    try:
+        conn = open_readonly(path, immutable=True)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+    except sqlite3.DatabaseError:
+        logger.exception('Could not open snapshot %s', path)
+        return None
+    if version != migrations.LATEST_VERSION:
+        conn.close()
+        return None
+    return conn
+
+
+class ExportReader:
+    """Read connection for work that outlives the request: the snapshot when usable, else a pooled one."""
+
+    def __init__(self, config, pool):
+        self.pool = pool
+        self.conn = open_snapshot(config)
+        self.snapshot_at = None
+        if self.conn is not None:
+            self.snapshot_at = db.utc_timestamp(datetime.fromtimestamp(
+                time.time() - snapshot_age(config['SNAPSHOT_PATH']), timezone.utc))
+
+    def __enter__(self):
+        if self.conn is None:
+            self.conn = self.pool.acquire()
+        return self.conn
+
+    def __exit__(self, *exc):
+        if self.snapshot_at is not None:
+            self.conn.close()
+        else:
+            self.pool.release(self.conn)
+        self.conn = None
+
+    def headers(self):
+        return {'X-Snapshot-At': self.snapshot_at} if self.snapshot_at else {}
+
+
+def export_reader():
+    return ExportReader(current_app.config, db.get_pool())
+
+
+class SnapshotRefresher:
+    def __init__(self, app, poll):
+        self.app = app
+        self.poll = poll
+        self.refreshes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='snapshot', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # First check right away, so a fresh deployment gets its snapshot early
+        while True:
+            try:
+                if refresh_snapshot(self.app.config) is not None:
+                    self.refreshes += 1
+            except Exception:
+                logger.exception('Snapshot refresh failed')
+            if self._stop.wait(self.poll):
+                return
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def start_snapshot_refresher():
+    """Start this worker's snapshot refresher, unless SNAPSHOT_PATH is unset or SNAPSHOT_INTERVAL is 0."""
+    global _refresher
+    app = current_app._get_current_object()
+    if not app.config['SNAPSHOT_PATH'] or not app.config['SNAPSHOT_INTERVAL']:
+        return
+    settings = (os.getpid(), app.config['DATABASE'], app.config['SNAPSHOT_PATH'])
+    if _refresher is None or _refresher.settings != settings:
+        with _refresher_lock:
+            if _refresher is None or _refresher.settings != settings:
+                if _refresher is not None:
+                    _refresher.stop()
+                refresher = SnapshotRefresher(app, min(POLL_SECONDS, app.config['SNAPSHOT_INTERVAL']))
+                refresher.settings = settings
+                refresher.start()
+                atexit.register(refresher.stop)
+                _refresher = refresher
+
+
+def echo_manifest(path, manifest):
+    rate = manifest['bytes'] / manifest['seconds'] / 1e6 if manifest['seconds'] else 0
+    click.echo(f"{path}: {manifest['bytes']} bytes at schema version {manifest['user_version']} "
+               f"in {manifest['seconds']:.1f}s ({rate:.0f} MB/s)")
+
+
+backup_cli = AppGroup('backup', help='Online backup, restore and snapshot commands.')
+
+
+@backup_cli.command('create')
+@click.argument('path', required=False)
+@click.option('--no-verify', is_flag=True, help='Skip checking the copy against its manifest.')
+def create_command(path, no_verify):
+    """Copy the live database to PATH (default: a timestamped file in BACKUP_DIR)."""
+    config = current_app.config
+    path = path or backup_name(config['BACKUP_DIR'])
+    manifest = copy_database(config['DATABASE'], path, config['BACKUP_PAGES'], config['BACKUP_PAUSE'])
+    echo_manifest(path, manifest)
+    if not no_verify:
+        problems = verify(path, manifest)
+        if problems:
+            raise click.ClickException('Backup failed verification: ' + '; '.join(problems))
+        click.echo(f"Verified: {len(manifest['tables'])} tables match the manifest.")
+
+
+@backup_cli.command('verify')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--quick', is_flag=True, help='quick_check instead of a full integrity_check.')
+def verify_command(path, quick):
+    """Check a backup's structure, row counts and counters against its manifest."""
+    problems = verify(path, quick=quick)
+    for problem in problems:
+        click.echo(problem)
+    if problems:
+        raise click.ClickException(f'{len(problems)} problems found in {path}.')
+    click.echo(f'{path} is sound.')
+
+
+@backup_cli.command('restore')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--to', 'target', default=None, help='Database to overwrite (default: the configured one).')
+@click.confirmation_option(prompt='This replaces every row of the target database. Continue?')
+def restore_command(path, target):
+    """Verify a backup, copy it over the database and verify the result."""
+    target = target or current_app.config['DATABASE']
+    try:
+        manifest = restore(path, target, current_app.config['BACKUP_PAGES'])
+    except BackupFailed as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Restored {path} (taken {manifest['created_at']} UTC) to {target}; verified.")
+
+
+@backup_cli.command('snapshot')
+def snapshot_command():
+    """Refresh the reporting snapshot now."""
+    if not current_app.config['SNAPSHOT_PATH']:
+        raise click.ClickException('SNAPSHOT_PATH is not set (CAMPUS_SNAPSHOT).')
+    manifest = refresh_snapshot(current_app.config, force=True)
+    if manifest is None:
+        raise click.ClickException('Another worker is refreshing the snapshot.')
+    echo_manifest(current_app.config['SNAPSHOT_PATH'], manifest)
+
+
+def init_app(app):
+    app.config.setdefault('BACKUP_DIR', os.environ.get('CAMPUS_BACKUP_DIR', 'backups'))
+    app.config.setdefault('BACKUP_PAGES', 4096)
+    app.config.setdefault('BACKUP_PAUSE', 0.0)
+    app.config.setdefault('SNAPSHOT_PATH', os.environ.get('CAMPUS_SNAPSHOT'))
+    app.config.setdefault('SNAPSHOT_INTERVAL', 300.0)
+    app.config.setdefault('SNAPSHOT_MAX_AGE', 900.0)
+    app.before_request(start_snapshot_refresher)
+    app.cli.add_command(backup_cli)
@@ -0,0 +1,91 @@
+"""Compare announcement fan-out against one notification row per recipient.
+
+Creates --users users (mostly students), then sends a campus-wide
+announcement and, for comparison, writes the same message as a personal
+notification for every student in one executemany. Afterwards it samples
+--sample users and times reading their merged inbox, the /api/notifications
+ETag and marking the announcement read.
+
+    python benchmarks/bench_announcements.py [--users 50000] [--sample 1000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import announcements  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+from app import create_app  # noqa: E402
+
+ROLES = ['student'] * 16 + ['faculty', 'chef', 'buscoordinator', 'admin']
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def percentile(times, fraction):
+    return sorted(times)[int(len(times) * fraction) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--sample', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        conn = db.connect(database)
+        migrations.upgrade(conn)
+        conn.executemany("INSERT INTO users (username, password, role, email, created_at) "
+                         "VALUES (?, 'x', ?, ?, '2000-01-01 00:00:00')",
+                         [(f'user{i}', ROLES[i % len(ROLES)], f'user{i}@campus.edu') for i in range(args.users)])
+        conn.close()
+        app = create_app({'DATABASE': database, 'NOISE_MONITOR': False})
+
+        with app.app_context():
+            def send():
+                with db.transaction() as conn:
+                    return announcements.create(conn, 'Campus closed', 'Campus is closed tomorrow.', [('all', '')])
+            _, elapsed = timed(send)
+            print(f'announcement to {args.users:,} users: {elapsed:.2f} ms')
+
+            def fan_out():
+                with db.transaction() as conn:
+                    students = [row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'student'")]
+                    conn.executemany("INSERT INTO notifications (user_id, title, message, category) "
+                                     "VALUES (?, 'Campus closed', 'Campus is closed tomorrow.', 'info')",
+                                     [(user_id,) for user_id in students])
+                    return len(students)
+            rows, elapsed = timed(fan_out)
+            print(f'per-recipient rows for {rows:,} students: {elapsed:.2f} ms')
+
+            user_ids = random.Random(0).sample(range(1, args.users + 1), min(args.sample, args.users))
+            conn = db.get_db()
+            results = {'inbox': [], 'etag': [], 'mark read': []}
+            for user_id in user_ids:
+                results['inbox'].append(timed(lambda: announcements.inbox(conn, user_id, limit=5, unread_only=True))[1])
+                results['etag'].append(timed(lambda: announcements.unread_etag(conn, user_id))[1])
+
+                def mark():
+                    with db.transaction() as conn:
+                        announcements.mark_read(conn, user_id, [1])
+                results['mark read'].append(timed(mark)[1])
+            for label, times in results.items():
+                print(f'{label}: p50 {percentile(times, 0.5):.3f} ms, p99 {percentile(times, 0.99):.3f} ms '
+                      f'over {len(times)} users')
+            reads = conn.execute('SELECT COUNT(*), SUM(LENGTH(read_bits)) FROM announcement_reads').fetchone()
+            print(f'read cursors: {reads[0]:,} rows, {reads[1] or 0} bytes of bitmap')
+
+
+if __name__ == '__main__':
+    main()
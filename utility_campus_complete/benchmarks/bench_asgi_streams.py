@@ -0,0 +1,151 @@
+"""Measure what idle notification streams cost a server process.
+
+Starts the app in a subprocess (the ASGI server from asgi.py, or with
+--wsgi the threaded Werkzeug server for comparison), opens --streams
+server-sent event connections for distinct users with signed session
+cookies, waits for each to receive its first event, and reports the
+server's resident memory and thread count before and after. It then
+closes the connections and checks the server still answers.
+
+    python benchmarks/bench_asgi_streams.py [--streams 10000] [--wsgi]
+"""
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+WSGI_SERVER = '''
+import sys
+from app import create_app
+app = create_app({'NOTIFY_STREAM': True})
+app.run(port=int(sys.argv[1]), threaded=True, use_reloader=False)
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_stats(pid):
+    stats = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'Threads'):
+                stats[key] = int(value.split()[0])
+    return stats['VmRSS'], stats['Threads']
+
+
+def wait_until_up(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/api/camera_status', timeout=2) as response:
+                return response.status
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+async def open_stream(port, cookie):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET /api/notifications/stream HTTP/1.1\r\nHost: bench\r\nCookie: {cookie}\r\n\r\n'.encode())
+    await writer.drain()
+    received = b''
+    while b'retry:' not in received:
+        data = await reader.read(4096)
+        if not data:
+            raise ConnectionError(received.decode(errors='replace')[:200])
+        received += data
+    return writer
+
+
+async def open_streams(port, cookies, concurrency=200):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(cookie):
+        async with limit:
+            return await open_stream(port, cookie)
+    return await asyncio.gather(*(one(cookie) for cookie in cookies))
+
+
+async def close_streams(writers):
+    for writer in writers:
+        writer.close()
+    await asyncio.sleep(1.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=10000)
+    parser.add_argument('--wsgi', action='store_true', help='threaded Werkzeug server instead of asgi.py')
+    args = parser.parse_args()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if args.streams + 100 > hard:
+        sys.exit(f'--streams {args.streams} needs more open files than the limit of {hard}')
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        conn = db.connect(database)
+        migrations.upgrade(conn)
+        conn.executemany("INSERT INTO users (username, password, role, email) VALUES (?, 'x', 'student', ?)",
+                         [(f'student{i}', f'student{i}@campus.edu') for i in range(args.streams)])
+        conn.close()
+
+        from app import create_app
+        app = create_app({'DATABASE': database})
+        serializer = app.session_interface.get_signing_serializer(app)
+        cookie_name = app.config['SESSION_COOKIE_NAME']
+        cookies = [f'{cookie_name}=' + serializer.dumps({'user_id': user_id, 'username': f'student{user_id - 1}',
+                                                          'role': 'student'})
+                   for user_id in range(1, args.streams + 1)]
+
+        port = free_port()
+        env = dict(os.environ, CAMPUS_DB=database)
+        if args.wsgi:
+            command = [sys.executable, '-c', WSGI_SERVER, str(port)]
+        else:
+            command = [sys.executable, os.path.join(APP_DIR, 'asgi.py'), '--port', str(port)]
+        server = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                  preexec_fn=lambda: resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard)))
+        try:
+            wait_until_up(port)
+            time.sleep(1.0)
+            rss_before, threads_before = process_stats(server.pid)
+            started = time.perf_counter()
+            loop = asyncio.new_event_loop()
+            writers = loop.run_until_complete(open_streams(port, cookies))
+            elapsed = time.perf_counter() - started
+            time.sleep(1.0)
+            rss_after, threads_after = process_stats(server.pid)
+            print(f'{"wsgi (threaded werkzeug)" if args.wsgi else "asgi (uvicorn)"}: '
+                  f'{args.streams} streams open in {elapsed:.1f}s')
+            print(f'server RSS: {rss_before / 1024:.1f} MB -> {rss_after / 1024:.1f} MB '
+                  f'({(rss_after - rss_before) / args.streams:.1f} KB per idle stream)')
+            print(f'server threads: {threads_before} -> {threads_after}')
+            loop.run_until_complete(close_streams(writers))
+            loop.close()
+            print(f'after closing: /api/camera_status -> {wait_until_up(port)}, '
+                  f'threads {process_stats(server.pid)[1]}')
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
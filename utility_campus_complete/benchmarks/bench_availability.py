@@ -0,0 +1,88 @@
+"""Time "who is free" lookups on the faculty availability bitmap index.
+
+Gives --faculty teachers a random weekly timetable (a few available blocks
+per weekday with busy meetings inside them), builds the index, then times
+random one-hour window queries against the index and against the
+equivalent SQL over teacher_availability.
+
+    python benchmarks/bench_availability.py [--faculty 2000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import availability  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+SQL_FREE = '''
+    SELECT DISTINCT a.teacher_id FROM teacher_availability a
+    WHERE a.day_ordinal = ? AND a.status = 'available' AND a.start_min <= ? AND a.end_min >= ?
+    AND NOT EXISTS (
+        SELECT 1 FROM teacher_availability b
+        WHERE b.teacher_id = a.teacher_id AND b.day_ordinal = ? AND b.status != 'available'
+        AND b.start_min < ? AND b.end_min > ?
+    )
+'''
+
+
+def timetable(rng, teacher_id):
+    for day in availability.DAYS[:5]:
+        start = rng.choice((8, 9, 10)) * 60
+        end = rng.choice((15, 16, 17, 18)) * 60
+        yield teacher_id, day, f'{start // 60:02d}:00', f'{end // 60:02d}:00', 'available'
+        meeting = rng.randrange(start + 30, end - 60, 30)
+        yield teacher_id, day, f'{meeting // 60:02d}:{meeting % 60:02d}', f'{meeting // 60 + 1:02d}:{meeting % 60:02d}', 'busy'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--faculty', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = db.connect(os.path.join(tmp, 'bench.db'))
+        migrations.upgrade(conn)
+        conn.executemany("INSERT INTO users (username, password, role, email) VALUES (?, 'x', 'faculty', ?)",
+                         [(f'faculty{i}', f'faculty{i}@campus.edu') for i in range(args.faculty)])
+        rows = [row for teacher_id in range(1, args.faculty + 1) for row in timetable(rng, teacher_id)]
+        conn.executemany('''
+            INSERT INTO teacher_availability (teacher_id, day_of_week, start_time, end_time, status)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        print(f'{args.faculty} faculty, {len(rows)} availability rows')
+
+        started = time.perf_counter()
+        index = availability.load_index(conn)
+        print(f'index build: {(time.perf_counter() - started) * 1000:.1f} ms')
+
+        windows = [(rng.randrange(5), start, start + 60)
+                   for start in (rng.randrange(8 * 60, 17 * 60, 15) for _ in range(args.queries))]
+        found = 0
+        started = time.perf_counter()
+        for day, start, end in windows:
+            found += len(index.free(day, start, end))
+        index_time = (time.perf_counter() - started) / len(windows) * 1000
+        print(f'index query: {index_time:.3f} ms mean ({found / len(windows):.0f} free faculty per window)')
+
+        sql_found = 0
+        started = time.perf_counter()
+        for day, start, end in windows[:200]:
+            sql_found += len(conn.execute(SQL_FREE, (day, start, end, day, end, start)).fetchall())
+        sql_time = (time.perf_counter() - started) / min(200, len(windows)) * 1000
+        print(f'SQL query: {sql_time:.3f} ms mean')
+        conn.close()
+        if index_time >= 1.0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
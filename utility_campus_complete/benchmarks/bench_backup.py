@@ -0,0 +1,125 @@
+"""Time online backups of a multi-GB database under write load.
+
+Generates a dataset.py database and pads it with random blobs to about
+--size-gb, then backs it up once per --pages setting while --writers
+processes keep inserting notifications, each in its own write transaction.
+Reports backup throughput, the writers' commit latency during the copy
+against their latency with no backup running, and how far the WAL grew
+while the copy pinned it; finally verifies the last copy against its
+manifest (full integrity check, row counts and dashboard counters).
+
+    python benchmarks/bench_backup.py [--size-gb 2] [--writers 2] [--pages 1024 4096 16384]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import backup  # noqa: E402
+import dataset  # noqa: E402
+import db  # noqa: E402
+
+PAD_ROW_BYTES = 4000
+
+
+def writer(path, start, stop, results):
+    conn = db.connect(path)
+    latencies = []
+    start.wait()
+    while not stop.is_set():
+        started = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute("INSERT INTO notifications (user_id, title, message, category) VALUES (1, 'Bench', 'x', 'info')")
+        conn.execute('COMMIT')
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.002)
+    conn.close()
+    results.put(latencies)
+
+
+def under_load(path, writers, seconds=None, work=None):
+    """Run work() (or sleep seconds) while writers insert; returns (work's result, sorted latencies)."""
+    context = multiprocessing.get_context('fork')
+    start, stop = context.Event(), context.Event()
+    results = context.Queue()
+    processes = [context.Process(target=writer, args=(path, start, stop, results)) for _ in range(writers)]
+    for process in processes:
+        process.start()
+    start.set()
+    time.sleep(0.2)
+    result = work() if work else time.sleep(seconds)
+    stop.set()
+    latencies = sorted(latency for _ in processes for latency in results.get())
+    for process in processes:
+        process.join()
+    return result, latencies
+
+
+def describe(latencies):
+    return (f'{len(latencies)} commits, p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, '
+            f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-gb', type=float, default=2.0)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--pages', type=int, nargs='+', default=[1024, 4096, 16384], help='pages per backup step')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        started = time.perf_counter()
+        dataset.generate(path, users=5000, bookings=500000, issues=100000, notifications=1000000,
+                         progress=lambda message: None)
+        conn = db.connect(path)
+        conn.execute('CREATE TABLE bench_padding (id INTEGER PRIMARY KEY, data BLOB)')
+        while os.path.getsize(path) + os.path.getsize(path + '-wal') < args.size_gb * 1e9:
+            conn.execute('BEGIN')
+            conn.execute('''
+                WITH RECURSIVE n (i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 25000)
+                INSERT INTO bench_padding (data) SELECT randomblob(?) FROM n
+            ''', (PAD_ROW_BYTES,))
+            conn.execute('COMMIT')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.close()
+        size = os.path.getsize(path)
+        print(f'{size / 1e9:.2f} GB database built in {time.perf_counter() - started:.0f}s')
+
+        _, idle = under_load(path, args.writers, seconds=3)
+        print(f'{args.writers} writers, no backup: {describe(idle)}')
+
+        worst = 0.0
+        target = os.path.join(tmp, 'backup.db')
+
+        def copy(pages):
+            manifest = backup.copy_database(path, target, pages)
+            # Still open in the writers, so not yet checkpointed away
+            return manifest, os.path.getsize(path + '-wal')
+
+        for pages in args.pages:
+            (manifest, wal), latencies = under_load(path, args.writers, work=lambda: copy(pages))
+            print(f"pages {pages:6d}: {manifest['bytes'] / 1e9:.2f} GB in {manifest['seconds']:.1f}s "
+                  f"({manifest['bytes'] / manifest['seconds'] / 1e6:.0f} MB/s); writers {describe(latencies)}; "
+                  f'WAL {wal / 1e6:.0f} MB')
+            worst = max(worst, latencies[int(len(latencies) * 0.99)])
+            conn = db.connect(path)
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.close()
+
+        started = time.perf_counter()
+        problems = backup.verify(target)
+        print(f'verified the last copy in {time.perf_counter() - started:.1f}s: '
+              + ('; '.join(problems) if problems else 'sound'))
+        if problems or worst >= 0.1:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Hammer the booking engine from several threads and check for double bookings.
+
+Every thread books random one- or two-hour slots across a handful of rooms and
+days through the same writer path the book_room view uses, so most attempts
+collide. Reports attempts per second, accepted/rejected counts, free-room query
+latency, and fails if any two confirmed bookings for a room overlap.
+
+    python benchmarks/bench_booking.py [--threads 8] [--attempts 5000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import bookings  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+ROOMS = 20
+DAYS = ['2025-03-%02d' % day for day in range(1, 6)]
+
+
+def worker(pool, attempts, seed, results):
+    rng = random.Random(seed)
+    accepted = rejected = 0
+    for _ in range(attempts):
+        start = rng.randrange(8 * 60, 18 * 60, 30)
+        end = start + rng.choice((60, 120))
+        try:
+            with pool.writer() as conn:
+                bookings.book(conn, rng.randint(1, ROOMS), 1, rng.choice(DAYS),
+                              bookings.format_minutes(start), bookings.format_minutes(end), 'bench')
+            accepted += 1
+        except bookings.BookingConflict:
+            rejected += 1
+    results.append((accepted, rejected))
+
+
+def count_overlaps(conn):
+    return conn.execute('''
+        SELECT COUNT(*) FROM bookings a JOIN bookings b
+        ON a.room_id = b.room_id AND a.booking_date = b.booking_date AND a.id < b.id
+        AND a.start_min < b.end_min AND b.start_min < a.end_min
+        WHERE a.status != 'cancelled' AND b.status != 'cancelled'
+    ''').fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--attempts', type=int, default=5000, help='total booking attempts')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        conn = db.connect(database)
+        migrations.upgrade(conn)
+        conn.executemany('INSERT INTO rooms (room_name, capacity, room_type) VALUES (?, 30, ?)',
+                         [(f'Room {i}', 'classroom') for i in range(1, ROOMS + 1)])
+
+        pool = db.ConnectionPool(database, size=args.threads)
+        results = []
+        per_thread = args.attempts // args.threads
+        threads = [threading.Thread(target=worker, args=(pool, per_thread, i, results))
+                   for i in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        accepted = sum(r[0] for r in results)
+        rejected = sum(r[1] for r in results)
+        total = accepted + rejected
+        print(f'{total} attempts in {elapsed:.2f}s: {total / elapsed:,.0f} attempts/s '
+              f'({accepted} booked, {rejected} conflicts) with {args.threads} threads')
+
+        queries = 1000
+        started = time.perf_counter()
+        for _ in range(queries):
+            bookings.free_rooms(conn, DAYS[0], '10:00', '11:00')
+        print(f'free_rooms: {(time.perf_counter() - started) / queries * 1e6:.0f} us/query')
+
+        overlaps = count_overlaps(conn)
+        print(f'double bookings: {overlaps}')
+        pool.close()
+        conn.close()
+        if overlaps:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Measure bulk import and export throughput for the reference tables.
+
+Generates a CSV of --rows canteen menu items, bus routes or rooms, imports
+it into an empty database (all inserts), imports it again (all updates on
+the natural key) and streams it back out as CSV, reporting rows per second
+for each step.
+
+    python benchmarks/bench_bulk.py [--rows 100000] [--table canteen_menu]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import bulk  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+from app import create_app  # noqa: E402
+
+
+def generate_csv(table, rows):
+    lines = []
+    if table == 'canteen_menu':
+        lines.append('day_of_week,meal_type,item_name,price,available')
+        for i in range(rows):
+            lines.append(f'{bulk.DAYS[i % 7]},{bulk.MEAL_TYPES[i % 4]},Item {i},{50 + i % 200}.50,1')
+    elif table == 'bus_routes':
+        lines.append('route_name,departure_time,destination,status')
+        for i in range(rows):
+            lines.append(f'Route {i // 1440},{(i % 1440) // 60:02d}:{i % 60:02d},Stop {i % 50},active')
+    else:
+        lines.append('room_name,capacity,room_type,status')
+        for i in range(rows):
+            lines.append(f'Room {i},{20 + i % 100},classroom,available')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def timed_import(app, table, data):
+    with app.app_context():
+        started = time.perf_counter()
+        result = bulk.run_import(table, io.BytesIO(data), 'csv')
+        return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--table', choices=sorted(bulk.TABLES), default='canteen_menu')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        conn = db.connect(database)
+        migrations.upgrade(conn)
+        conn.close()
+        app = create_app({'DATABASE': database, 'NOISE_MONITOR': False})
+        data = generate_csv(args.table, args.rows)
+        print(f'{args.table}: {args.rows:,} rows, {len(data) / 1e6:.1f} MB of CSV')
+
+        for label in ('insert', 'update'):
+            result, elapsed = timed_import(app, args.table, data)
+            print(f'import ({label}): {elapsed:.2f}s, {args.rows / elapsed:,.0f} rows/s '
+                  f'({result["inserted"]} inserted, {result["updated"]} updated)')
+
+        conn = db.connect(database)
+        started = time.perf_counter()
+        size = sum(len(chunk) for chunk in bulk.export_rows(conn, args.table, 'csv'))
+        elapsed = time.perf_counter() - started
+        conn.close()
+        print(f'export: {elapsed:.2f}s, {args.rows / elapsed:,.0f} rows/s ({size / 1e6:.1f} MB)')
+
+
+if __name__ == '__main__':
+    main()
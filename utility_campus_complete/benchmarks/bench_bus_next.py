@@ -0,0 +1,106 @@
+"""Time next-departure queries on the bus timetable index.
+
+Builds --routes routes with --stops stops each (shared between routes), a
+departure every 10-30 minutes through the day on random weekday masks and
+a few delayed trips today, then times "next 5 departures from stop S after
+T" on the sorted departure arrays against the equivalent SQL over
+bus_schedules and bus_route_stops.
+
+    python benchmarks/bench_bus_next.py [--routes 200] [--stops 20] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import timetable  # noqa: E402
+
+# Same day only and without delays, which already makes it the easy case for SQL
+SQL_NEXT = '''
+    SELECT s.id, s.departure_min + rs.offset_min AS minute FROM bus_route_stops rs
+    JOIN bus_schedules s ON s.route_id = rs.route_id
+    JOIN bus_routes r ON r.id = s.route_id
+    WHERE rs.stop_id = ? AND r.status = 'active' AND s.days & ? AND s.departure_min + rs.offset_min >= ?
+    ORDER BY minute LIMIT ?
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routes', type=int, default=200)
+    parser.add_argument('--stops', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = db.connect(os.path.join(tmp, 'bench.db'))
+        migrations.upgrade(conn)
+        conn.execute('BEGIN')
+        conn.executemany('INSERT INTO bus_stops (name) VALUES (?)', [(f'Stop {i}',) for i in range(args.stops * 5)])
+        stop_ids = [row[0] for row in conn.execute("SELECT id FROM bus_stops WHERE name != 'Campus'")]
+        schedules = 0
+        for route in range(args.routes):
+            # The insert trigger adds the first stop and a daily 06:00 departure
+            route_id = conn.execute("INSERT INTO bus_routes (route_name, departure_time, destination) VALUES (?, '06:00', ?)",
+                                    (f'Route {route}', f'Stop {route}')).lastrowid
+            offset = 0
+            for sequence, stop_id in enumerate(rng.sample(stop_ids, args.stops), start=1):
+                offset += rng.randrange(2, 6)
+                conn.execute('INSERT INTO bus_route_stops (route_id, stop_sequence, stop_id, offset_min) VALUES (?, ?, ?, ?)',
+                             (route_id, sequence, stop_id, offset))
+            minute = 6 * 60 + rng.randrange(1, 30)
+            while minute < 23 * 60:
+                conn.execute('INSERT INTO bus_schedules (route_id, departure_time, days) VALUES (?, ?, ?)',
+                             (route_id, f'{minute // 60:02d}:{minute % 60:02d}', rng.choice((127, 31, 96, 85))))
+                schedules += 1
+                minute += rng.randrange(10, 31)
+        today = date.today().isoformat()
+        conn.executemany("INSERT OR IGNORE INTO bus_trip_updates (schedule_id, service_date, delay_min) VALUES (?, ?, ?)",
+                         [(rng.randrange(1, schedules), today, rng.randrange(5, 45)) for _ in range(args.routes)])
+        conn.execute('COMMIT')
+        print(f'{args.routes} routes x {args.stops} stops, {schedules} schedules')
+
+        started = time.perf_counter()
+        index = timetable.load(conn)
+        print(f'index build: {(time.perf_counter() - started) * 1000:.1f} ms '
+              f'({sum(len(times) for times, _ in index.departures.values()):,} array entries)')
+        updates = {}
+
+        def trip_updates(day):
+            if day not in updates:
+                updates[day] = {row[0]: (row[1], bool(row[2]), None) for row in conn.execute(
+                    'SELECT schedule_id, delay_min, cancelled FROM bus_trip_updates WHERE service_date = ?',
+                    (day.isoformat(),))}
+            return updates[day]
+
+        base = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        queries = [(rng.choice(stop_ids), base + timedelta(minutes=rng.randrange(6 * 60, 23 * 60)))
+                   for _ in range(args.queries)]
+        started = time.perf_counter()
+        found = 0
+        for stop_id, at in queries:
+            found += len(index.next(at, 5, trip_updates, stop_id=stop_id))
+        index_time = (time.perf_counter() - started) / len(queries) * 1000
+        print(f'index query: {index_time:.3f} ms mean ({found / len(queries):.1f} departures per query)')
+
+        started = time.perf_counter()
+        for stop_id, at in queries[:200]:
+            conn.execute(SQL_NEXT, (stop_id, 1 << at.weekday(), at.hour * 60 + at.minute, 5)).fetchall()
+        sql_time = (time.perf_counter() - started) / min(200, len(queries)) * 1000
+        print(f'SQL query (same day, no delays): {sql_time:.3f} ms mean')
+        conn.close()
+        if index_time >= 1.0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
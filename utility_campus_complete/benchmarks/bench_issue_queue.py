@@ -0,0 +1,148 @@
+"""Time issue queue reads, concurrent claims and the SLA check.
+
+Builds --issues issues over the past 90 days (a quarter of them open and
+unclaimed), then times the head of the bus queue against the coordinator
+dashboard's old query (every bus issue joined to its reporter, newest
+first), the all-categories, multi-category and per-location queues, and
+has --claimers processes, each with its own connection, claim --claims
+issues from one queue at once and checks that no issue went to two of them.
+Finally it times a first SLA check over the whole table and a second one
+with nothing left to mark.
+
+    python benchmarks/bench_issue_queue.py [--issues 1000000] [--claimers 8] [--claims 2000]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import db  # noqa: E402
+import issue_queue  # noqa: E402
+import migrations  # noqa: E402
+
+CATEGORIES = ('washroom', 'water', 'food', 'classroom', 'bus', 'electrical', 'plumbing', 'security', 'other')
+OLD_DASHBOARD_QUERY = '''
+    SELECT i.*, u.username FROM issues i JOIN users u ON i.user_id = u.id
+    WHERE i.category = 'bus' ORDER BY i.created_at DESC LIMIT 20
+'''
+SLA_MINUTES = {'urgent': 60, 'high': 4 * 60, 'medium': 24 * 60, 'low': 3 * 24 * 60}
+
+
+def mean_ms(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def claimer(path, user_id, claims, start, results):
+    conn = db.connect(path)
+    mine = []
+    start.wait()
+    while len(mine) < claims:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            issue = issue_queue.claim_next(conn, user_id, ['bus'])
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        if issue is None:
+            break
+        mine.append(issue['id'])
+    conn.close()
+    results.put(mine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--issues', type=int, default=1000000)
+    parser.add_argument('--claimers', type=int, default=8)
+    parser.add_argument('--claims', type=int, default=2000, help='total across claimers')
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        conn = db.connect(path)
+        migrations.upgrade(conn)
+        conn.execute('BEGIN')
+        conn.executemany("INSERT INTO users (username, password, role, email) VALUES (?, 'x', ?, ?)",
+                         [(f'user{i}', 'buscoordinator' if i < args.claimers else 'student', f'user{i}@campus.edu')
+                          for i in range(1000)])
+        now = datetime.utcnow()
+        started = time.perf_counter()
+        for batch in range(0, args.issues, 50000):
+            conn.executemany('''
+                INSERT INTO issues (user_id, category, description, location, priority, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(rng.randrange(args.claimers + 1, 1001), rng.choice(CATEGORIES), f'Synthetic issue {i}',
+                   f'Block {i % 40}', rng.choice(issue_queue.PRIORITIES),
+                   rng.choice(('open', 'resolved', 'resolved', 'closed')),
+                   (now - timedelta(minutes=rng.randrange(90 * 24 * 60))).strftime('%Y-%m-%d %H:%M:%S'))
+                  for i in range(batch, min(batch + 50000, args.issues))])
+        conn.execute('COMMIT')
+        conn.execute('ANALYZE')
+        open_bus = conn.execute("SELECT COUNT(*) FROM issues WHERE category = 'bus' AND status = 'open'").fetchone()[0]
+        print(f'{args.issues:,} issues loaded in {time.perf_counter() - started:.1f}s, {open_bus:,} open bus issues')
+
+        old = mean_ms(lambda: conn.execute(OLD_DASHBOARD_QUERY).fetchall(), 20)
+        bus = mean_ms(lambda: issue_queue.queue(conn, ['bus'], limit=20), 200)
+        print(f'bus dashboard, old join query: {old:.2f} ms; bus queue head: {bus:.3f} ms')
+        print(f'all-categories queue: {mean_ms(lambda: issue_queue.queue(conn, limit=20), 200):.3f} ms; '
+              f'three categories: {mean_ms(lambda: issue_queue.queue(conn, ["bus", "food", "water"]), 200):.3f} ms; '
+              f'one location: {mean_ms(lambda: issue_queue.queue(conn, location="Block 7"), 200):.3f} ms')
+        conn.close()
+
+        context = multiprocessing.get_context('fork')
+        start = context.Event()
+        results = context.Queue()
+        workers = [context.Process(target=claimer, args=(path, user_id, args.claims // args.claimers, start, results))
+                   for user_id in range(1, args.claimers + 1)]
+        for worker in workers:
+            worker.start()
+        started = time.perf_counter()
+        start.set()
+        claimed = [issue_id for _ in workers for issue_id in results.get()]
+        elapsed = time.perf_counter() - started
+        for worker in workers:
+            worker.join()
+        duplicates = sum(count - 1 for count in Counter(claimed).values() if count > 1)
+        print(f'{args.claimers} claimers: {len(claimed)} claims in {elapsed:.2f}s '
+              f'({len(claimed) / elapsed:.0f}/s), {duplicates} claimed twice')
+
+        conn = db.connect(path)
+        expected = [row[0] for row in conn.execute('''
+            SELECT id FROM issues WHERE category = 'bus' AND status = 'open' OR id IN (
+                SELECT issue_id FROM issue_events WHERE event = 'claimed')
+            ORDER BY priority_rank, created_at, id LIMIT ?
+        ''', (len(claimed),))]
+        in_order = sorted(claimed) == sorted(expected)
+        print(f'claimed issues are the head of the queue: {in_order}')
+
+        for run in ('first', 'second'):
+            started = time.perf_counter()
+            breached = 0
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                marked = len(issue_queue.mark_breaches(conn, SLA_MINUTES, None, 500))
+                conn.execute('COMMIT')
+                breached += marked
+                if marked < 500:
+                    break
+            print(f'{run} SLA check: {breached:,} issues marked in {(time.perf_counter() - started) * 1000:.1f} ms')
+        conn.close()
+        if duplicates or not in_order or bus >= 1.0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
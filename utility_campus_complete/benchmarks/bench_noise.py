@@ -0,0 +1,75 @@
+"""Time the noise monitor's tick with hundreds of simulated microphones.
+
+Creates one active ai_alerts row per location, each fed by a sim:// source,
+and drives NoiseMonitor.tick() directly for the requested number of ticks.
+Reports mean and p99 tick time against the budget of one tick period, and
+how many alerts fired (and were written as announcements).
+
+    python benchmarks/bench_noise.py [--locations 300] [--ticks 600] [--hz 10]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import noise  # noqa: E402
+from app import create_app  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--locations', type=int, default=300)
+    parser.add_argument('--ticks', type=int, default=600)
+    parser.add_argument('--hz', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        conn = db.connect(database)
+        migrations.upgrade(conn)
+        conn.execute("INSERT INTO users (username, password, role, email) VALUES ('admin', 'x', 'admin', 'a@x')")
+        conn.executemany(
+            "INSERT INTO ai_alerts (location, alert_type, threshold, source_url) VALUES (?, 'noise', ?, ?)",
+            [(f'Room {i}', 60.0, f'sim://room-{i}?level={40 + i % 15}') for i in range(args.locations)])
+        conn.close()
+
+        app = create_app({'DATABASE': database, 'NOISE_MONITOR': False})
+        monitor = noise.NoiseMonitor(app, tick_hz=args.hz, cooldown=0.0)
+        monitor.reload()
+        fired = 0
+        times = []
+        now = time.time()
+        for i in range(args.ticks):
+            started = time.perf_counter()
+            fired += len(monitor.tick(now + i / args.hz))
+            times.append(time.perf_counter() - started)
+        monitor.stop()
+        monitor._writer.shutdown(wait=True)
+
+        times.sort()
+        budget = 1000 / args.hz
+        mean = sum(times) / len(times) * 1000
+        p99 = times[int(len(times) * 0.99) - 1] * 1000
+        print(f'{args.locations} locations, {args.ticks} ticks at {args.hz} Hz: '
+              f'mean {mean:.2f} ms, p99 {p99:.2f} ms per tick ({mean / budget:.1%} of the {budget:.0f} ms budget)')
+        started = time.perf_counter()
+        for _ in range(100):
+            monitor._payload_tick = None
+            monitor.payload()
+        print(f'status payload: {(time.perf_counter() - started) * 10:.2f} ms to build')
+        conn = db.connect(database)
+        written = conn.execute("SELECT COUNT(*) FROM announcements WHERE category = 'alert'").fetchone()[0]
+        conn.close()
+        print(f'alerts fired: {fired}, announcements written: {written}')
+        if mean > budget:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
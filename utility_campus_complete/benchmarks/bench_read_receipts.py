@@ -0,0 +1,139 @@
+"""Time clearing a notification list one id at a time, in bulk and buffered.
+
+Gives each of --users users --per-user unread notifications and marks them
+read three ways: one transaction per id (the old GET endpoint), one bulk
+statement per user, and through the write-behind buffer. The buffered run
+also checks the buffer's durability rules: receipts are invisible to other
+connections until a flush, hidden from the worker that queued them, put
+back when a flush fails, and written on stop().
+
+    python benchmarks/bench_read_receipts.py [--users 200] [--per-user 50]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import notifications  # noqa: E402
+import receipts  # noqa: E402
+from app import create_app  # noqa: E402
+
+
+def reset(database, users, per_user):
+    conn = db.connect(database)
+    conn.execute('DELETE FROM notifications')
+    conn.executemany("INSERT INTO notifications (user_id, title, message, category) VALUES (?, 'T', 'M', 'info')",
+                     [(user_id,) for user_id in range(1, users + 1) for _ in range(per_user)])
+    ids = {}
+    for row in conn.execute('SELECT user_id, id FROM notifications ORDER BY id'):
+        ids.setdefault(row[0], []).append(row[1])
+    conn.close()
+    return ids
+
+
+def unread(database):
+    conn = db.connect(database)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM notifications WHERE read_status = 0').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def report(label, elapsed, receipts_count):
+    print(f'{label}: {elapsed * 1000:.1f} ms, {receipts_count / elapsed:,.0f} receipts/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--per-user', type=int, default=50)
+    args = parser.parse_args()
+    total = args.users * args.per_user
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        conn = db.connect(database)
+        migrations.upgrade(conn)
+        conn.executemany("INSERT INTO users (username, password, role, email) VALUES (?, 'x', 'student', ?)",
+                         [(f'user{i}', f'user{i}@campus.edu') for i in range(args.users)])
+        conn.close()
+        app = create_app({'DATABASE': database, 'NOISE_MONITOR': False})
+        print(f'{args.users} users x {args.per_user} unread notifications')
+
+        with app.app_context():
+            ids = reset(database, args.users, args.per_user)
+            started = time.perf_counter()
+            for user_id, user_ids in ids.items():
+                for notification_id in user_ids:
+                    with db.transaction() as conn:
+                        conn.execute('UPDATE notifications SET read_status = 1 WHERE id = ? AND user_id = ?',
+                                     (notification_id, user_id))
+            report('one transaction per id', time.perf_counter() - started, total)
+            assert unread(database) == 0
+
+            ids = reset(database, args.users, args.per_user)
+            started = time.perf_counter()
+            for user_id, user_ids in ids.items():
+                receipts.record(user_id, user_ids)
+            report('bulk ids per user', time.perf_counter() - started, total)
+            assert unread(database) == 0
+
+            ids = reset(database, args.users, args.per_user)
+            started = time.perf_counter()
+            for user_id, user_ids in ids.items():
+                receipts.record(user_id, up_to=user_ids[-1])
+            report('watermark per user', time.perf_counter() - started, total)
+            assert unread(database) == 0
+
+            ids = reset(database, args.users, args.per_user)
+            buffer = receipts.ReadBuffer(app, interval=3600, max_pending=total + 1)
+            started = time.perf_counter()
+            for user_id, user_ids in ids.items():
+                for notification_id in user_ids:
+                    reads = receipts.PendingReads()
+                    reads.merge([notification_id])
+                    buffer.add(user_id, reads)
+            queued = time.perf_counter() - started
+            # Queued receipts are only visible to this worker until the flush
+            assert unread(database) == total
+            visible = [dict(row) for row in notifications.newer_than(db.get_db(), 1, 0)]
+            assert buffer.hide_read(1, visible) == []
+            started = time.perf_counter()
+            buffer.flush()
+            flushed = time.perf_counter() - started
+            report('buffered, queue one id per request', queued, total)
+            report('buffered, flush', flushed, total)
+            assert unread(database) == 0
+
+            # A failed flush keeps its receipts for the next attempt
+            ids = reset(database, args.users, args.per_user)
+            reads = receipts.PendingReads()
+            reads.merge(up_to=ids[1][-1])
+            buffer.add(1, reads)
+            write = receipts.write
+
+            def failing_write(conn, user_id, reads):
+                raise RuntimeError('simulated write failure')
+            receipts.write = failing_write
+            try:
+                buffer.flush()
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError('flush should have failed')
+            finally:
+                receipts.write = write
+            assert unread(database) == total
+            buffer.stop()
+            assert unread(database) == total - args.per_user
+            print('durability checks passed')
+
+
+if __name__ == '__main__':
+    main()
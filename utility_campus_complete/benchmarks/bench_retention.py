@@ -0,0 +1,114 @@
+"""Time a retention pass over a large database and the write latency around it.
+
+Generates a dataset.py database (bookings spread over a year around today,
+notifications over the past 90 days, issues backdated over the past 400
+days), then runs one retention pass with --bookings-days,
+--notifications-days and --issues-days while another process keeps
+inserting notifications, each in its own write transaction, and reports
+the rows archived, the longest write lock a batch held, what that writer
+waited for, and the bytes reclaimed from the database and its file.
+
+    python benchmarks/bench_retention.py [--bookings 1000000] [--notifications 2000000] [--format sqlite]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dataset  # noqa: E402
+import db  # noqa: E402
+import retention  # noqa: E402
+
+
+def writer(path, stop, results):
+    conn = db.connect(path)
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute("INSERT INTO notifications (user_id, title, message, category) VALUES (1, 'Bench', 'x', 'info')")
+        conn.execute('COMMIT')
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.005)
+    conn.close()
+    results.put(latencies)
+
+
+def file_size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--bookings', type=int, default=1000000)
+    parser.add_argument('--issues', type=int, default=200000)
+    parser.add_argument('--notifications', type=int, default=2000000)
+    parser.add_argument('--bookings-days', type=int, default=30)
+    parser.add_argument('--notifications-days', type=int, default=30)
+    parser.add_argument('--issues-days', type=int, default=180)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--format', choices=retention.FORMATS, default='sqlite')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        dataset.generate(path, users=args.users, bookings=args.bookings, issues=args.issues,
+                         notifications=args.notifications, progress=lambda message: None)
+        conn = db.connect(path)
+        conn.execute("UPDATE issues SET created_at = datetime('now', '-' || (id % 400) || ' days')")
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        before = file_size(path)
+        rows = {name: retention.table_rows(conn, name) for name in retention.POLICIES}
+        conn.close()
+        print(f'{sum(rows.values()):,} rows ({rows}), {before / 1e6:.0f} MB')
+
+        config = {
+            'DATABASE': path,
+            'RETENTION_FORMAT': args.format,
+            'RETENTION_ARCHIVE_DIR': os.path.join(tmp, 'archive'),
+            'RETENTION_DAYS': {'bookings': args.bookings_days, 'notifications': args.notifications_days,
+                               'issues': args.issues_days},
+            'RETENTION_MAX_ROWS': {name: 10 ** 9 for name in retention.POLICIES},
+            'RETENTION_INTERVAL': 0,
+            'RETENTION_BATCH': args.batch,
+            'RETENTION_PAUSE': 0.05,
+            'RETENTION_VACUUM_PAGES': 2000,
+            'RETENTION_MERGE_PAGES': 500,
+            'RETENTION_UPLOAD_GRACE': 3600,
+            'UPLOAD_FOLDER': os.path.join(tmp, 'uploads'),
+        }
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        results = context.Queue()
+        process = context.Process(target=writer, args=(path, stop, results))
+        process.start()
+        time.sleep(0.5)
+        report = retention.run(config)
+        stop.set()
+        latencies = sorted(results.get())
+        process.join()
+
+        archived = sum(report['archived'].values())
+        print(f"archived {report['archived']} ({archived:,} rows) in {report['seconds']:.1f}s "
+              f'({archived / report["seconds"]:,.0f} rows/s), longest batch lock {report["max_lock_ms"]:.1f} ms')
+        print(f'concurrent writer: {len(latencies)} inserts, p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, '
+              f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms')
+        conn = db.connect(path)
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.close()
+        after = file_size(path)
+        print(f"reclaimed {report['reclaimed_bytes'] / 1e6:.0f} MB of pages, database file "
+              f'{before / 1e6:.0f} MB -> {after / 1e6:.0f} MB; hot rows now {report["hot_rows"]}')
+        if report['max_lock_ms'] >= 500 or latencies[int(len(latencies) * 0.99)] >= 0.1:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Time full-text issue search against LIKE scans.
+
+Loads --issues issues whose descriptions are 8-24 words drawn from a
+skewed vocabulary (a few very common words, a long tail of rare ones),
+through the live triggers so the FTS5 index is built the way production
+builds it, then runs rare, common, two-word and prefix (word*) searches both
+through search.search() (bm25-ranked and highlighted, first page of 20)
+and as the equivalent LIKE '%word%' query over description and location.
+
+    python benchmarks/bench_search.py [--issues 1000000] [--queries 50]
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import search  # noqa: E402
+
+COMMON = ('broken', 'water', 'leaking', 'light', 'door', 'room', 'floor', 'please', 'fix', 'near', 'not', 'working')
+SYLLABLES = ('ka', 'lo', 'mi', 'ret', 'sun', 'vo', 'pra', 'den', 'tis', 'gul', 'fe', 'nor', 'bal', 'qui')
+LIKE_QUERY = '''
+    SELECT id FROM issues WHERE {clauses} ORDER BY id DESC LIMIT 20
+'''
+
+
+def vocabulary(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randrange(2, 5))))
+    return sorted(words)
+
+
+def like_search(conn, words):
+    clauses = ' AND '.join('(description LIKE ? OR location LIKE ?)' for _ in words)
+    params = [f'%{word.rstrip("*")}%' for word in words for _ in range(2)]
+    return conn.execute(LIKE_QUERY.format(clauses=clauses), params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--issues', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=50, help='per kind of search')
+    args = parser.parse_args()
+    rng = random.Random(1)
+    words = vocabulary(rng, 20000)
+    # Zipf-like: word i is drawn with weight 1 / (i + 1)
+    cumulative = list(itertools.accumulate(1 / (i + 1) for i in range(len(words))))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = db.connect(os.path.join(tmp, 'bench.db'))
+        migrations.upgrade(conn)
+        conn.execute("INSERT INTO users (username, password, role, email) VALUES ('admin', 'x', 'admin', 'a')")
+        started = time.perf_counter()
+        for batch in range(0, args.issues, 50000):
+            rows = []
+            for i in range(batch, min(batch + 50000, args.issues)):
+                text = rng.choices(words, cum_weights=cumulative, k=rng.randrange(6, 20)) + rng.sample(COMMON, 2)
+                rng.shuffle(text)
+                rows.append((1, 'other', ' '.join(text), f'Block {i % 40} room {i % 300}'))
+            conn.execute('BEGIN')
+            conn.executemany('INSERT INTO issues (user_id, category, description, location) VALUES (?, ?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        load_time = time.perf_counter() - started
+        # What `flask search reindex` leaves behind: one merged segment
+        conn.execute("INSERT INTO issues_fts (issues_fts) VALUES ('optimize')")
+        size = conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name LIKE 'issues_fts%'").fetchone()[0] \
+            if conn.execute("SELECT 1 FROM pragma_compile_options WHERE compile_options = 'ENABLE_DBSTAT_VTAB'").fetchone() \
+            else None
+        print(f'{args.issues:,} issues loaded through the triggers in {load_time:.1f}s'
+              + (f', FTS index {size / 1e6:.0f} MB' if size else ''))
+
+        searches = {
+            'rare word': [[rng.choice(words[5000:])] for _ in range(args.queries)],
+            'common word': [[rng.choice(COMMON)] for _ in range(args.queries)],
+            'two words': [[rng.choice(words[:2000]), rng.choice(COMMON)] for _ in range(args.queries)],
+            'prefix': [[rng.choice(words[:5000])[:-1] + '*'] for _ in range(args.queries)],
+        }
+        worst = 0.0
+        for kind, queries in searches.items():
+            started = time.perf_counter()
+            found = sum(len(search.search(conn, ' '.join(query), {}, types=['issue'])[0]) for query in queries)
+            fts_time = (time.perf_counter() - started) / len(queries) * 1000
+            worst = max(worst, fts_time)
+            like_queries = queries[:5]
+            started = time.perf_counter()
+            for query in like_queries:
+                like_search(conn, query)
+            like_time = (time.perf_counter() - started) / len(like_queries) * 1000
+            print(f'{kind:12s} fts {fts_time:8.2f} ms   like {like_time:8.1f} ms   '
+                  f'({found / len(queries):.1f} results per page)')
+        conn.close()
+        if worst >= 50.0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
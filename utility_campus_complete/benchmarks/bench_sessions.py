@@ -0,0 +1,157 @@
+"""Time what opening the session and loading the user costs per request.
+
+Signs in --sessions of --users users and sends --requests requests, each as
+a random one of them, to a JSON view that checks the role and returns the
+user id, in four setups: signed-cookie sessions with the old inline role
+check (no query), signed cookies with sessions.login_required (one users
+query), server-side sessions with a warm per-worker cache, and server-side
+sessions with the cache dropped before every request (the session and user
+loaded in one query). Reports the time per request and what each setup adds
+to the first. Then checks revocation with CACHE_BACKEND 'file': a forked
+worker keeps requesting as one user while the parent deletes the account,
+and reports how long after the revoking transaction began the worker
+stopped accepting the session.
+
+    python benchmarks/bench_sessions.py [--users 5000] [--sessions 2000] [--requests 20000]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import secrets
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from flask import g, jsonify, session  # noqa: E402
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import sessions  # noqa: E402
+from app import create_app  # noqa: E402
+
+
+def inline_view():
+    if 'user_id' not in session or session['role'] != 'student':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(session['user_id'])
+
+
+@sessions.login_required('student', api=True)
+def decorated_view():
+    return jsonify(g.user['id'])
+
+
+def sign_in(app, user_ids):
+    """Server-side session tokens and signed cookies for the same users."""
+    now = int(time.time())
+    lifetime = int(app.permanent_session_lifetime.total_seconds())
+    signer = app.session_interface.get_signing_serializer(app)
+    tokens, cookies = [], []
+    with app.app_context():
+        with db.transaction() as conn:
+            for user_id in user_ids:
+                token = secrets.token_urlsafe(32)
+                sessions.save_record(conn, sessions.token_key(token), user_id, None, now + lifetime, now)
+                tokens.append(token)
+                cookies.append(signer.dumps({'user_id': user_id, 'username': f'user{user_id}', 'role': 'student'}))
+    return tokens, cookies
+
+
+def timed_requests(app, client, path, cookies, requests, before=None):
+    rng = random.Random(1)
+    latencies = []
+    for _ in range(requests):
+        cookie = rng.choice(cookies)
+        if before:
+            before()
+        started = time.perf_counter()
+        response = client.get(path, headers={'Cookie': f'session={cookie}'})
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.status_code
+    return sorted(latencies)
+
+
+def worker(app, token, ready, results):
+    client = app.test_client(use_cookies=False)
+    ready.set()
+    while client.get('/bench/decorated', headers={'Cookie': f'session={token}'}).status_code == 200:
+        time.sleep(0.0005)
+    results.put(time.time())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        conn = db.connect(database)
+        migrations.upgrade(conn)
+        conn.executemany("INSERT INTO users (username, password, role, email) VALUES (?, 'x', 'student', ?)",
+                         [(f'user{i}', f'user{i}@campus.edu') for i in range(args.users)])
+        conn.close()
+        app = create_app({'DATABASE': database, 'NOISE_MONITOR': False, 'CACHE_BACKEND': 'file',
+                          'CACHE_VERSION_FILE': os.path.join(tmp, 'cache-versions'),
+                          'SESSION_VERSION_FILE': os.path.join(tmp, 'session-versions')})
+        app.add_url_rule('/bench/inline', 'bench_inline', inline_view)
+        app.add_url_rule('/bench/decorated', 'bench_decorated', decorated_view)
+        tokens, cookies = sign_in(app, random.Random(0).sample(range(1, args.users + 1), args.sessions))
+        client = app.test_client(use_cookies=False)
+        print(f'{args.users} users, {args.sessions} signed in, {args.requests} requests per setup')
+
+        def drop_cache():
+            with app.app_context():
+                sessions.get_store().cache.clear()
+
+        setups = [
+            ('cookie, inline check', 'cookie', '/bench/inline', cookies, None),
+            ('cookie, login_required', 'cookie', '/bench/decorated', cookies, None),
+            ('server, warm cache', 'server', '/bench/decorated', tokens, None),
+            ('server, cache dropped', 'server', '/bench/decorated', tokens, drop_cache),
+        ]
+        baseline = None
+        results = {}
+        for label, store, path, values, before in setups:
+            app.config['SESSION_STORE'] = store
+            timed_requests(app, client, path, values, min(1000, args.requests), before)
+            latencies = timed_requests(app, client, path, values, args.requests, before)
+            p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+            baseline = baseline or p50
+            results[label] = p50 - baseline
+            print(f'{label:24s} p50 {p50 * 1e6:6.0f} us, p99 {p99 * 1e6:6.0f} us, '
+                  f'+{(p50 - baseline) * 1e6:4.0f} us over the inline cookie check')
+        with app.app_context():
+            stats = sessions.get_store().cache.stats()
+        print(f"session cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} entries")
+
+        app.config['SESSION_STORE'] = 'server'
+        context = multiprocessing.get_context('fork')
+        ready, queue = context.Event(), context.Queue()
+        process = context.Process(target=worker, args=(app, tokens[0], ready, queue))
+        process.start()
+        ready.wait()
+        time.sleep(0.2)
+        revoking = time.time()
+        with app.app_context():
+            with db.transaction() as conn:
+                user_id = conn.execute('SELECT user_id FROM user_sessions WHERE id = ?',
+                                       (sessions.token_key(tokens[0]),)).fetchone()[0]
+                conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
+                sessions.revoke_user(conn, user_id)
+        refused = queue.get(timeout=10)
+        process.join()
+        print(f'revocation: the other worker refused the session {(refused - revoking) * 1000:.1f} ms '
+              'after the revoking transaction began')
+        if results['server, warm cache'] >= 0.0001 or refused - revoking >= 0.05:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
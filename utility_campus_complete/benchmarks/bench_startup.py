@@ -0,0 +1,64 @@
+"""Measure application startup cost.
+
+Times a cold `import app` plus `create_app()` in a fresh interpreter (what
+every gunicorn worker, test process and flask CLI call pays), and `init_db()`
+against an empty and an already seeded database.
+
+    python benchmarks/bench_startup.py [--runs 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+
+def time_import(database, runs):
+    env = dict(os.environ, CAMPUS_DB=database)
+    code = 'import time; t = time.perf_counter(); import app; app.create_app(); print(time.perf_counter() - t)'
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', code], cwd=APP_DIR, env=env,
+                             capture_output=True, text=True, check=True)
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def time_init_db(app_module, app, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        with app.app_context():
+            app_module.init_db()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def report(label, samples):
+    print(f'{label:<28} median {statistics.median(samples) * 1000:8.2f} ms'
+          f'   min {min(samples) * 1000:8.2f} ms   runs {len(samples)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        os.environ['CAMPUS_DB'] = database
+        import app as app_module
+        app = app_module.create_app()
+
+        report('import app + create_app()', time_import(database, args.runs))
+        report('init_db (empty database)', time_init_db(app_module, app, 1))
+        report('init_db (already seeded)', time_init_db(app_module, app, args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""Generate a synthetic campus database for load tests.
+
+Writes users of every role, rooms, bookings, issues and notifications
+straight into a SQLite file at the current schema version. Usernames are
+<role><n> (student1 .. studentN, faculty1, ...) and every account's
+password is PASSWORD, so load_test.py can log in as anyone. Bookings never
+overlap: each one takes the next free hour slot of a room, spread over
+days around today so dashboards see both past and upcoming bookings.
+The same --seed always produces the same data.
+
+    python benchmarks/dataset.py campus-bench.db [--users 50000] [--bookings 1000000] [--notifications 5000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import search  # noqa: E402
+import seed  # noqa: E402
+import stats  # noqa: E402
+
+PASSWORD = 'bench123'
+# Share of accounts per role; admins get whatever is left (at least one)
+ROLE_SHARES = (('student', 0.90), ('faculty', 0.06), ('chef', 0.01), ('buscoordinator', 0.01))
+ROOM_TYPES = ('classroom', 'laboratory', 'library', 'conference')
+SLOTS = range(8, 18)
+ISSUE_CATEGORIES = ('washroom', 'classroom', 'food', 'bus', 'other')
+NOTIFICATION_CATEGORIES = ('booking', 'issue', 'system', 'info', 'alert')
+BATCH = 50000
+
+
+def role_counts(users):
+    counts = {role: max(1, int(users * share)) for role, share in ROLE_SHARES}
+    counts['admin'] = max(1, users - sum(counts.values()))
+    return counts
+
+
+def batches(rows, size=BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load(conn, sql, rows):
+    count = 0
+    for batch in batches(rows):
+        conn.execute('BEGIN')
+        conn.executemany(sql, batch)
+        conn.execute('COMMIT')
+        count += len(batch)
+    return count
+
+
+def generate(path, users=50000, rooms=None, bookings=1000000, issues=50000, notifications=5000000,
+             seed_value=1, progress=print):
+    """Create path (which must not exist) and fill it; returns row counts per table."""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    rng = random.Random(seed_value)
+    conn = db.connect(path)
+    migrations.upgrade(conn)
+    # Rebuildable scratch data: trade crash safety for load speed, and build
+    # indexes and triggers once at the end instead of row by row (the rows
+    # are valid by construction and the stats counters are rebuilt)
+    conn.execute('PRAGMA synchronous = OFF')
+    deferred = conn.execute('''
+        SELECT name, type, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+        AND tbl_name IN ('users', 'rooms', 'bookings', 'issues', 'notifications')
+    ''').fetchall()
+    for row in deferred:
+        conn.execute(f'DROP {row["type"].upper()} {row["name"]}')
+    counts = {}
+    started = time.perf_counter()
+
+    password = generate_password_hash(PASSWORD)
+    accounts = [(role, n) for role, count in role_counts(users).items() for n in range(1, count + 1)]
+    counts['users'] = load(conn, 'INSERT INTO users (username, password, role, email) VALUES (?, ?, ?, ?)',
+                           ((f'{role}{n}', password, role, f'{role}{n}@campus.edu') for role, n in accounts))
+    progress(f'users: {counts["users"]:,}')
+    user_ids = [row[0] for row in conn.execute('SELECT id FROM users ORDER BY id')]
+
+    # Enough rooms that bookings cover about a year of days
+    if rooms is None:
+        rooms = max(20, bookings // (len(SLOTS) * 365) + 1)
+    counts['rooms'] = load(conn, 'INSERT INTO rooms (room_name, capacity, room_type, status) VALUES (?, ?, ?, ?)',
+                           ((f'Room {i}', rng.choice((15, 25, 30, 50)), ROOM_TYPES[i % len(ROOM_TYPES)], 'available')
+                            for i in range(1, rooms + 1)))
+    conn.execute('BEGIN')
+    for table, columns, key, rows in seed.SAMPLE_TABLES:
+        if table in ('bus_routes', 'canteen_menu', 'washroom_status'):
+            seed.insert_missing(conn, table, columns, key, rows)
+    conn.execute('COMMIT')
+
+    per_day = rooms * len(SLOTS)
+    first_day = date.today() - timedelta(days=bookings // per_day // 2)
+
+    def booking_rows():
+        for i in range(bookings):
+            day, slot = divmod(i, per_day)
+            room, hour = divmod(slot, len(SLOTS))
+            status = 'cancelled' if rng.random() < 0.05 else 'confirmed'
+            yield (room + 1, rng.choice(user_ids), (first_day + timedelta(days=day)).isoformat(),
+                   f'{SLOTS[hour]:02d}:00', f'{SLOTS[hour] + 1:02d}:00', 'Study group', status)
+    counts['bookings'] = load(conn, '''
+        INSERT INTO bookings (room_id, user_id, booking_date, start_time, end_time, purpose, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', booking_rows())
+    progress(f'bookings: {counts["bookings"]:,}')
+
+    counts['issues'] = load(conn, '''
+        INSERT INTO issues (user_id, category, description, location, priority, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', ((rng.choice(user_ids), rng.choice(ISSUE_CATEGORIES), f'Synthetic issue {i}', f'Block {i % 20}',
+           rng.choice(('low', 'medium', 'high', 'urgent')), rng.choice(('open', 'open', 'in_progress', 'resolved')))
+          for i in range(issues)))
+    progress(f'issues: {counts["issues"]:,}')
+
+    # Spread notifications over the past 90 days, most of them read
+    now = time.time()
+    counts['notifications'] = load(conn, '''
+        INSERT INTO notifications (user_id, title, message, category, read_status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', ((rng.choice(user_ids), 'Campus update', f'Synthetic notification {i}', rng.choice(NOTIFICATION_CATEGORIES),
+           0 if rng.random() < 0.1 else 1,
+           time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - rng.random() * 90 * 86400)))
+          for i in range(notifications)))
+    progress(f'notifications: {counts["notifications"]:,}')
+
+    conn.execute('BEGIN')
+    for row in sorted(deferred, key=lambda row: row['type']):
+        conn.execute(row['sql'])
+    stats.rebuild(conn)
+    search.rebuild(conn)
+    conn.execute('COMMIT')
+    progress(f'indexes and triggers: {len(deferred)}')
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    progress(f'done in {time.perf_counter() - started:.1f}s, {os.path.getsize(path) / 1e6:.0f} MB')
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path')
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--rooms', type=int, default=None, help='default: enough for a year of bookings')
+    parser.add_argument('--bookings', type=int, default=1000000)
+    parser.add_argument('--issues', type=int, default=50000)
+    parser.add_argument('--notifications', type=int, default=5000000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    generate(args.path, users=args.users, rooms=args.rooms, bookings=args.bookings, issues=args.issues,
+             notifications=args.notifications, seed_value=args.seed)
+
+
+if __name__ == '__main__':
+    main()
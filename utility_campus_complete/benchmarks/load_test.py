@@ -0,0 +1,293 @@
+"""Drive the app with concurrent simulated users and report per-route latency.
+
+Each client logs in as a random user of its role and then loops over that
+role's mix of requests (dashboard loads, /api/notifications polls,
+/book_room POSTs) until --duration runs out. By default requests go
+through the Flask test client in this process, so every client shares one
+worker's GIL and connection pool; pass --url to load a running server
+instead (one cookie jar per client, redirects not followed).
+
+Reports requests per second and p50/p95/p99 latency per route. --save
+writes the results as a JSON baseline; --compare checks a run against one
+and exits 1 when a route's p95 or throughput is more than --tolerance
+worse.
+
+    python benchmarks/dataset.py campus-bench.db --users 50000 --bookings 1000000 --notifications 5000000
+    python benchmarks/load_test.py --db campus-bench.db [--clients 32] [--duration 30] [--save base.json]
+    python benchmarks/load_test.py --db campus-bench.db --compare base.json
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dataset  # noqa: E402
+
+DEFAULT_MIX = 'student=80,faculty=10,chef=3,buscoordinator=3,admin=4'
+
+# (weight, route label, request factory) per role; factories take an rng and the
+# room count and return (method, path, form data or None)
+POLL = (60, 'GET /api/notifications', lambda rng, rooms: ('GET', '/api/notifications', None))
+
+
+def book_room(rng, rooms):
+    start = rng.randrange(8, 18)
+    day = date.today() + timedelta(days=rng.randrange(1, 30))
+    return 'POST', '/book_room', {
+        'room_id': str(rng.randint(1, rooms)),
+        'booking_date': day.isoformat(),
+        'start_time': f'{start:02d}:00',
+        'end_time': f'{start + 1:02d}:00',
+        'purpose': 'Load test',
+    }
+
+
+SCENARIOS = {
+    'student': [
+        (25, 'GET /student/dashboard', lambda rng, rooms: ('GET', '/student/dashboard', None)),
+        POLL,
+        (15, 'POST /book_room', book_room),
+    ],
+    'faculty': [
+        (30, 'GET /faculty/dashboard', lambda rng, rooms: ('GET', '/faculty/dashboard', None)),
+        POLL,
+        (10, 'POST /book_room', book_room),
+    ],
+    'chef': [
+        (40, 'GET /chef/dashboard', lambda rng, rooms: ('GET', '/chef/dashboard', None)),
+        POLL,
+    ],
+    'buscoordinator': [
+        (40, 'GET /buscoordinator/dashboard', lambda rng, rooms: ('GET', '/buscoordinator/dashboard', None)),
+        POLL,
+    ],
+    'admin': [
+        (40, 'GET /admin/dashboard', lambda rng, rooms: ('GET', '/admin/dashboard', None)),
+        POLL,
+    ],
+}
+
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+
+class HttpSession:
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self.NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        role, _, weight = part.partition('=')
+        if role not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f'unknown role {role!r}')
+        mix[role] = float(weight or 1)
+    return mix
+
+
+class Results:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, route, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+def percentile(values, fraction):
+    # Nearest rank on sorted values
+    return values[max(0, int(round(fraction * len(values))) - 1)]
+
+
+def client(make_session, role, user_count, rooms, deadline, seed, results):
+    rng = random.Random(seed)
+    session = make_session()
+    username = f'{role}{rng.randint(1, user_count)}'
+    started = time.perf_counter()
+    status = session.request('POST', '/login', {'username': username, 'password': dataset.PASSWORD})
+    results.add('POST /login', time.perf_counter() - started, status == 302)
+    scenario = SCENARIOS[role]
+    weights = [weight for weight, _, _ in scenario]
+    while time.monotonic() < deadline:
+        _, route, factory = rng.choices(scenario, weights)[0]
+        method, path, data = factory(rng, rooms)
+        started = time.perf_counter()
+        status = session.request(method, path, data)
+        results.add(route, time.perf_counter() - started, status < 400)
+
+
+def summarize(results, elapsed):
+    routes = {}
+    for route, latencies in sorted(results.latencies.items()):
+        latencies.sort()
+        routes[route] = {
+            'requests': len(latencies),
+            'errors': results.errors.get(route, 0),
+            'rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    return routes
+
+
+def print_table(routes, total_rps):
+    print(f'{"route":34} {"requests":>9} {"errors":>7} {"rps":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for route, row in routes.items():
+        print(f'{route:34} {row["requests"]:>9} {row["errors"]:>7} {row["rps"]:>8.1f} '
+              f'{row["p50_ms"]:>8.2f} {row["p95_ms"]:>8.2f} {row["p99_ms"]:>8.2f}')
+    print(f'total: {total_rps:.1f} requests/s')
+
+
+def compare(routes, baseline, tolerance):
+    """Print changes against a baseline; returns the routes that regressed."""
+    regressed = []
+    print(f'\nagainst {baseline.get("commit") or "baseline"} (tolerance {tolerance:.0%}):')
+    for route, row in routes.items():
+        before = baseline['routes'].get(route)
+        if before is None:
+            print(f'  {route}: new')
+            continue
+        p95 = row['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+        rps = row['rps'] / before['rps'] - 1 if before['rps'] else 0.0
+        worse = p95 > tolerance or rps < -tolerance
+        print(f'  {route}: p95 {before["p95_ms"]:.2f} -> {row["p95_ms"]:.2f} ms ({p95:+.0%}), '
+              f'rps {before["rps"]:.1f} -> {row["rps"]:.1f} ({rps:+.0%}){"  REGRESSION" if worse else ""}')
+        if worse:
+            regressed.append(route)
+    return regressed
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='database from dataset.py (default: a small generated one)')
+    parser.add_argument('--url', help='load a running server instead of the in-process test client')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'default: {DEFAULT_MIX}')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = args.db
+        if database is None:
+            database = os.path.join(tmp, 'bench.db')
+            dataset.generate(database, users=5000, bookings=50000, issues=5000, notifications=200000,
+                             seed_value=args.seed, progress=lambda message: None)
+        conn = dataset.db.connect(database)
+        user_counts = {row[0]: row[1] for row in conn.execute('SELECT role, COUNT(*) FROM users GROUP BY role')}
+        rooms = conn.execute('SELECT COUNT(*) FROM rooms').fetchone()[0]
+        sizes = {table: conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0] or 0
+                 for table in ('users', 'bookings', 'notifications')}
+        conn.close()
+
+        if args.url:
+            def make_session():
+                return HttpSession(args.url)
+        else:
+            from app import create_app
+            app = create_app({'DATABASE': database, 'NOISE_MONITOR': False})
+
+            def make_session():
+                return TestClientSession(app)
+
+        roles = [role for role in args.mix if user_counts.get(role)]
+        rng = random.Random(args.seed)
+        assigned = rng.choices(roles, [args.mix[role] for role in roles], k=args.clients)
+        results = Results()
+        deadline = time.monotonic() + args.duration
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(make_session, role, user_counts[role], rooms, deadline,
+                                                         args.seed * 1000 + i, results))
+                   for i, role in enumerate(assigned)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    routes = summarize(results, elapsed)
+    total_rps = sum(row['requests'] for row in routes.values()) / elapsed
+    print(f'{args.clients} clients for {elapsed:.1f}s against {args.url or "the test client"}; '
+          f'{sizes["users"]:,} users, {sizes["bookings"]:,} bookings, {sizes["notifications"]:,} notifications')
+    print_table(routes, total_rps)
+
+    report = {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'target': args.url or 'test-client',
+        'clients': args.clients,
+        'duration': round(elapsed, 2),
+        'mix': args.mix,
+        'dataset': sizes,
+        'total_rps': round(total_rps, 2),
+        'routes': routes,
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'saved {args.save}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        changed = [key for key in ('target', 'clients', 'mix', 'dataset') if baseline.get(key) != report[key]]
+        if changed:
+            print(f'warning: baseline was run with a different {", ".join(changed)}')
+        if compare(routes, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import re
+
+# Room booking engine.
+#
+# Bookings are indexed as intervals per (room, date): the start_min/end_min
+# generated columns (minutes since midnight, added in schema migration 3) are
+# covered by idx_bookings_interval on (room_id, booking_date, start_min, end_min),
+# so an overlap check is a single index seek into one room's day. The check and
+# the insert run inside the caller's BEGIN IMMEDIATE transaction (see
+# db.transaction()), and the bookings_no_overlap trigger rejects overlapping
+# inserts from any other write path as well.
+
+TIME_RE = re.compile(r'^(\d{1,2}):(\d{2})(?::\d{2})?$')
+
+# Bookings with this status free their slot again
+CANCELLED = 'cancelled'
+
+
+class InvalidBooking(ValueError):
+    pass
+
+
+class BookingConflict(Exception):
+    def __init__(self, booking):
+        super().__init__('Room is already booked for this time slot')
+        self.booking = booking
+
+
+def to_minutes(value):
+    match = TIME_RE.match(value or '')
+    if not match:
+        raise InvalidBooking(f'Invalid time: {value!r}')
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if hours > 24 or minutes > 59 or (hours == 24 and minutes):
+        raise InvalidBooking(f'Invalid time: {value!r}')
+    return hours * 60 + minutes
+
+
+def to_interval(start_time, end_time):
+    start, end = to_minutes(start_time), to_minutes(end_time)
+    if end <= start:
+        raise InvalidBooking('End time must be after start time')
+    return start, end
+
+
+def find_conflict(conn, room_id, booking_date, start, end):
+    # Half-open intervals: [09:00, 10:00) and [10:00, 11:00) do not overlap,
+    # while a booking that contains or is contained by another one does.
+    return conn.execute('''
+        SELECT id, room_id, booking_date, start_time, end_time, user_id FROM bookings
+        WHERE room_id = ? AND booking_date = ?
+        AND start_min < ? AND end_min > ?
+        AND status != ?
+        LIMIT 1
+    ''', (room_id, booking_date, end, start, CANCELLED)).fetchone()
+
+
+def book(conn, room_id, user_id, booking_date, start_time, end_time, purpose):
+    """Insert a booking if the slot is free; conn must be inside BEGIN IMMEDIATE.
+
+    Returns the new booking id, raises BookingConflict or InvalidBooking.
+    """
+    start, end = to_interval(start_time, end_time)
+    conflict = find_conflict(conn, room_id, booking_date, start, end)
+    if conflict is not None:
+        raise BookingConflict(conflict)
+    cursor = conn.execute('''
+        INSERT INTO bookings (room_id, user_id, booking_date, start_time, end_time, purpose)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (room_id, user_id, booking_date, format_minutes(start), format_minutes(end), purpose))
+    return cursor.lastrowid
+
+
+def free_rooms(conn, booking_date, start_time, end_time):
+    """Rooms with status 'available' and no booking overlapping the slot, in one query."""
+    start, end = to_interval(start_time, end_time)
+    return conn.execute('''
+        SELECT r.* FROM rooms r
+        WHERE r.status = 'available'
+        AND NOT EXISTS (
+            SELECT 1 FROM bookings b
+            WHERE b.room_id = r.id AND b.booking_date = ?
+            AND b.start_min < ? AND b.end_min > ?
+            AND b.status != ?
+        )
+        ORDER BY r.room_name
+    ''', (booking_date, end, start, CANCELLED)).fetchall()
+
+
+def format_minutes(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
@@ -0,0 +1,394 @@
+import csv
+import io
+import json
+
+import click
+from flask import Response, current_app, jsonify, request
+from flask.cli import AppGroup
+
+import backup
+import bookings
+import cache
+import db
+import listing
+import sessions
+from seed import insert_missing
+
+# Bulk import and export of reference data.
+#
+# An import is validated row by row and upserted on the natural key of its
+# table (the same keys seed.py uses) inside a single transaction: each batch
+# is one executemany UPDATE of the rows that already exist followed by one
+# executemany INSERT of the ones that do not. Any invalid row rejects the
+# whole import unless skip_invalid is set, in which case only the valid rows
+# are written. Exports stream through listing.iter_rows.
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+MEAL_TYPES = ('breakfast', 'lunch', 'dinner', 'snack')
+# Only 'available' rooms are offered for booking; the others take a room out of it
+ROOM_STATUSES = ('available', 'unavailable', 'maintenance')
+REQUIRED = object()
+IGNORED_COLUMNS = ('id',)
+
+
+class InvalidImport(ValueError):
+    """The file as a whole cannot be imported (bad format or header)."""
+
+
+class ImportRejected(Exception):
+    """Some rows were invalid; nothing was written."""
+
+    def __init__(self, result):
+        super().__init__(f'{result["error_count"]} invalid rows')
+        self.result = result
+
+
+def text(value):
+    value = str(value).strip()
+    if len(value) > 200:
+        raise ValueError('must be at most 200 characters')
+    return value
+
+
+def integer(value):
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise ValueError('must be a whole number')
+    if number < 0:
+        raise ValueError('must not be negative')
+    return number
+
+
+def price(value):
+    try:
+        amount = float(str(value).strip())
+    except ValueError:
+        raise ValueError('must be a number')
+    if amount < 0:
+        raise ValueError('must not be negative')
+    return round(amount, 2)
+
+
+def time_of_day(value):
+    try:
+        return bookings.format_minutes(bookings.to_minutes(str(value).strip()))
+    except bookings.InvalidBooking:
+        raise ValueError('must be a time as HH:MM')
+
+
+def weekday(value):
+    day = str(value).strip().capitalize()
+    if day not in DAYS:
+        raise ValueError(f'must be one of {", ".join(DAYS)}')
+    return day
+
+
+def boolean(value):
+    flag = str(value).strip().lower()
+    if flag in ('1', 'true', 'yes'):
+        return 1
+    if flag in ('0', 'false', 'no'):
+        return 0
+    raise ValueError('must be 1/0, true/false or yes/no')
+
+
+def choice(*allowed):
+    def parse(value):
+        value = str(value).strip().lower()
+        if value not in allowed:
+            raise ValueError(f'must be one of {", ".join(allowed)}')
+        return value
+    return parse
+
+
+# table -> roles allowed to import/export, natural key, [(column, parser, default)]
+TABLES = {
+    'rooms': {
+        'roles': ('admin',),
+        'key': ('room_name',),
+        'columns': [
+            ('room_name', text, REQUIRED),
+            ('capacity', integer, None),
+            ('room_type', text, None),
+            ('status', choice(*ROOM_STATUSES), 'available'),
+        ],
+    },
+    'bus_routes': {
+        'roles': ('buscoordinator', 'admin'),
+        'key': ('route_name', 'departure_time'),
+        'columns': [
+            ('route_name', text, REQUIRED),
+            ('departure_time', time_of_day, REQUIRED),
+            ('destination', text, REQUIRED),
+            ('status', choice('active', 'inactive'), 'active'),
+        ],
+    },
+    'canteen_menu': {
+        'roles': ('chef', 'admin'),
+        'key': ('day_of_week', 'meal_type', 'item_name'),
+        'columns': [
+            ('day_of_week', weekday, REQUIRED),
+            ('meal_type', choice(*MEAL_TYPES), REQUIRED),
+            ('item_name', text, REQUIRED),
+            ('price', price, REQUIRED),
+            ('available', boolean, 1),
+        ],
+    },
+}
+
+
+def import_columns(table, header):
+    """Columns of table present in header, in table order; rejects unknown or missing ones."""
+    spec = TABLES[table]
+    known = [name for name, _, _ in spec['columns']]
+    header = [name.strip() for name in header if name and name.strip()]
+    unknown = [name for name in header if name not in known and name not in IGNORED_COLUMNS]
+    if unknown:
+        raise InvalidImport(f'Unknown columns: {", ".join(unknown)}')
+    missing = [name for name, _, default in spec['columns'] if default is REQUIRED and name not in header]
+    if missing:
+        raise InvalidImport(f'Missing required columns: {", ".join(missing)}')
+    return [name for name in known if name in header]
+
+
+def validate(spec, columns, record):
+    values, errors = {}, {}
+    for name, parse, default in spec['columns']:
+        if name not in columns:
+            continue
+        raw = record.get(name)
+        if raw is None or str(raw).strip() == '':
+            if default is REQUIRED:
+                errors[name] = 'is required'
+            else:
+                values[name] = default
+            continue
+        try:
+            values[name] = parse(raw)
+        except ValueError as exc:
+            errors[name] = str(exc)
+    return values, errors
+
+
+def write_batch(conn, table, columns, rows):
+    """Upsert rows (dicts) on the table's natural key; returns (inserted, updated)."""
+    key = TABLES[table]['key']
+    others = [name for name in columns if name not in key]
+    if others:
+        conn.executemany(
+            f'UPDATE {table} SET {", ".join(f"{name} = ?" for name in others)} '
+            f'WHERE {" AND ".join(f"{name} = ?" for name in key)}',
+            [tuple(row[name] for name in others) + tuple(row[name] for name in key) for row in rows])
+    inserted = insert_missing(conn, table, columns, key, [tuple(row[name] for name in columns) for row in rows])
+    return inserted, len(rows) - inserted
+
+
+def import_rows(conn, table, header, records, skip_invalid=False, dry_run=False, batch_size=BATCH_SIZE):
+    """Validate and upsert records (dicts) inside the caller's transaction.
+
+    Raises ImportRejected if any row is invalid and skip_invalid is not set;
+    the caller's transaction must then be rolled back. Returns a summary with
+    per-row errors (row numbers start at 1).
+    """
+    spec = TABLES[table]
+    columns = import_columns(table, header)
+    result = {'table': table, 'rows': 0, 'valid': 0, 'inserted': 0, 'updated': 0,
+              'error_count': 0, 'errors': [], 'dry_run': dry_run}
+    batch = {}
+
+    def flush():
+        if batch and not dry_run:
+            inserted, updated = write_batch(conn, table, columns, list(batch.values()))
+            result['inserted'] += inserted
+            result['updated'] += updated
+        batch.clear()
+
+    for number, record in enumerate(records, start=1):
+        result['rows'] = number
+        if not isinstance(record, dict):
+            values, errors = {}, {'row': 'must be an object'}
+        else:
+            values, errors = validate(spec, columns, record)
+        if errors:
+            result['error_count'] += 1
+            if len(result['errors']) < MAX_REPORTED_ERRORS:
+                result['errors'].append({'row': number, 'errors': errors})
+            continue
+        result['valid'] += 1
+        if result['error_count'] and not skip_invalid:
+            # Keep validating to report every error, but stop writing
+            batch.clear()
+            continue
+        # A key repeated within the file: the last row wins
+        batch[tuple(values[name] for name in spec['key'])] = values
+        if len(batch) >= batch_size:
+            flush()
+    if result['error_count'] and not skip_invalid:
+        raise ImportRejected(result)
+    flush()
+    if not dry_run and (result['inserted'] or result['updated']):
+        cache.invalidate(table)
+    return result
+
+
+def read_csv(stream):
+    """(header, iterator of dicts) from a binary CSV stream, read incrementally."""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    try:
+        header = reader.fieldnames
+    except (csv.Error, UnicodeDecodeError) as exc:
+        raise InvalidImport(f'Invalid CSV: {exc}')
+    if header is None:
+        raise InvalidImport('The file is empty')
+    header = reader.fieldnames = [name.strip() for name in header]
+
+    def records():
+        try:
+            yield from reader
+        except (csv.Error, UnicodeDecodeError) as exc:
+            raise InvalidImport(f'Invalid CSV after line {reader.line_num}: {exc}')
+    return header, records()
+
+
+def read_json(stream):
+    """(header, list of dicts) from a JSON array of objects or {"rows": [...]}."""
+    try:
+        data = json.load(stream)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise InvalidImport(f'Invalid JSON: {exc}')
+    if isinstance(data, dict):
+        data = data.get('rows')
+    if not isinstance(data, list):
+        raise InvalidImport('Expected a JSON array of objects')
+    header = list(dict.fromkeys(name for record in data if isinstance(record, dict) for name in record))
+    return header, data
+
+
+def read_file(stream, file_format):
+    if file_format == 'csv':
+        return read_csv(stream)
+    if file_format == 'json':
+        return read_json(stream)
+    raise InvalidImport('format must be csv or json')
+
+
+def run_import(table, stream, file_format, skip_invalid=False, dry_run=False):
+    """Parse and import in one write transaction; returns the summary."""
+    with db.transaction() as conn:
+        header, records = read_file(stream, file_format)
+        return import_rows(conn, table, header, records, skip_invalid=skip_invalid, dry_run=dry_run)
+
+
+def export_rows(conn, table, file_format):
+    columns = listing.LISTS[table]['columns']
+    rows = listing.iter_rows(conn, table, {})
+    if file_format == 'csv':
+        return listing.export_csv(rows, columns)
+    return listing.export_json(rows, columns)
+
+
+def allowed(table):
+    user = sessions.current_user()
+    return user is not None and user['role'] in TABLES[table]['roles']
+
+
+def request_format():
+    file_format = request.args.get('format')
+    if file_format:
+        return file_format
+    upload = request.files.get('file')
+    name = upload.filename if upload else ''
+    if name.lower().endswith('.csv') or request.mimetype == 'text/csv':
+        return 'csv'
+    return 'json'
+
+
+def bulk_import(table):
+    if not allowed(table):
+        return jsonify({'error': 'Unauthorized'}), 403
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    try:
+        result = run_import(table, stream, request_format(),
+                            skip_invalid=request.args.get('skip_invalid') == '1',
+                            dry_run=request.args.get('dry_run') == '1')
+    except InvalidImport as e:
+        return jsonify({'error': str(e)}), 400
+    except ImportRejected as e:
+        return jsonify(e.result), 422
+    return jsonify(result)
+
+
+def bulk_export(table):
+    if not allowed(table):
+        return jsonify({'error': 'Unauthorized'}), 403
+    file_format = request.args.get('format', 'json')
+    if file_format not in ('json', 'csv'):
+        return jsonify({'error': 'format must be json or csv'}), 400
+    reader = backup.export_reader()
+
+    def generate():
+        # Runs after the view returns, so it holds its own connection
+        with reader as conn:
+            yield from export_rows(conn, table, file_format)
+
+    mimetype = 'text/csv' if file_format == 'csv' else 'application/json'
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={table}.{file_format}',
+                             **reader.headers()})
+
+
+bulk_cli = AppGroup('bulk', help='Bulk import and export of rooms, bus routes and canteen menus.')
+table_argument = click.argument('table', type=click.Choice(sorted(TABLES)))
+format_option = click.option('--format', 'file_format', type=click.Choice(['csv', 'json']),
+                             help='Defaults to the file extension, else csv.')
+
+
+@bulk_cli.command('import')
+@table_argument
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@format_option
+@click.option('--skip-invalid', is_flag=True, help='Import the valid rows even if others fail.')
+@click.option('--dry-run', is_flag=True, help='Validate only; write nothing.')
+def import_command(table, path, file_format, skip_invalid, dry_run):
+    """Upsert rows from a CSV or JSON file."""
+    file_format = file_format or ('json' if path.lower().endswith('.json') else 'csv')
+    try:
+        with open(path, 'rb') as stream:
+            result = run_import(table, stream, file_format, skip_invalid=skip_invalid, dry_run=dry_run)
+    except InvalidImport as e:
+        raise click.ClickException(str(e))
+    except ImportRejected as e:
+        result = e.result
+    for error in result['errors']:
+        details = '; '.join(f'{name} {message}' for name, message in error['errors'].items())
+        click.echo(f'row {error["row"]}: {details}', err=True)
+    if result['error_count'] and not skip_invalid:
+        raise click.ClickException(f'{result["error_count"]} of {result["rows"]} rows invalid; nothing imported.')
+    click.echo(f'{result["rows"]} rows: {result["inserted"]} inserted, {result["updated"]} updated, '
+               f'{result["error_count"]} skipped{" (dry run)" if dry_run else ""}.')
+
+
+@bulk_cli.command('export')
+@table_argument
+@format_option
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='Defaults to stdout.')
+def export_command(table, file_format, output):
+    """Write every row of a table as CSV or JSON."""
+    conn = db.connect(current_app.config['DATABASE'])
+    try:
+        for chunk in export_rows(conn, table, file_format or 'csv'):
+            output.write(chunk)
+    finally:
+        conn.close()
+
+
+def init_app(app):
+    tables = ', '.join(sorted(TABLES))
+    app.add_url_rule(f'/api/bulk/<any({tables}):table>', 'bulk_import', bulk_import, methods=['POST'])
+    app.add_url_rule(f'/api/bulk/<any({tables}):table>/export', 'bulk_export', bulk_export)
+    app.cli.add_command(bulk_cli)
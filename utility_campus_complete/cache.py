@@ -0,0 +1,185 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify
+
+from db import after_commit
+
+try:
+    import fcntl
+except ImportError:  # Windows: cross-process increments fall back to a thread lock
+    fcntl = None
+
+# Read-through cache for reference tables that change rarely.
+#
+# Every cached result remembers the version of the tables it was read from.
+# Write paths bump a table's version after their transaction commits, which
+# makes every dependent entry stale at once. With the 'file' backend the
+# version counters live in a small memory-mapped file, so a write in one
+# gunicorn worker invalidates the caches of all the others.
+
+CACHED_TABLES = ('rooms', 'bus_routes', 'canteen_menu', 'washroom_status', 'teacher_availability',
+                 'bus_stops', 'bus_schedules', 'bus_trip_updates')
+
+SLOT = struct.Struct('<Q')
+
+
+class LocalVersions:
+    def __init__(self, tables):
+        self._versions = dict.fromkeys(tables, 0)
+        self._lock = threading.Lock()
+
+    def get(self, table):
+        return self._versions[table]
+
+    def bump(self, table):
+        with self._lock:
+            self._versions[table] += 1
+
+
+class FileVersions:
+    """Per-table counters in a memory-mapped file shared by every process."""
+
+    def __init__(self, path, tables):
+        self.slots = {table: i for i, table in enumerate(tables)}
+        size = SLOT.size * len(tables)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def get(self, table):
+        return SLOT.unpack_from(self._map, self.slots[table] * SLOT.size)[0]
+
+    def bump(self, table):
+        offset = self.slots[table] * SLOT.size
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                SLOT.pack_into(self._map, offset, SLOT.unpack_from(self._map, offset)[0] + 1)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class ReferenceCache:
+    """Size-bounded LRU with TTL whose entries are tagged with table versions."""
+
+    def __init__(self, versions, maxsize=256, ttl=300.0, tables=CACHED_TABLES):
+        self.versions = versions
+        self.tables = tables
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.settings = None
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get_or_load(self, key, tables, load):
+        tags = tuple(self.versions.get(table) for table in tables)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_tags, expires, value = entry
+                if entry_tags == tags and expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self.stale += 1
+            self.misses += 1
+
+        value = load()
+        with self._lock:
+            self._entries[key] = (tags, now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, table):
+        self.versions.bump(table)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'versions': {table: self.versions.get(table) for table in self.tables},
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    config = current_app.config
+    settings = (os.getpid(), config['CACHE_BACKEND'], config['CACHE_VERSION_FILE'])
+    # Rebuilt after a fork so every worker holds its own lock on the version file
+    if _cache is None or _cache.settings != settings:
+        with _cache_lock:
+            if _cache is None or _cache.settings != settings:
+                if config['CACHE_BACKEND'] == 'file':
+                    versions = FileVersions(config['CACHE_VERSION_FILE'], CACHED_TABLES)
+                else:
+                    versions = LocalVersions(CACHED_TABLES)
+                _cache = ReferenceCache(versions, maxsize=config['CACHE_MAXSIZE'], ttl=config['CACHE_TTL'])
+                _cache.settings = settings
+    return _cache
+
+
+def query(conn, tables, sql, params=()):
+    """Run a read query through the cache; tables lists every table it reads."""
+    if isinstance(tables, str):
+        tables = (tables,)
+    return get_cache().get_or_load(
+        (sql, tuple(params)), tables,
+        lambda: tuple(conn.execute(sql, params).fetchall()),
+    )
+
+
+def invalidate(*tables):
+    # Call inside db.transaction(): the bump happens only once the write is
+    # committed, so no worker can re-cache the old rows in between.
+    cache = get_cache()
+
+    def bump():
+        for table in tables:
+            cache.invalidate(table)
+    after_commit(bump)
+
+
+def cache_stats():
+    return jsonify(get_cache().stats())
+
+
+def init_app(app):
+    app.config.setdefault('CACHE_BACKEND', os.environ.get('CAMPUS_CACHE_BACKEND', 'local'))
+    app.config.setdefault('CACHE_VERSION_FILE', os.environ.get('CAMPUS_CACHE_VERSION_FILE', 'campus.cache-versions'))
+    app.config.setdefault('CACHE_MAXSIZE', 256)
+    app.config.setdefault('CACHE_TTL', 300)
+    # sessions is built on this module, so its check is applied here rather than at import
+    from sessions import login_required
+    app.add_url_rule('/api/admin/cache_stats', 'cache_stats', login_required('admin', api=True)(cache_stats))
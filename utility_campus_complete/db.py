@@ -0,0 +1,233 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from flask import current_app, g, jsonify
+
+import instrumentation
+
+# Pragmas applied once to every pooled connection when it is opened.
+# journal_mode=WAL is persistent in the database file, the rest are per connection.
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -16000),
+    ('temp_store', 'MEMORY'),
+)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def connect(database, pragmas=CONNECTION_PRAGMAS, uri=False):
+    # Autocommit mode: reads never hold a transaction open, writes go through
+    # transaction() which issues its own BEGIN IMMEDIATE.
+    conn = sqlite3.connect(database, check_same_thread=False, isolation_level=None, uri=uri,
+                           factory=instrumentation.InstrumentedConnection)
+    conn.row_factory = sqlite3.Row
+    for name, value in pragmas:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def utc_timestamp(at=None):
+    """A datetime as stored by CURRENT_TIMESTAMP ('YYYY-MM-DD HH:MM:SS', UTC)."""
+    at = at or datetime.now(timezone.utc)
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class ConnectionPool:
+    """Bounded pool of reader connections plus one serialized writer connection."""
+
+    def __init__(self, database, size=8, timeout=10.0):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        self._on_commit = []
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'writer_acquires': 0,
+            'writer_wait_time_total': 0.0,
+        }
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._stats['hits'] += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                self._stats['misses'] += 1
+                open_new = True
+            else:
+                open_new = False
+
+        if open_new:
+            try:
+                return connect(self.database)
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        # Pool exhausted: wait for a connection to be released
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f'No database connection available after {self.timeout}s')
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._stats['waits'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def writer(self):
+        # One writer connection per process; BEGIN IMMEDIATE takes the database
+        # write lock up front so concurrent processes queue on busy_timeout
+        # instead of failing half way through a transaction.
+        started = time.perf_counter()
+        with self._writer_lock:
+            waited = time.perf_counter() - started
+            with self._lock:
+                self._stats['writer_acquires'] += 1
+                self._stats['writer_wait_time_total'] += waited
+            if self._writer is None:
+                self._writer = connect(self.database)
+            conn = self._writer
+            if conn.in_transaction:
+                # Nested use from the same thread joins the outer transaction
+                yield conn
+                return
+            conn.execute('BEGIN IMMEDIATE')
+            self._on_commit = []
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                self._on_commit = []
+                raise
+            else:
+                conn.commit()
+                callbacks, self._on_commit = self._on_commit, []
+                for callback in callbacks:
+                    callback()
+
+    def after_commit(self, callback):
+        # Only meaningful inside writer(); runs once the transaction has committed
+        self._on_commit.append(callback)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._opened
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['open'] - stats['idle']
+        requests = stats['hits'] + stats['misses'] + stats['waits']
+        stats['hit_rate'] = round(stats['hits'] / requests, 4) if requests else 0.0
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['waits'] if stats['waits'] else 0.0
+        return stats
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._lock:
+            self._opened = 0
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    database = current_app.config['DATABASE']
+    # Rebuild after a fork (gunicorn preload) or if the app was reconfigured
+    if _pool is None or _pool.pid != os.getpid() or _pool.database != database:
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid() or _pool.database != database:
+                _pool = ConnectionPool(
+                    database,
+                    size=current_app.config['DB_POOL_SIZE'],
+                    timeout=current_app.config['DB_POOL_TIMEOUT'],
+                )
+    return _pool
+
+
+def get_db():
+    # Request-scoped reader connection, returned to the pool on teardown
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+@contextmanager
+def transaction():
+    with get_pool().writer() as conn:
+        yield conn
+
+
+def after_commit(callback):
+    get_pool().after_commit(callback)
+
+
+def close_db(e=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def db_stats():
+    return jsonify(get_pool().stats())
+
+
+def init_app(app):
+    app.config.setdefault('DATABASE', os.environ.get('CAMPUS_DB', 'campus.db'))
+    app.config.setdefault('DB_POOL_SIZE', int(os.environ.get('CAMPUS_DB_POOL_SIZE', 8)))
+    app.config.setdefault('DB_POOL_TIMEOUT', float(os.environ.get('CAMPUS_DB_POOL_TIMEOUT', 10)))
+    app.teardown_appcontext(close_db)
+    # sessions is built on this module, so its check is applied here rather than at import
+    from sessions import login_required
+    app.add_url_rule('/api/admin/db_stats', 'db_stats', login_required('admin', api=True)(db_stats))
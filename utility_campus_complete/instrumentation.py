@@ -0,0 +1,314 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from flask import Response, current_app, g, jsonify, request, session, template_rendered, before_render_template
+
+import db
+
+# Request timing, SQL instrumentation and sampled profiling.
+#
+# Every connection from db.connect() is an InstrumentedConnection. While a
+# request is running its thread has a RequestRecorder, and each execute()
+# adds the statement's latency to it (time until SQLite returns the first
+# row; rows fetched later are not counted). Statements slower than
+# SLOW_QUERY_MS are logged with their EXPLAIN QUERY PLAN, and the same
+# statement run N_PLUS_ONE_THRESHOLD or more times in one request is
+# reported as a likely N+1. Background threads have no recorder and pay
+# only a thread-local lookup per statement.
+#
+# Histograms live in this process only: with several workers each one
+# serves its own /metrics, so scrape every worker or aggregate upstream.
+
+logger = logging.getLogger(__name__)
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+SLOW_LOG_SIZE = 100
+
+_local = threading.local()
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: (list(counts), count, total) for labels, (counts, count, total) in self._series.items()}
+        for labels, (counts, count, total) in sorted(series.items()):
+            base = format_labels(self.label_names, labels)
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{base}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{base}}} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f'{self.name}{{{format_labels(self.label_names, labels)}}} {value}')
+        return lines
+
+
+def format_labels(names, values):
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values))
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram('campus_request_duration_seconds', 'Time to build a response, by endpoint.',
+                            ('endpoint', 'method', 'status'), REQUEST_BUCKETS)
+REQUEST_QUERIES = Histogram('campus_request_queries', 'SQL statements run per request.',
+                            ('endpoint',), COUNT_BUCKETS)
+QUERY_SECONDS = Histogram('campus_query_duration_seconds', 'SQL statement latency, by endpoint.',
+                          ('endpoint',), QUERY_BUCKETS)
+TEMPLATE_SECONDS = Histogram('campus_template_render_seconds', 'Template render time.',
+                             ('template',), REQUEST_BUCKETS)
+SLOW_QUERIES = Counter('campus_slow_queries_total', 'Statements slower than SLOW_QUERY_MS.', ('endpoint',))
+N_PLUS_ONE = Counter('campus_n_plus_one_total', 'Requests that repeated one statement too often.', ('endpoint',))
+
+_slow_log = deque(maxlen=SLOW_LOG_SIZE)
+
+
+def normalize(sql):
+    return ' '.join(sql.split())
+
+
+class RequestRecorder:
+    __slots__ = ('endpoint', 'started', 'queries', 'query_seconds', 'statements', 'slow_ms', 'template_seconds')
+
+    def __init__(self, endpoint, slow_ms):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.statements = {}
+        self.slow_ms = slow_ms
+        self.template_seconds = 0.0
+
+    def record(self, conn, sql, params, elapsed, many=False):
+        self.queries += 1
+        self.query_seconds += elapsed
+        self.statements[sql] = self.statements.get(sql, 0) + 1
+        QUERY_SECONDS.observe((self.endpoint,), elapsed)
+        if elapsed * 1000 >= self.slow_ms:
+            self.slow(conn, sql, params, elapsed, many)
+
+    def slow(self, conn, sql, params, elapsed, many):
+        plan = []
+        if not many and EXPLAINABLE.match(sql):
+            try:
+                plan = [row[3] for row in sqlite3.Connection.execute(conn, f'EXPLAIN QUERY PLAN {sql}', params)]
+            except sqlite3.Error:
+                pass
+        entry = {
+            'endpoint': self.endpoint,
+            'ms': round(elapsed * 1000, 2),
+            'sql': normalize(sql),
+            'plan': plan,
+            'at': time.time(),
+        }
+        _slow_log.append(entry)
+        SLOW_QUERIES.inc((self.endpoint,))
+        logger.warning('Slow query in %s (%.1f ms): %s\n  plan: %s', self.endpoint, entry['ms'], entry['sql'],
+                       '; '.join(plan) or 'n/a')
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection that reports statement latency to the current request."""
+
+    def execute(self, sql, parameters=()):
+        recorder = getattr(_local, 'recorder', None)
+        if recorder is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        recorder.record(self, sql, parameters, time.perf_counter() - started)
+        return cursor
+
+    def executemany(self, sql, parameters):
+        recorder = getattr(_local, 'recorder', None)
+        if recorder is None:
+            return super().executemany(sql, parameters)
+        started = time.perf_counter()
+        cursor = super().executemany(sql, parameters)
+        recorder.record(self, sql, (), time.perf_counter() - started, many=True)
+        return cursor
+
+
+def current_recorder():
+    return getattr(_local, 'recorder', None)
+
+
+def wants_profile():
+    config = current_app.config
+    if request.headers.get('X-Profile') == '1' and (config['PROFILE_HEADER'] or session.get('role') == 'admin'):
+        return True
+    rate = config['PROFILE_SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+
+def start_request():
+    if not current_app.config['INSTRUMENTATION']:
+        return
+    _local.recorder = RequestRecorder(request.endpoint or 'unknown', current_app.config['SLOW_QUERY_MS'])
+    _local.templates = []
+    if wants_profile():
+        profiler = cProfile.Profile()
+        g.profiler = profiler
+        profiler.enable()
+
+
+def finish_request(response):
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None:
+        return response
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        response.headers['X-Profile-File'] = save_profile(profiler, recorder.endpoint)
+    elapsed = time.perf_counter() - recorder.started
+    REQUEST_SECONDS.observe((recorder.endpoint, request.method, str(response.status_code)), elapsed)
+    REQUEST_QUERIES.observe((recorder.endpoint,), recorder.queries)
+    response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.1f}')
+    response.headers.add('Server-Timing', f'db;dur={recorder.query_seconds * 1000:.1f};desc="{recorder.queries} queries"')
+    if recorder.template_seconds:
+        response.headers.add('Server-Timing', f'render;dur={recorder.template_seconds * 1000:.1f}')
+    threshold = current_app.config['N_PLUS_ONE_THRESHOLD']
+    repeated = [(sql, count) for sql, count in recorder.statements.items() if count >= threshold]
+    if repeated:
+        N_PLUS_ONE.inc((recorder.endpoint,))
+        for sql, count in repeated:
+            logger.warning('Possible N+1 in %s: statement ran %d times: %s', recorder.endpoint, count, normalize(sql))
+    return response
+
+
+def clear_request(exc=None):
+    # Runs even when the view raised, so a recorder never leaks into the next request
+    _local.recorder = None
+    _local.templates = []
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+
+
+def save_profile(profiler, endpoint):
+    directory = current_app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{endpoint}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{random.randrange(1 << 16):04x}.prof')
+    profiler.dump_stats(path)
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(15)
+    logger.info('Profile for %s saved to %s\n%s', endpoint, path, summary.getvalue())
+    return os.path.basename(path)
+
+
+def template_started(sender, template, context, **extra):
+    templates = getattr(_local, 'templates', None)
+    if templates is not None:
+        templates.append(time.perf_counter())
+
+
+def template_finished(sender, template, context, **extra):
+    templates = getattr(_local, 'templates', None)
+    if not templates:
+        return
+    elapsed = time.perf_counter() - templates.pop()
+    TEMPLATE_SECONDS.observe((template.name or 'string',), elapsed)
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is not None and not templates:
+        recorder.template_seconds += elapsed
+
+
+def render_metrics():
+    lines = []
+    for metric in (REQUEST_SECONDS, REQUEST_QUERIES, QUERY_SECONDS, TEMPLATE_SECONDS, SLOW_QUERIES, N_PLUS_ONE):
+        lines.extend(metric.render())
+    stats = db.get_pool().stats()
+    for name in ('open', 'in_use', 'idle', 'waits', 'timeouts'):
+        kind = 'counter' if name in ('waits', 'timeouts') else 'gauge'
+        lines.append(f'# TYPE campus_db_pool_{name} {kind}')
+        lines.append(f'campus_db_pool_{name} {stats[name]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def slow_queries():
+    return jsonify(list(reversed(_slow_log)))
+
+
+def init_app(app):
+    app.config.setdefault('INSTRUMENTATION', os.environ.get('CAMPUS_INSTRUMENTATION', '1') == '1')
+    app.config.setdefault('SLOW_QUERY_MS', float(os.environ.get('CAMPUS_SLOW_QUERY_MS', 100)))
+    app.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+    app.config.setdefault('METRICS_TOKEN', os.environ.get('CAMPUS_METRICS_TOKEN'))
+    # Sampled cProfile: a fraction of requests, or X-Profile: 1 from admins
+    # (from anyone when PROFILE_HEADER is on)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', float(os.environ.get('CAMPUS_PROFILE_SAMPLE_RATE', 0)))
+    app.config.setdefault('PROFILE_HEADER', False)
+    app.config.setdefault('PROFILE_DIR', os.environ.get('CAMPUS_PROFILE_DIR', 'profiles'))
+    # Registered first so the timing covers the other before_request hooks
+    app.before_request_funcs.setdefault(None, []).insert(0, start_request)
+    app.after_request(finish_request)
+    app.teardown_request(clear_request)
+    before_render_template.connect(template_started, app)
+    template_rendered.connect(template_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    # sessions imports db, which imports this module, so the check is applied here rather than at import
+    from sessions import login_required
+    app.add_url_rule('/api/admin/slow_queries', 'slow_queries', login_required('admin', api=True)(slow_queries))
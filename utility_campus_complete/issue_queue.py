@@ -0,0 +1,441 @@
+import atexit
+import heapq
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, jsonify, request, session
+from flask.cli import AppGroup
+
+import notifications
+import sessions
+from db import get_db, transaction, utc_timestamp
+
+# Issue triage queue.
+#
+# Every issue has a numeric priority_rank (urgent 0 .. low 3, a generated
+# column from schema version 12) and moves through the statuses in
+# TRANSITIONS; each move stamps claimed_at/resolved_at/updated_at on the row
+# and appends an issue_events row, so an issue's history reads straight from
+# the table. A queue is the unclaimed open issues of some categories, or of
+# one location, in claim order: most urgent first, then oldest. The partial
+# indexes idx_issues_queue* hold exactly those rows in that order, so taking
+# the head of a queue reads a few index entries however many issues have
+# ever been reported. Several categories are merged from their per-category
+# heads.
+#
+# claim_next() picks the head and assigns it inside one write transaction.
+# Writers are serialized (BEGIN IMMEDIATE), and the UPDATE only matches a
+# row that is still open and unassigned, so two staff claiming at the same
+# moment always get different issues.
+#
+# ISSUE_QUEUE_ROLES maps staff roles to the categories they handle (None for
+# all of them). The SLA check marks issues still open or in progress past
+# ISSUE_SLA_MINUTES for their priority, in batches of ISSUE_SLA_BATCH, and
+# tells the assignee, or the staff for that category when nobody has claimed
+# it. Each worker runs it every ISSUE_SLA_INTERVAL seconds (0 turns the
+# background job off; `flask issues sla-check` runs it once). Only rows not
+# yet marked are updated, so running it in several workers notifies once.
+
+PRIORITIES = ('urgent', 'high', 'medium', 'low')
+STATUSES = ('open', 'in_progress', 'resolved', 'closed')
+TRANSITIONS = {
+    'open': ('in_progress', 'resolved', 'closed'),
+    'in_progress': ('open', 'resolved', 'closed'),
+    'resolved': ('open', 'closed'),
+    'closed': ('open',),
+}
+# Columns stamped when an issue moves into a status
+STATUS_STAMPS = {
+    'open': 'assigned_to = NULL, claimed_at = NULL, resolved_at = NULL',
+    'in_progress': 'assigned_to = COALESCE(assigned_to, :actor), claimed_at = COALESCE(claimed_at, CURRENT_TIMESTAMP)',
+    'resolved': 'resolved_at = CURRENT_TIMESTAMP',
+    'closed': 'resolved_at = COALESCE(resolved_at, CURRENT_TIMESTAMP)',
+}
+COLUMNS = '''
+    id, user_id, category, description, location, priority, priority_rank, status, assigned_to,
+    created_at, claimed_at, resolved_at, updated_at, sla_breached_at
+'''
+UNCLAIMED = "status = 'open' AND assigned_to IS NULL"
+QUEUE_ORDER = 'priority_rank, created_at, id'
+MAX_LIMIT = 100
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidIssue(ValueError):
+    pass
+
+
+def queue_key(issue):
+    return issue['priority_rank'], issue['created_at'], issue['id']
+
+
+def record_event(conn, issue_id, event, actor_id=None, from_status=None, to_status=None, note=None):
+    conn.execute('''
+        INSERT INTO issue_events (issue_id, event, from_status, to_status, actor_id, note)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (issue_id, event, from_status, to_status, actor_id, note))
+
+
+def report(conn, user_id, category, description, location, priority='medium'):
+    """Log a new issue inside the caller's transaction; returns its id."""
+    if priority not in PRIORITIES:
+        raise InvalidIssue(f'Unknown priority: {priority!r}')
+    issue_id = conn.execute('''
+        INSERT INTO issues (user_id, category, description, location, priority, updated_at)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (user_id, category, description, location, priority)).lastrowid
+    record_event(conn, issue_id, 'reported', user_id, to_status='open')
+    notifications.notify(conn, user_id, 'Issue Reported',
+                         f'Your {category} issue at {location} has been logged', 'issue')
+    return issue_id
+
+
+def queue(conn, categories=None, location=None, limit=20):
+    """Unclaimed open issues in claim order.
+
+    categories is a list of categories (None for every category) and location
+    narrows the queue to one place.
+    """
+    if categories is not None and not categories:
+        return []
+    if location is not None:
+        sql = f'SELECT {COLUMNS} FROM issues WHERE location = ? AND {UNCLAIMED}'
+        params = [location]
+        if categories is not None:
+            sql += f' AND category IN ({", ".join("?" * len(categories))})'
+            params += categories
+        return conn.execute(f'{sql} ORDER BY {QUEUE_ORDER} LIMIT ?', params + [limit]).fetchall()
+    if categories is None:
+        # Without table statistics the planner would pick idx_issues_status and sort every open issue
+        return conn.execute(f'SELECT {COLUMNS} FROM issues INDEXED BY idx_issues_queue WHERE {UNCLAIMED} '
+                            f'ORDER BY {QUEUE_ORDER} LIMIT ?', (limit,)).fetchall()
+    # One short range scan per category, merged on the queue key
+    heads = [conn.execute(f'SELECT {COLUMNS} FROM issues WHERE category = ? AND {UNCLAIMED} '
+                          f'ORDER BY {QUEUE_ORDER} LIMIT ?', (category, limit)).fetchall()
+             for category in dict.fromkeys(categories)]
+    return list(heapq.merge(*heads, key=queue_key))[:limit]
+
+
+def assigned(conn, user_id, limit=50):
+    """Issues a staff member has claimed and not finished, most urgent first."""
+    return conn.execute(f'''
+        SELECT {COLUMNS} FROM issues WHERE assigned_to = ? AND status = 'in_progress'
+        ORDER BY {QUEUE_ORDER} LIMIT ?
+    ''', (user_id, limit)).fetchall()
+
+
+def get_issue(conn, issue_id):
+    return conn.execute(f'SELECT {COLUMNS} FROM issues WHERE id = ?', (issue_id,)).fetchone()
+
+
+def history(conn, issue_id):
+    return conn.execute('''
+        SELECT e.event, e.from_status, e.to_status, e.note, e.created_at, u.username AS actor
+        FROM issue_events e LEFT JOIN users u ON u.id = e.actor_id
+        WHERE e.issue_id = ? ORDER BY e.id
+    ''', (issue_id,)).fetchall()
+
+
+def claim_next(conn, user_id, categories=None, location=None):
+    """Assign the head of a queue to user_id; returns the issue or None when the queue is empty.
+
+    Must run inside transaction(), which holds the write lock from the read
+    of the head to the update.
+    """
+    for candidate in queue(conn, categories, location, limit=1):
+        issue = conn.execute(f'''
+            UPDATE issues SET status = 'in_progress', assigned_to = ?, claimed_at = CURRENT_TIMESTAMP,
+                              updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND {UNCLAIMED} RETURNING {COLUMNS}
+        ''', (user_id, candidate['id'])).fetchone()
+        if issue is not None:
+            record_event(conn, issue['id'], 'claimed', user_id, 'open', 'in_progress')
+            return issue
+    return None
+
+
+def transition(conn, issue_id, to_status, actor_id, note=None):
+    """Move an issue to to_status inside the caller's transaction.
+
+    Returns the updated issue, or None if there is no such issue. Raises
+    InvalidIssue when the move is not in TRANSITIONS. The reporter is told
+    when their issue is resolved or closed.
+    """
+    if to_status not in STATUSES:
+        raise InvalidIssue(f'Unknown status: {to_status!r}')
+    issue = get_issue(conn, issue_id)
+    if issue is None:
+        return None
+    if to_status not in TRANSITIONS.get(issue['status'], ()):
+        raise InvalidIssue(f"A {issue['status'].replace('_', ' ')} issue cannot be moved to "
+                           f"{to_status.replace('_', ' ')}")
+    updated = conn.execute(f'''
+        UPDATE issues SET status = :to_status, updated_at = CURRENT_TIMESTAMP, {STATUS_STAMPS[to_status]}
+        WHERE id = :id RETURNING {COLUMNS}
+    ''', {'to_status': to_status, 'actor': actor_id, 'id': issue_id}).fetchone()
+    record_event(conn, issue_id, 'status', actor_id, issue['status'], to_status, note)
+    if to_status in ('resolved', 'closed') and issue['user_id'] is not None:
+        notifications.notify(conn, issue['user_id'], 'Issue Update',
+                             f"Your {issue['category']} issue at {issue['location']} has been "
+                             f"{to_status}" + (f': {note}' if note else ''), 'issue')
+    return updated
+
+
+def set_priority(conn, issue_id, priority, actor_id):
+    """Re-triage an issue; returns the updated issue or None if there is no such issue."""
+    if priority not in PRIORITIES:
+        raise InvalidIssue(f'Unknown priority: {priority!r}')
+    issue = get_issue(conn, issue_id)
+    if issue is None or issue['priority'] == priority:
+        return issue
+    record_event(conn, issue_id, 'priority', actor_id, note=f"{issue['priority']} -> {priority}")
+    return conn.execute(f'''
+        UPDATE issues SET priority = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? RETURNING {COLUMNS}
+    ''', (priority, issue_id)).fetchone()
+
+
+def staff_for(conn, category, roles):
+    """Users whose role handles category explicitly, or the catch-all roles when none does."""
+    dedicated = [role for role, categories in roles.items() if categories is not None and category in categories]
+    handlers = dedicated or [role for role, categories in roles.items() if categories is None]
+    if not handlers:
+        return []
+    return [row[0] for row in conn.execute(
+        f'SELECT id FROM users WHERE role IN ({", ".join("?" * len(handlers))})', handlers)]
+
+
+def mark_breaches(conn, sla_minutes, now, batch_size):
+    """Mark up to batch_size overdue issues per priority; returns the newly marked issues."""
+    now = utc_timestamp(now)
+    breached = []
+    for rank, priority in enumerate(PRIORITIES):
+        minutes = sla_minutes.get(priority)
+        if not minutes:
+            continue
+        deadline = utc_timestamp(datetime.strptime(now, '%Y-%m-%d %H:%M:%S') - timedelta(minutes=minutes))
+        breached += conn.execute(f'''
+            UPDATE issues SET sla_breached_at = ? WHERE id IN (
+                SELECT id FROM issues
+                WHERE sla_breached_at IS NULL AND status IN ('open', 'in_progress')
+                  AND priority_rank = ? AND created_at < ?
+                LIMIT ?
+            ) RETURNING {COLUMNS}
+        ''', (now, rank, deadline, batch_size)).fetchall()
+    conn.executemany(
+        "INSERT INTO issue_events (issue_id, event, to_status, note) VALUES (?, 'sla_breached', ?, ?)",
+        [(issue['id'], issue['status'], f"{PRIORITIES[issue['priority_rank']]} SLA of "
+                                        f"{sla_minutes[PRIORITIES[issue['priority_rank']]]} min")
+         for issue in breached])
+    return breached
+
+
+def check_sla(app, now=None):
+    """Mark and announce every issue past its SLA, one batch per transaction; returns how many."""
+    sla_minutes = app.config['ISSUE_SLA_MINUTES']
+    batch_size = app.config['ISSUE_SLA_BATCH']
+    total = 0
+    with app.app_context():
+        while True:
+            with transaction() as conn:
+                breached = mark_breaches(conn, sla_minutes, now, batch_size)
+                recipients = {}
+                for issue in breached:
+                    targets = ([issue['assigned_to']] if issue['assigned_to'] is not None
+                               else staff_for(conn, issue['category'], app.config['ISSUE_QUEUE_ROLES']))
+                    for user_id in targets:
+                        recipients.setdefault(user_id, []).append(issue)
+                for user_id, issues in recipients.items():
+                    if len(issues) == 1:
+                        issue = issues[0]
+                        message = (f"The {issue['priority']} {issue['category']} issue at {issue['location']} "
+                                   f"(#{issue['id']}) is past its SLA")
+                    else:
+                        message = f"{len(issues)} issues are past their SLA: " + \
+                            ', '.join(f"#{issue['id']}" for issue in issues[:10]) + ('...' if len(issues) > 10 else '')
+                    notifications.notify(conn, user_id, 'SLA Breach', message, 'issue')
+            total += len(breached)
+            # A priority that filled its batch may have more waiting
+            if len(breached) < batch_size:
+                return total
+
+
+class SlaMonitor:
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self.runs = 0
+        self.breached = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='issue-sla', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.breached += check_sla(self.app)
+                self.runs += 1
+            except Exception:
+                logger.exception('Issue SLA check failed')
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def start_sla_monitor():
+    """Start this worker's periodic SLA check, unless ISSUE_SLA_INTERVAL is 0."""
+    global _monitor
+    app = current_app._get_current_object()
+    if not app.config['ISSUE_SLA_INTERVAL']:
+        return
+    settings = (os.getpid(), app.config['DATABASE'])
+    if _monitor is None or _monitor.settings != settings:
+        with _monitor_lock:
+            if _monitor is None or _monitor.settings != settings:
+                if _monitor is not None:
+                    _monitor.stop()
+                monitor = SlaMonitor(app, app.config['ISSUE_SLA_INTERVAL'])
+                monitor.settings = settings
+                monitor.start()
+                atexit.register(monitor.stop)
+                _monitor = monitor
+
+
+def staff_categories(role):
+    """(is staff, categories handled) for a role; categories None means all of them."""
+    roles = current_app.config['ISSUE_QUEUE_ROLES']
+    return role in roles, roles.get(role)
+
+
+def handles(categories, category):
+    return categories is None or category in categories
+
+
+def as_json(issue):
+    return dict(issue)
+
+
+def parse_limit(value, default=20):
+    try:
+        return min(MAX_LIMIT, max(1, int(value))) if value else default
+    except ValueError:
+        raise InvalidIssue('limit must be a whole number')
+
+
+def requested_scope(categories, data):
+    """The queue a request asks for, narrowed to what the caller handles."""
+    category = data.get('category') or None
+    if category is not None and not handles(categories, category):
+        raise PermissionError(category)
+    return [category] if category else categories, data.get('location') or None
+
+
+@sessions.login_required(api=True)
+def issue_queue():
+    is_staff, categories = staff_categories(session['role'])
+    if not is_staff:
+        return jsonify({'error': 'Unauthorized'}), 403
+    try:
+        categories, location = requested_scope(categories, request.args)
+        limit = parse_limit(request.args.get('limit'))
+    except PermissionError:
+        return jsonify({'error': 'Unauthorized'}), 403
+    except InvalidIssue as e:
+        return jsonify({'error': str(e)}), 400
+    conn = get_db()
+    return jsonify({
+        'queue': [as_json(issue) for issue in queue(conn, categories, location, limit)],
+        'mine': [as_json(issue) for issue in assigned(conn, session['user_id'])],
+    })
+
+
+@sessions.login_required(api=True)
+def claim_issue():
+    is_staff, categories = staff_categories(session['role'])
+    if not is_staff:
+        return jsonify({'error': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or request.form
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Send a JSON object or form fields'}), 400
+    try:
+        categories, location = requested_scope(categories, data)
+    except PermissionError:
+        return jsonify({'error': 'Unauthorized'}), 403
+    with transaction() as conn:
+        issue = claim_next(conn, session['user_id'], categories, location)
+    if issue is None:
+        return jsonify({'success': False, 'error': 'No open issues in your queue'}), 404
+    return jsonify({'success': True, 'issue': as_json(issue)})
+
+
+@sessions.login_required(api=True)
+def update_issue(issue_id):
+    is_staff, categories = staff_categories(session['role'])
+    if not is_staff:
+        return jsonify({'error': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or request.form
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Send a JSON object or form fields'}), 400
+    try:
+        with transaction() as conn:
+            issue = get_issue(conn, issue_id)
+            if issue is None:
+                return jsonify({'error': 'Unknown issue'}), 404
+            if not handles(categories, issue['category']):
+                return jsonify({'error': 'Unauthorized'}), 403
+            # Staff who handle every category can step in on someone else's claim
+            if issue['assigned_to'] not in (None, session['user_id']) and categories is not None:
+                return jsonify({'error': 'Claimed by someone else'}), 409
+            if data.get('priority'):
+                issue = set_priority(conn, issue_id, data['priority'], session['user_id'])
+            if data.get('status') and data['status'] != issue['status']:
+                issue = transition(conn, issue_id, data['status'], session['user_id'],
+                                   (data.get('note') or '').strip() or None)
+    except InvalidIssue as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'issue': as_json(issue)})
+
+
+@sessions.login_required(api=True)
+def issue_details(issue_id):
+    conn = get_db()
+    issue = get_issue(conn, issue_id)
+    if issue is None:
+        return jsonify({'error': 'Unknown issue'}), 404
+    is_staff, categories = staff_categories(session['role'])
+    if issue['user_id'] != session['user_id'] and not (is_staff and handles(categories, issue['category'])):
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({'issue': as_json(issue), 'history': [dict(event) for event in history(conn, issue_id)]})
+
+
+issues_cli = AppGroup('issues', help='Issue queue commands.')
+
+
+@issues_cli.command('sla-check')
+def sla_check_command():
+    """Mark issues past their SLA and notify their assignees or queue staff."""
+    breached = check_sla(current_app._get_current_object())
+    click.echo(f'{breached} issues newly past their SLA.')
+
+
+def init_app(app):
+    app.config.setdefault('ISSUE_QUEUE_ROLES', {'admin': None, 'buscoordinator': ('bus',), 'chef': ('food',)})
+    app.config.setdefault('ISSUE_SLA_MINUTES', {'urgent': 60, 'high': 4 * 60, 'medium': 24 * 60, 'low': 3 * 24 * 60})
+    app.config.setdefault('ISSUE_SLA_INTERVAL', 60.0)
+    app.config.setdefault('ISSUE_SLA_BATCH', 500)
+    app.before_request(start_sla_monitor)
+    app.add_url_rule('/api/issues/queue', 'issue_queue', issue_queue)
+    app.add_url_rule('/api/issues/claim', 'claim_issue', claim_issue, methods=['POST'])
+    app.add_url_rule('/api/issues/<int:issue_id>', 'issue_details', issue_details)
+    app.add_url_rule('/api/issues/<int:issue_id>/update', 'update_issue', update_issue, methods=['POST'])
+    app.cli.add_command(issues_cli)
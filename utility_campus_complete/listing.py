@@ -0,0 +1,163 @@
+import csv
+import io
+import json
+
+# Keyset (cursor) pagination over the admin lists, also used to export the
+# reference tables (see bulk.py).
+#
+# Lists are ordered newest first by id, which follows created_at for
+# AUTOINCREMENT keys. A page ends with the id of its last row; the next page
+# asks for rows with a smaller id, so every page is an index range scan no
+# matter how deep into the list it is, unlike OFFSET.
+
+LISTS = {
+    'users': {
+        'select': 'SELECT u.id, u.username, u.role, u.email, u.created_at FROM users u',
+        'key': 'u.id',
+        'filters': {
+            'role': 'u.role = ?',
+            'date_from': 'u.created_at >= ?',
+            'date_to': "u.created_at < date(?, '+1 day')",
+        },
+        'columns': ('id', 'username', 'role', 'email', 'created_at'),
+    },
+    'issues': {
+        'select': 'SELECT i.*, u.username FROM issues i LEFT JOIN users u ON i.user_id = u.id',
+        'key': 'i.id',
+        'filters': {
+            'status': 'i.status = ?',
+            'category': 'i.category = ?',
+            'priority': 'i.priority = ?',
+            'user_id': 'i.user_id = ?',
+            'date_from': 'i.created_at >= ?',
+            'date_to': "i.created_at < date(?, '+1 day')",
+        },
+        'columns': ('id', 'user_id', 'username', 'category', 'description', 'location',
+                    'priority', 'status', 'created_at'),
+    },
+    'bookings': {
+        'select': '''SELECT b.*, r.room_name, u.username FROM bookings b
+                     LEFT JOIN rooms r ON b.room_id = r.id LEFT JOIN users u ON b.user_id = u.id''',
+        'key': 'b.id',
+        'filters': {
+            'status': 'b.status = ?',
+            'room_id': 'b.room_id = ?',
+            'user_id': 'b.user_id = ?',
+            'date': 'b.booking_date = ?',
+            'date_from': 'b.booking_date >= ?',
+            'date_to': 'b.booking_date <= ?',
+        },
+        'columns': ('id', 'room_id', 'room_name', 'user_id', 'username', 'booking_date',
+                    'start_time', 'end_time', 'purpose', 'status', 'created_at'),
+    },
+    'rooms': {
+        'select': 'SELECT r.* FROM rooms r',
+        'key': 'r.id',
+        'filters': {'status': 'r.status = ?', 'room_type': 'r.room_type = ?'},
+        'columns': ('id', 'room_name', 'capacity', 'room_type', 'status'),
+    },
+    'bus_routes': {
+        'select': 'SELECT br.* FROM bus_routes br',
+        'key': 'br.id',
+        'filters': {'status': 'br.status = ?'},
+        'columns': ('id', 'route_name', 'departure_time', 'destination', 'status'),
+    },
+    'canteen_menu': {
+        'select': 'SELECT m.* FROM canteen_menu m',
+        'key': 'm.id',
+        'filters': {'day_of_week': 'm.day_of_week = ?', 'meal_type': 'm.meal_type = ?'},
+        'columns': ('id', 'day_of_week', 'meal_type', 'item_name', 'price', 'available'),
+    },
+}
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+EXPORT_BATCH = 1000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def parse_cursor(value):
+    if value in (None, ''):
+        return None
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        raise InvalidCursor(f'Invalid cursor: {value!r}')
+    if cursor < 1:
+        raise InvalidCursor(f'Invalid cursor: {value!r}')
+    return cursor
+
+
+def parse_limit(value, default=DEFAULT_LIMIT):
+    try:
+        return max(1, min(int(value), MAX_LIMIT))
+    except (TypeError, ValueError):
+        return default
+
+
+def build_query(name, filters, cursor, limit):
+    spec = LISTS[name]
+    clauses, params = [], []
+    for field, clause in spec['filters'].items():
+        value = filters.get(field)
+        if value not in (None, ''):
+            clauses.append(clause)
+            params.append(value)
+    if cursor is not None:
+        clauses.append(f'{spec["key"]} < ?')
+        params.append(cursor)
+    sql = spec['select']
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += f' ORDER BY {spec["key"]} DESC LIMIT ?'
+    params.append(limit)
+    return sql, params
+
+
+def page(conn, name, filters, cursor=None, limit=DEFAULT_LIMIT):
+    """Return (rows, next_cursor); next_cursor is None on the last page."""
+    # Fetch one extra row to know whether another page follows
+    sql, params = build_query(name, filters, cursor, limit + 1)
+    rows = conn.execute(sql, params).fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1]['id']
+    return rows, None
+
+
+def iter_rows(conn, name, filters, batch=EXPORT_BATCH):
+    # Walks the cursor in batches so no statement (and no read snapshot) stays
+    # open for the whole export and memory stays bounded by one batch.
+    cursor = None
+    while True:
+        sql, params = build_query(name, filters, cursor, batch)
+        rows = conn.execute(sql, params).fetchall()
+        yield from rows
+        if len(rows) < batch:
+            return
+        cursor = rows[-1]['id']
+
+
+def export_json(rows, columns):
+    yield '['
+    first = True
+    for row in rows:
+        yield ('' if first else ',') + json.dumps({col: row[col] for col in columns})
+        first = False
+    yield ']'
+
+
+def export_csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([row[col] for col in columns])
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
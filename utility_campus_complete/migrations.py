@@ -0,0 +1,631 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+import db
+import search
+import stats
+
+# Schema migrations, applied in order. Each entry is (version, description,
+# statements); the applied version is stored in PRAGMA user_version so a
+# database is only ever migrated once per version.
+
+BASELINE_SCHEMA = [
+    # Users table
+    '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL,
+            email TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    # Rooms table
+    '''
+        CREATE TABLE IF NOT EXISTS rooms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_name TEXT NOT NULL,
+            capacity INTEGER,
+            room_type TEXT,
+            status TEXT DEFAULT 'available'
+        )
+    ''',
+    # Bookings table
+    '''
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER,
+            user_id INTEGER,
+            booking_date DATE,
+            start_time TIME,
+            end_time TIME,
+            purpose TEXT,
+            status TEXT DEFAULT 'confirmed',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (room_id) REFERENCES rooms (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''',
+    # Issues table
+    '''
+        CREATE TABLE IF NOT EXISTS issues (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            category TEXT,
+            description TEXT,
+            location TEXT,
+            priority TEXT DEFAULT 'medium',
+            status TEXT DEFAULT 'open',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''',
+    # Teacher availability table
+    '''
+        CREATE TABLE IF NOT EXISTS teacher_availability (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            teacher_id INTEGER,
+            day_of_week TEXT,
+            start_time TIME,
+            end_time TIME,
+            status TEXT DEFAULT 'available',
+            FOREIGN KEY (teacher_id) REFERENCES users (id)
+        )
+    ''',
+    # Bus routes table
+    '''
+        CREATE TABLE IF NOT EXISTS bus_routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            route_name TEXT,
+            departure_time TIME,
+            destination TEXT,
+            status TEXT DEFAULT 'active'
+        )
+    ''',
+    # Canteen menu table
+    '''
+        CREATE TABLE IF NOT EXISTS canteen_menu (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            day_of_week TEXT,
+            meal_type TEXT,
+            item_name TEXT,
+            price REAL,
+            available BOOLEAN DEFAULT 1
+        )
+    ''',
+    # Notifications table
+    '''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            title TEXT,
+            message TEXT,
+            category TEXT,
+            read_status BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''',
+    # Washroom status table
+    '''
+        CREATE TABLE IF NOT EXISTS washroom_status (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            location TEXT,
+            status TEXT DEFAULT 'clean',
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    # Events table
+    '''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            description TEXT,
+            event_date DATE,
+            event_time TIME,
+            location TEXT,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (created_by) REFERENCES users (id)
+        )
+    ''',
+    # Camera feeds table for seat availability
+    '''
+        CREATE TABLE IF NOT EXISTS camera_feeds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            location TEXT NOT NULL,
+            feed_url TEXT,
+            status TEXT DEFAULT 'active',
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    # AI voice alerts table
+    '''
+        CREATE TABLE IF NOT EXISTS ai_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            location TEXT NOT NULL,
+            alert_type TEXT NOT NULL,
+            threshold DECIMAL(5,2),
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    # Maintenance photos table
+    '''
+        CREATE TABLE IF NOT EXISTS maintenance_photos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            issue_id INTEGER,
+            photo_path TEXT NOT NULL,
+            uploaded_by INTEGER,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (issue_id) REFERENCES issues (id),
+            FOREIGN KEY (uploaded_by) REFERENCES users (id)
+        )
+    ''',
+]
+
+HOT_PATH_INDEXES = [
+    # Dashboard notification lists: WHERE user_id = ? ORDER BY created_at DESC
+    '''
+        CREATE INDEX IF NOT EXISTS idx_notifications_user_created
+        ON notifications (user_id, created_at DESC)
+    ''',
+    # /api/notifications poll only ever looks at unread rows
+    '''
+        CREATE INDEX IF NOT EXISTS idx_notifications_unread
+        ON notifications (user_id, created_at DESC) WHERE read_status = 0
+    ''',
+    # Booking conflict check, covering the columns it compares
+    '''
+        CREATE INDEX IF NOT EXISTS idx_bookings_room_date
+        ON bookings (room_id, booking_date, start_time, end_time)
+    ''',
+    # "My bookings" list on the booking page
+    '''
+        CREATE INDEX IF NOT EXISTS idx_bookings_user_date
+        ON bookings (user_id, booking_date DESC)
+    ''',
+    # Bus coordinator issue list and per-reporter issue list
+    '''
+        CREATE INDEX IF NOT EXISTS idx_issues_category
+        ON issues (category, created_at DESC)
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_issues_user_created
+        ON issues (user_id, created_at DESC)
+    ''',
+    # Faculty dashboard and availability page
+    '''
+        CREATE INDEX IF NOT EXISTS idx_teacher_availability_teacher
+        ON teacher_availability (teacher_id, day_of_week)
+    ''',
+    # Student dashboard: today's available menu items
+    '''
+        CREATE INDEX IF NOT EXISTS idx_canteen_menu_day
+        ON canteen_menu (day_of_week, meal_type) WHERE available = 1
+    ''',
+    # Photos shown on the upload page of an issue
+    '''
+        CREATE INDEX IF NOT EXISTS idx_maintenance_photos_issue
+        ON maintenance_photos (issue_id)
+    ''',
+    'ANALYZE',
+]
+
+
+def minutes_expr(column):
+    # 'H:MM', 'HH:MM' or 'HH:MM:SS' -> minutes since midnight
+    return (f"(CAST(substr({column}, 1, instr({column}, ':') - 1) AS INTEGER) * 60"
+            f" + CAST(substr({column}, instr({column}, ':') + 1, 2) AS INTEGER))")
+
+
+BOOKING_OVERLAP_CHECK = f'''
+    COALESCE(NEW.status, 'confirmed') != 'cancelled' AND EXISTS (
+        SELECT 1 FROM bookings
+        WHERE room_id = NEW.room_id AND booking_date = NEW.booking_date
+        AND start_min < {minutes_expr('NEW.end_time')}
+        AND end_min > {minutes_expr('NEW.start_time')}
+        AND status != 'cancelled'
+'''
+
+BOOKING_INTERVALS = [
+    # Integer minutes instead of TEXT comparisons on start_time/end_time
+    f'''
+        ALTER TABLE bookings ADD COLUMN start_min INTEGER
+        GENERATED ALWAYS AS ({minutes_expr('start_time')}) VIRTUAL
+    ''',
+    f'''
+        ALTER TABLE bookings ADD COLUMN end_min INTEGER
+        GENERATED ALWAYS AS ({minutes_expr('end_time')}) VIRTUAL
+    ''',
+    'DROP INDEX IF EXISTS idx_bookings_room_date',
+    # Interval index per (room, date), covering the overlap check
+    '''
+        CREATE INDEX IF NOT EXISTS idx_bookings_interval
+        ON bookings (room_id, booking_date, start_min, end_min, status)
+    ''',
+    # Last line of defence for writers that bypass bookings.book()
+    f'''
+        CREATE TRIGGER IF NOT EXISTS bookings_no_overlap
+        BEFORE INSERT ON bookings
+        WHEN {BOOKING_OVERLAP_CHECK})
+        BEGIN
+            SELECT RAISE(ABORT, 'booking overlaps an existing booking');
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS bookings_no_overlap_update
+        BEFORE UPDATE OF room_id, booking_date, start_time, end_time, status ON bookings
+        WHEN {BOOKING_OVERLAP_CHECK} AND id != NEW.id)
+        BEGIN
+            SELECT RAISE(ABORT, 'booking overlaps an existing booking');
+        END
+    ''',
+]
+
+# Single-column indexes end in the rowid, so WHERE col = ? AND id < ?
+# ORDER BY id DESC (keyset pagination, see listing.py) is one range scan.
+ADMIN_LIST_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_users_role ON users (role)',
+    'CREATE INDEX IF NOT EXISTS idx_issues_status ON issues (status)',
+    'CREATE INDEX IF NOT EXISTS idx_bookings_date ON bookings (booking_date)',
+    'CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings (status)',
+]
+
+PHOTO_DERIVATIVES = [
+    'ALTER TABLE maintenance_photos ADD COLUMN content_hash TEXT',
+    'ALTER TABLE maintenance_photos ADD COLUMN size_bytes INTEGER',
+    'ALTER TABLE maintenance_photos ADD COLUMN width INTEGER',
+    'ALTER TABLE maintenance_photos ADD COLUMN height INTEGER',
+    'ALTER TABLE maintenance_photos ADD COLUMN thumb_path TEXT',
+    'ALTER TABLE maintenance_photos ADD COLUMN preview_path TEXT',
+    'ALTER TABLE maintenance_photos ADD COLUMN thumb_status TEXT',
+    'CREATE INDEX IF NOT EXISTS idx_maintenance_photos_hash ON maintenance_photos (content_hash)',
+]
+
+# Natural keys that bulk.py upserts on (not unique: older data may repeat them)
+BULK_UPSERT_KEYS = [
+    'CREATE INDEX IF NOT EXISTS idx_rooms_name ON rooms (room_name)',
+    'CREATE INDEX IF NOT EXISTS idx_bus_routes_key ON bus_routes (route_name, departure_time)',
+    'CREATE INDEX IF NOT EXISTS idx_canteen_menu_key ON canteen_menu (day_of_week, meal_type, item_name)',
+]
+
+# Where noise.py reads a location's audio from (WAV file or sim://)
+NOISE_SOURCES = [
+    'ALTER TABLE ai_alerts ADD COLUMN source_url TEXT',
+]
+
+# Campus-wide announcements: one row per announcement and per audience, and a
+# compact read cursor per user instead of a notification row per recipient
+ANNOUNCEMENTS = [
+    '''
+    CREATE TABLE IF NOT EXISTS announcements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        message TEXT NOT NULL,
+        category TEXT NOT NULL DEFAULT 'announcement',
+        created_by INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP,
+        FOREIGN KEY (created_by) REFERENCES users (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS announcement_audiences (
+        announcement_id INTEGER NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('all', 'role', 'room', 'route')),
+        value TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (kind, value, announcement_id),
+        FOREIGN KEY (announcement_id) REFERENCES announcements (id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS announcement_reads (
+        user_id INTEGER PRIMARY KEY,
+        read_through INTEGER NOT NULL DEFAULT 0,
+        read_bits BLOB,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS route_subscriptions (
+        user_id INTEGER NOT NULL,
+        route_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, route_id),
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (route_id) REFERENCES bus_routes (id)
+    ) WITHOUT ROWID
+    ''',
+]
+
+DAY_ORDINAL = ("(CASE lower(day_of_week) WHEN 'monday' THEN 0 WHEN 'tuesday' THEN 1 WHEN 'wednesday' THEN 2"
+               " WHEN 'thursday' THEN 3 WHEN 'friday' THEN 4 WHEN 'saturday' THEN 5 WHEN 'sunday' THEN 6 END)")
+
+# One row per (teacher, day, start) so saving a slot updates it, plus day
+# ordinals and minute columns for week-ordered listing and availability.py
+AVAILABILITY_SLOTS = [
+    # Keep the newest of any duplicates INSERT OR REPLACE let pile up
+    '''
+        DELETE FROM teacher_availability WHERE id NOT IN (
+            SELECT MAX(id) FROM teacher_availability GROUP BY teacher_id, day_of_week, start_time
+        )
+    ''',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_teacher_availability_slot ON teacher_availability (teacher_id, day_of_week, start_time)',
+    f'ALTER TABLE teacher_availability ADD COLUMN day_ordinal INTEGER GENERATED ALWAYS AS {DAY_ORDINAL} VIRTUAL',
+    f"ALTER TABLE teacher_availability ADD COLUMN start_min INTEGER GENERATED ALWAYS AS ({minutes_expr('start_time')}) VIRTUAL",
+    f"ALTER TABLE teacher_availability ADD COLUMN end_min INTEGER GENERATED ALWAYS AS ({minutes_expr('end_time')}) VIRTUAL",
+    '''
+        CREATE INDEX IF NOT EXISTS idx_teacher_availability_week
+        ON teacher_availability (teacher_id, day_ordinal, start_min)
+    ''',
+]
+
+# Bus timetable: stops in order along each route, recurring departures with a
+# weekday mask (bit 0 = Monday), and per-trip delay/cancellation updates.
+# Every bus_routes row keeps working as a route; its departure_time becomes a
+# daily schedule leaving the 'Campus' stop, here and by trigger for rows
+# added later (route form, bulk import, seed).
+BUS_TIMETABLE = [
+    '''
+        CREATE TABLE IF NOT EXISTS bus_stops (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS bus_route_stops (
+            route_id INTEGER NOT NULL,
+            stop_sequence INTEGER NOT NULL,
+            stop_id INTEGER NOT NULL,
+            offset_min INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (route_id, stop_sequence),
+            FOREIGN KEY (route_id) REFERENCES bus_routes (id),
+            FOREIGN KEY (stop_id) REFERENCES bus_stops (id)
+        ) WITHOUT ROWID
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS bus_schedules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            route_id INTEGER NOT NULL,
+            departure_time TEXT NOT NULL,
+            days INTEGER NOT NULL DEFAULT 127,
+            FOREIGN KEY (route_id) REFERENCES bus_routes (id)
+        )
+    ''',
+    f"ALTER TABLE bus_schedules ADD COLUMN departure_min INTEGER GENERATED ALWAYS AS ({minutes_expr('departure_time')}) VIRTUAL",
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_bus_schedules_trip ON bus_schedules (route_id, departure_time)',
+    '''
+        CREATE TABLE IF NOT EXISTS bus_trip_updates (
+            schedule_id INTEGER NOT NULL,
+            service_date DATE NOT NULL,
+            delay_min INTEGER NOT NULL DEFAULT 0,
+            cancelled INTEGER NOT NULL DEFAULT 0,
+            note TEXT,
+            updated_by INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (service_date, schedule_id),
+            FOREIGN KEY (schedule_id) REFERENCES bus_schedules (id),
+            FOREIGN KEY (updated_by) REFERENCES users (id)
+        ) WITHOUT ROWID
+    ''',
+    "INSERT OR IGNORE INTO bus_stops (name) VALUES ('Campus')",
+    '''
+        INSERT OR IGNORE INTO bus_route_stops (route_id, stop_sequence, stop_id, offset_min)
+        SELECT r.id, 0, s.id, 0 FROM bus_routes r, bus_stops s WHERE s.name = 'Campus'
+    ''',
+    '''
+        INSERT OR IGNORE INTO bus_schedules (route_id, departure_time)
+        SELECT id, departure_time FROM bus_routes WHERE departure_time LIKE '%:%'
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS bus_routes_timetable_insert AFTER INSERT ON bus_routes
+        BEGIN
+            INSERT OR IGNORE INTO bus_route_stops (route_id, stop_sequence, stop_id, offset_min)
+            SELECT NEW.id, 0, id, 0 FROM bus_stops WHERE name = 'Campus';
+            INSERT OR IGNORE INTO bus_schedules (route_id, departure_time)
+            SELECT NEW.id, NEW.departure_time WHERE NEW.departure_time LIKE '%:%';
+        END
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS bus_routes_timetable_delete AFTER DELETE ON bus_routes
+        BEGIN
+            DELETE FROM bus_trip_updates WHERE schedule_id IN (SELECT id FROM bus_schedules WHERE route_id = OLD.id);
+            DELETE FROM bus_schedules WHERE route_id = OLD.id;
+            DELETE FROM bus_route_stops WHERE route_id = OLD.id;
+        END
+    ''',
+]
+
+# Triage queue: numeric priority, assignment and status timestamps on issues,
+# an audit trail of transitions, and partial indexes that hold only the rows a
+# queue or the SLA check can return, already in queue order.
+ISSUE_QUEUE = [
+    '''
+        ALTER TABLE issues ADD COLUMN priority_rank INTEGER GENERATED ALWAYS AS (
+            CASE priority WHEN 'urgent' THEN 0 WHEN 'high' THEN 1 WHEN 'low' THEN 3 ELSE 2 END
+        ) VIRTUAL
+    ''',
+    'ALTER TABLE issues ADD COLUMN assigned_to INTEGER REFERENCES users (id)',
+    'ALTER TABLE issues ADD COLUMN claimed_at TIMESTAMP',
+    'ALTER TABLE issues ADD COLUMN resolved_at TIMESTAMP',
+    'ALTER TABLE issues ADD COLUMN updated_at TIMESTAMP',
+    'ALTER TABLE issues ADD COLUMN sla_breached_at TIMESTAMP',
+    '''
+        CREATE TABLE IF NOT EXISTS issue_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            issue_id INTEGER NOT NULL,
+            event TEXT NOT NULL,
+            from_status TEXT,
+            to_status TEXT,
+            actor_id INTEGER,
+            note TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (issue_id) REFERENCES issues (id),
+            FOREIGN KEY (actor_id) REFERENCES users (id)
+        )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_issue_events_issue ON issue_events (issue_id, id)',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_issues_queue ON issues (priority_rank, created_at, id)
+        WHERE status = 'open' AND assigned_to IS NULL
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_issues_queue_category ON issues (category, priority_rank, created_at, id)
+        WHERE status = 'open' AND assigned_to IS NULL
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_issues_queue_location ON issues (location, priority_rank, created_at, id)
+        WHERE status = 'open' AND assigned_to IS NULL
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_issues_sla ON issues (priority_rank, created_at)
+        WHERE sla_breached_at IS NULL AND status IN ('open', 'in_progress')
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_issues_assignee ON issues (assigned_to, status)
+        WHERE assigned_to IS NOT NULL
+    ''',
+    '''
+        CREATE TRIGGER IF NOT EXISTS issues_events_delete AFTER DELETE ON issues
+        BEGIN
+            DELETE FROM issue_events WHERE issue_id = OLD.id;
+        END
+    ''',
+]
+
+# Retention: a log of archive and compaction runs, and partial indexes that
+# hold only the rows a retention pass may archive, oldest first.
+RETENTION = [
+    '''
+        CREATE TABLE IF NOT EXISTS retention_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TIMESTAMP NOT NULL,
+            finished_at TIMESTAMP,
+            dry_run INTEGER NOT NULL DEFAULT 0,
+            report TEXT
+        )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_retention_runs_started ON retention_runs (started_at) WHERE dry_run = 0',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_notifications_read_created ON notifications (created_at)
+        WHERE read_status = 1
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_issues_closed ON issues (COALESCE(resolved_at, updated_at, created_at))
+        WHERE status IN ('resolved', 'closed')
+    ''',
+]
+
+USER_SESSIONS = [
+    # Keyed by the SHA-256 of the cookie token; username and role are joined
+    # from users on load, so only the id and the leftover keys are stored
+    '''
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            id BLOB PRIMARY KEY,
+            user_id INTEGER,
+            data BLOB,
+            created_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_user_sessions_user ON user_sessions (user_id) WHERE user_id IS NOT NULL',
+    'CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions (expires_at)',
+]
+
+MIGRATIONS = [
+    (1, 'baseline schema', BASELINE_SCHEMA),
+    (2, 'indexes for dashboard, booking and issue queries', HOT_PATH_INDEXES),
+    (3, 'booking intervals, interval index and overlap trigger', BOOKING_INTERVALS),
+    (4, 'indexes for admin list filters', ADMIN_LIST_INDEXES),
+    (5, 'dashboard counters maintained by triggers', stats.schema_statements()),
+    (6, 'content hashes and derived sizes for maintenance photos', PHOTO_DERIVATIVES),
+    (7, 'audio sources for noise alerts', NOISE_SOURCES),
+    (8, 'natural key indexes for bulk upserts', BULK_UPSERT_KEYS),
+    (9, 'announcements with audience targeting and read cursors', ANNOUNCEMENTS),
+    (10, 'unique teacher availability slots with day ordinals', AVAILABILITY_SLOTS),
+    (11, 'bus stops, weekday schedules and trip updates', BUS_TIMETABLE),
+    (12, 'issue queue priorities, assignment, SLA and transition history', ISSUE_QUEUE),
+    (13, 'full-text search indexes for issues, events and notifications', search.schema_statements()),
+    (14, 'retention run log and indexes over archivable rows', RETENTION),
+    (15, 'server-side user sessions', USER_SESSIONS),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def pending_migrations(conn):
+    version = current_version(conn)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def upgrade(conn, target=None):
+    """Apply pending migrations up to target (default: latest), one transaction each.
+
+    Returns the list of versions that were applied.
+    """
+    applied = []
+    if not conn.execute('SELECT 1 FROM sqlite_master').fetchone():
+        # A new database frees deleted pages in chunks (see retention.compact);
+        # the mode only changes with a VACUUM, which is instant while it is empty
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    for version, description, statements in pending_migrations(conn):
+        if target is not None and version > target:
+            break
+        conn.execute('BEGIN IMMEDIATE')
+        if version <= current_version(conn):
+            # Another process applied it while this one waited for the write lock
+            conn.execute('ROLLBACK')
+            continue
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        applied.append(version)
+    return applied
+
+
+db_cli = AppGroup('db', help='Database schema commands.')
+
+
+@db_cli.command('upgrade')
+@click.option('--to', 'target', type=int, default=None, help='Stop at this schema version.')
+def upgrade_command(target):
+    """Apply pending schema migrations."""
+    conn = db.connect(current_app.config['DATABASE'])
+    try:
+        before = current_version(conn)
+        applied = upgrade(conn, target)
+    finally:
+        conn.close()
+    if applied:
+        click.echo(f'Upgraded schema from version {before} to {applied[-1]}.')
+    else:
+        click.echo(f'Schema already at version {before}.')
+
+
+@db_cli.command('status')
+def status_command():
+    """Show the current schema version and pending migrations."""
+    conn = db.connect(current_app.config['DATABASE'])
+    try:
+        click.echo(f'Current version: {current_version(conn)} (latest {LATEST_VERSION})')
+        for version, description, _ in pending_migrations(conn):
+            click.echo(f'  pending {version}: {description}')
+    finally:
+        conn.close()
+
+
+def init_app(app):
+    app.cli.add_command(db_cli)
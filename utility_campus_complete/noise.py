@@ -0,0 +1,438 @@
+import json
+import logging
+import os
+import threading
+import time
+import wave
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+
+from flask import Response, current_app, jsonify
+
+import announcements
+import db
+import sessions
+
+try:
+    import numpy as np
+except ImportError:  # without NumPy the monitor stays off; see enabled()
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: every worker records the alerts it fires
+    fcntl = None
+
+# Noise monitoring for ai_alerts.
+#
+# Every active ai_alerts row names a location and, through source_url, the
+# microphone feeding it: a WAV file (replayed in a loop) or
+# sim://name?level=45 for synthetic audio. One thread ticks NOISE_TICK_HZ
+# times a second: it reads a block of samples per location, stores the
+# block's mean square in a (locations x window) ring buffer and turns the
+# whole buffer into rolling levels with one NumPy reduction. Alerts are
+# evaluated as arrays as well: an alert fires once its level has stayed above
+# threshold for NOISE_DEBOUNCE_TICKS ticks and re-arms only after the level
+# has stayed NOISE_HYSTERESIS_DB below it for as long. Fired alerts are
+# written on a separate thread so a slow write never delays a tick, and
+# /api/ai_alert_status is served from memory.
+#
+# Every worker process runs a monitor for its own status endpoint, but only
+# the one holding the lock file next to the database records fired alerts,
+# each as one announcement to the admin and faculty roles. The others retry
+# the lock on every reload, so one takes over when that worker exits.
+#
+# The monitor is off unless NOISE_MONITOR is set (env CAMPUS_NOISE_MONITOR=1):
+# the sample alerts listen to simulated microphones.
+
+FLOOR = 1e-12  # mean square treated as silence, keeps log10 finite
+ALERT_AUDIENCES = [('role', 'admin'), ('role', 'faculty')]
+
+logger = logging.getLogger(__name__)
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+class UnsupportedSource(ValueError):
+    pass
+
+
+class SimulatedMicrophone:
+    """White noise around a base level with occasional loud bursts."""
+
+    def __init__(self, name, tick_hz, sample_rate=8000, level=45.0, calibration=90.0):
+        self.rng = np.random.default_rng(zlib.crc32(name.encode()))
+        self.block = int(sample_rate / tick_hz)
+        self.base = level
+        self.calibration = calibration
+        self.burst = 0
+
+    def read(self):
+        if self.burst:
+            self.burst -= 1
+        elif self.rng.random() < 0.01:
+            self.burst = int(self.rng.integers(10, 60))
+        level = self.base + (25.0 if self.burst else self.rng.normal(0.0, 2.0))
+        sigma = 10 ** ((level - self.calibration) / 20)
+        return self.rng.normal(0.0, sigma, self.block).astype(np.float32)
+
+
+class WavSource:
+    """Replays a PCM WAV file in a loop, one tick's worth of frames at a time."""
+
+    DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+    def __init__(self, path, tick_hz):
+        self.wav = wave.open(path, 'rb')
+        width = self.wav.getsampwidth()
+        if width not in self.DTYPES:
+            raise UnsupportedSource(f'{path}: {8 * width}-bit samples are not supported')
+        self.dtype = self.DTYPES[width]
+        self.channels = self.wav.getnchannels()
+        self.scale = float(2 ** (8 * width - 1))
+        self.block = max(1, int(self.wav.getframerate() / tick_hz))
+
+    def read(self):
+        data = self.wav.readframes(self.block)
+        if len(data) < self.block * self.channels * self.wav.getsampwidth():
+            self.wav.rewind()
+            data += self.wav.readframes(self.block - len(data) // (self.channels * self.wav.getsampwidth()))
+        samples = np.frombuffer(data, dtype=self.dtype).astype(np.float32)
+        if self.dtype is np.uint8:
+            samples -= 128.0
+        samples = samples.reshape(-1, self.channels).mean(axis=1)
+        return samples / self.scale
+
+
+def open_source(source_url, tick_hz, sample_rate=8000, calibration=90.0):
+    if not source_url:
+        raise UnsupportedSource('No audio source configured')
+    url = urlparse(source_url)
+    if url.scheme == 'sim':
+        options = parse_qs(url.query)
+        level = float(options.get('level', ['45'])[0])
+        return SimulatedMicrophone(url.netloc or url.path, tick_hz, sample_rate, level, calibration)
+    if url.scheme in ('', 'file'):
+        path = url.path if url.scheme == 'file' else source_url
+        if not os.path.isfile(path):
+            raise UnsupportedSource(f'{path} does not exist')
+        try:
+            return WavSource(path, tick_hz)
+        except (wave.Error, EOFError) as exc:
+            raise UnsupportedSource(f'{path}: {exc}')
+    raise UnsupportedSource(f'Unsupported audio source: {url.scheme}')
+
+
+def rounded(value):
+    return None if not np.isfinite(value) else round(float(value), 1)
+
+
+class NoiseMonitor:
+    def __init__(self, app, tick_hz=10, window=1.0, debounce=5, hysteresis=3.0, cooldown=60.0,
+                 calibration=90.0, sample_rate=8000, reload_interval=30.0, recent=50, lock_path=None):
+        self.app = app
+        self.tick_hz = tick_hz
+        self.window = max(1, int(round(window * tick_hz)))
+        self.debounce = debounce
+        self.hysteresis = hysteresis
+        self.cooldown = cooldown
+        self.calibration = calibration
+        self.sample_rate = sample_rate
+        self.reload_interval = reload_interval
+        self.lock_path = lock_path
+        self.settings = None
+
+        # Per location
+        self.locations = []
+        self.sources = []
+        self.errors = []
+        self.energy = np.zeros((0, self.window))
+        self.level_db = np.zeros(0)
+        self.peak_db = np.zeros(0)
+        # Per alert
+        self.alerts = []
+        self.alert_location = np.zeros(0, dtype=np.intp)
+        self.thresholds = np.zeros(0)
+        self.above = np.zeros(0, dtype=np.int32)
+        self.below = np.zeros(0, dtype=np.int32)
+        self.active = np.zeros(0, dtype=bool)
+        self.last_fired = np.zeros(0)
+
+        self.recent = deque(maxlen=recent)
+        self.ticks = 0
+        self.overruns = 0
+        self.tick_seconds = 0.0
+        self._lock = threading.Lock()
+        self._payload = None
+        self._payload_tick = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='noise-alerts')
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+
+    def start(self):
+        self.reload()
+        self._thread = threading.Thread(target=self._run, name='noise-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._writer.shutdown(wait=False)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    @property
+    def recording(self):
+        """Whether this monitor writes the alerts it fires."""
+        return self.lock_path is None or fcntl is None or self._lock_file is not None
+
+    def claim(self):
+        """Take the alert lock unless another worker holds it."""
+        if self.recording:
+            return
+        lock = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return
+        self._lock_file = lock
+
+    def reload(self):
+        self.claim()
+        conn = db.connect(self.app.config['DATABASE'])
+        try:
+            rows = conn.execute('''
+                SELECT id, location, alert_type, threshold, source_url FROM ai_alerts
+                WHERE status = 'active' ORDER BY id
+            ''').fetchall()
+        finally:
+            conn.close()
+
+        with self._lock:
+            old_locations = {key: i for i, key in enumerate(self.locations)}
+            old_alerts = {alert['id']: i for i, alert in enumerate(self.alerts)}
+            locations, sources, errors, rows_from = [], [], [], []
+            index = {}
+            alert_location = []
+            for row in rows:
+                key = (row['location'], row['source_url'])
+                if key not in index:
+                    index[key] = len(locations)
+                    locations.append(key)
+                    old = old_locations.get(key)
+                    rows_from.append(old)
+                    if old is not None:
+                        sources.append(self.sources[old])
+                        errors.append(self.errors[old])
+                    else:
+                        try:
+                            sources.append(open_source(row['source_url'], self.tick_hz,
+                                                       self.sample_rate, self.calibration))
+                            errors.append(None)
+                        except (UnsupportedSource, OSError, ValueError) as exc:
+                            sources.append(None)
+                            errors.append(str(exc))
+                alert_location.append(index[key])
+
+            # Keep the window of locations whose source did not change
+            energy = np.zeros((len(locations), self.window))
+            kept = [(new, old) for new, old in enumerate(rows_from) if old is not None]
+            if kept:
+                new_rows, old_rows = zip(*kept)
+                energy[list(new_rows)] = self.energy[list(old_rows)]
+            self.locations, self.sources, self.errors, self.energy = locations, sources, errors, energy
+            self.level_db = np.full(len(locations), np.nan)
+            self.peak_db = np.full(len(locations), np.nan)
+
+            count = len(rows)
+            previous = [old_alerts.get(row['id']) for row in rows]
+            carry = [(new, old) for new, old in enumerate(previous) if old is not None]
+            above, below = np.zeros(count, dtype=np.int32), np.zeros(count, dtype=np.int32)
+            active, last_fired = np.zeros(count, dtype=bool), np.full(count, -np.inf)
+            if carry:
+                new_rows, old_rows = (list(side) for side in zip(*carry))
+                above[new_rows], below[new_rows] = self.above[old_rows], self.below[old_rows]
+                active[new_rows], last_fired[new_rows] = self.active[old_rows], self.last_fired[old_rows]
+            self.alerts = [dict(row) for row in rows]
+            self.alert_location = np.array(alert_location, dtype=np.intp)
+            self.thresholds = np.array([np.nan if row['threshold'] is None else float(row['threshold'])
+                                        for row in rows])
+            self.above, self.below, self.active, self.last_fired = above, below, active, last_fired
+            self._payload_tick = None
+
+    def tick(self, now):
+        with self._lock:
+            column = self.ticks % self.window
+            for i, source in enumerate(self.sources):
+                if source is None:
+                    self.energy[i, column] = np.nan
+                    continue
+                try:
+                    samples = source.read()
+                    self.energy[i, column] = float(np.dot(samples, samples)) / len(samples)
+                except Exception as exc:
+                    self.errors[i] = str(exc)
+                    self.energy[i, column] = np.nan
+            self.ticks += 1
+            filled = self.energy[:, :min(self.ticks, self.window)]
+            self.level_db = 10 * np.log10(np.maximum(filled.mean(axis=1), FLOOR)) + self.calibration
+            self.peak_db = 10 * np.log10(np.maximum(filled.max(axis=1), FLOOR)) + self.calibration
+
+            level = self.level_db[self.alert_location]
+            # NaN levels and thresholds compare False, so they never fire
+            self.above = np.where(level > self.thresholds, self.above + 1, 0)
+            self.below = np.where(level < self.thresholds - self.hysteresis, self.below + 1, 0)
+            fire = ~self.active & (self.above >= self.debounce) & (now - self.last_fired >= self.cooldown)
+            self.active = (self.active | fire) & ~(self.below >= self.debounce)
+            self.last_fired[fire] = now
+
+            fired = []
+            for i in np.flatnonzero(fire):
+                alert = self.alerts[i]
+                event = {
+                    'alert_id': alert['id'],
+                    'location': alert['location'],
+                    'level_db': rounded(level[i]),
+                    'threshold': alert['threshold'],
+                    'time': datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+                }
+                self.recent.appendleft(event)
+                fired.append(event)
+        if fired and self.recording:
+            self._writer.submit(self._notify, fired)
+        return fired
+
+    def _notify(self, events):
+        try:
+            with self.app.app_context(), db.transaction() as conn:
+                for event in events:
+                    message = (f'{event["location"]}: noise at {event["level_db"]:.0f} dB '
+                               f'is above the {event["threshold"]:.0f} dB limit')
+                    announcements.create(conn, 'Noise Alert', message, ALERT_AUDIENCES, category='alert')
+        except Exception:
+            logger.exception('Could not record noise alerts')
+
+    def _run(self):
+        period = 1.0 / self.tick_hz
+        next_tick = time.monotonic()
+        next_reload = next_tick + self.reload_interval
+        while not self._stop.is_set():
+            if time.monotonic() >= next_reload:
+                try:
+                    self.reload()
+                except Exception:
+                    logger.exception('Could not reload noise alerts')
+                next_reload = time.monotonic() + self.reload_interval
+            started = time.perf_counter()
+            try:
+                self.tick(time.time())
+            except RuntimeError:  # writer shut down: stop() or interpreter exit
+                return
+            self.tick_seconds += time.perf_counter() - started
+            next_tick += period
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                # Fell behind; skip the missed ticks instead of bursting
+                self.overruns += 1
+                next_tick = time.monotonic()
+            else:
+                self._stop.wait(delay)
+
+    def payload(self):
+        with self._lock:
+            if self._payload_tick != self.ticks:
+                self._payload = json.dumps(self._status()).encode()
+                self._payload_tick = self.ticks
+            return self._payload
+
+    def snapshot(self):
+        return json.loads(self.payload())
+
+    def _status(self):
+        states = np.where(self.active, 'alerting', np.where(self.above > 0, 'rising', 'quiet'))
+        return {
+            'tick_hz': self.tick_hz,
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'tick_ms': round(1000 * self.tick_seconds / self.ticks, 3) if self.ticks else None,
+            'locations': [
+                {'location': location, 'level_db': rounded(self.level_db[i]),
+                 'peak_db': rounded(self.peak_db[i]), 'error': self.errors[i]}
+                for i, (location, _) in enumerate(self.locations)
+            ],
+            'alerts': [
+                {'id': alert['id'], 'location': alert['location'], 'alert_type': alert['alert_type'],
+                 'threshold': alert['threshold'], 'state': str(states[i]),
+                 'level_db': rounded(self.level_db[self.alert_location[i]]),
+                 'last_fired': (datetime.fromtimestamp(self.last_fired[i]).isoformat(timespec='seconds')
+                                if np.isfinite(self.last_fired[i]) else None)}
+                for i, alert in enumerate(self.alerts)
+            ],
+            'recent': list(self.recent),
+        }
+
+
+def get_monitor():
+    global _monitor
+    app = current_app._get_current_object()
+    settings = (os.getpid(), app.config['DATABASE'])
+    # One monitor per worker process, started with the first request
+    if _monitor is None or _monitor.settings != settings:
+        with _monitor_lock:
+            if _monitor is None or _monitor.settings != settings:
+                if _monitor is not None:
+                    _monitor.stop()
+                config = app.config
+                monitor = NoiseMonitor(
+                    app,
+                    tick_hz=config['NOISE_TICK_HZ'],
+                    window=config['NOISE_WINDOW'],
+                    debounce=config['NOISE_DEBOUNCE_TICKS'],
+                    hysteresis=config['NOISE_HYSTERESIS_DB'],
+                    cooldown=config['NOISE_COOLDOWN'],
+                    calibration=config['NOISE_CALIBRATION_DB'],
+                    lock_path=config['DATABASE'] + '.noise.lock',
+                )
+                monitor.settings = settings
+                monitor.start()
+                _monitor = monitor
+    return _monitor
+
+
+def enabled():
+    return np is not None and current_app.config['NOISE_MONITOR']
+
+
+def start_monitor():
+    if enabled():
+        get_monitor()
+
+
+def current_status():
+    """Live levels and alert states, or None when monitoring is off."""
+    return get_monitor().snapshot() if enabled() else None
+
+
+@sessions.login_required(api=401)
+def ai_alert_status():
+    if not enabled():
+        return jsonify({'error': 'Noise monitoring is not running'}), 503
+    return Response(get_monitor().payload(), mimetype='application/json')
+
+
+def init_app(app):
+    app.config.setdefault('NOISE_MONITOR', os.environ.get('CAMPUS_NOISE_MONITOR') == '1')
+    app.config.setdefault('NOISE_TICK_HZ', 10)
+    app.config.setdefault('NOISE_WINDOW', 1.0)
+    app.config.setdefault('NOISE_DEBOUNCE_TICKS', 5)
+    app.config.setdefault('NOISE_HYSTERESIS_DB', 3.0)
+    app.config.setdefault('NOISE_COOLDOWN', 60.0)
+    app.config.setdefault('NOISE_CALIBRATION_DB', 90.0)
+    app.before_request(start_monitor)
+    app.add_url_rule('/api/ai_alert_status', 'ai_alert_status', ai_alert_status)
@@ -0,0 +1,225 @@
+import json
+import queue
+
+import announcements
+from db import after_commit
+from pubsub import broker
+
+# Notification writes and the server-sent event stream that pushes them.
+#
+# notify() inserts inside the caller's transaction and publishes to the
+# user's channel only after the transaction commits. A stream subscribes to
+# that channel, replays anything newer than the client's Last-Event-ID from
+# the database, and then waits for pushes. Pushes only reach streams in the
+# same process, so every resync_interval seconds the stream also checks the
+# database for rows written by other workers.
+#
+# Streams also subscribe to the shared announcements channel and forward the
+# announcements whose audiences match the user. Those events carry no id:
+# line, so Last-Event-ID keeps tracking personal notifications only.
+#
+# stream() is the WSGI version: one thread and a blocking broker queue per
+# client. astream() is the asyncio version served by asgi.py; both drive the
+# same StreamState.
+
+BACKLOG_LIMIT = 100
+
+
+def channel(user_id):
+    return f'user:{user_id}'
+
+
+def notify(conn, user_id, title, message, category):
+    cursor = conn.execute('''
+        INSERT INTO notifications (user_id, title, message, category)
+        VALUES (?, ?, ?, ?)
+    ''', (user_id, title, message, category))
+    notification = dict(conn.execute('SELECT * FROM notifications WHERE id = ?',
+                                     (cursor.lastrowid,)).fetchone())
+    after_commit(lambda: broker.publish(channel(user_id), notification))
+    return notification
+
+
+def newer_than(conn, user_id, last_id):
+    return conn.execute('''
+        SELECT * FROM notifications WHERE user_id = ? AND id > ?
+        ORDER BY id LIMIT ?
+    ''', (user_id, last_id, BACKLOG_LIMIT)).fetchall()
+
+
+def latest_id(conn, user_id):
+    row = conn.execute('SELECT MAX(id) FROM notifications WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] or 0
+
+
+def mark_read(conn, user_id, ids=(), up_to=None):
+    """Mark personal notifications read by id and/or up to a watermark id.
+
+    Runs one UPDATE inside the caller's transaction and returns the number of
+    rows that changed; ids that are already read or belong to someone else
+    are ignored.
+    """
+    if not ids and up_to is None:
+        return 0
+    cursor = conn.execute('''
+        UPDATE notifications SET read_status = 1
+        WHERE user_id = ? AND read_status = 0
+        AND (id IN (SELECT value FROM json_each(?)) OR id <= ?)
+    ''', (user_id, json.dumps(sorted(ids)), up_to if up_to is not None else 0))
+    return cursor.rowcount
+
+
+def split_ids(values):
+    """([personal ids], [announcement ids]) from ids as sent by clients."""
+    personal, broadcast = [], []
+    for value in values:
+        announcement_id = announcements.parse_item_id(value)
+        if announcement_id is not None:
+            broadcast.append(announcement_id)
+        elif (isinstance(value, int) and not isinstance(value, bool)) or (isinstance(value, str) and value.isdigit()):
+            personal.append(int(value))
+        else:
+            raise ValueError(f'Invalid notification id: {value!r}')
+    return personal, broadcast
+
+
+def unread_etag(conn, user_id):
+    # Changes whenever an unread notification is added or marked read
+    count, newest = conn.execute('''
+        SELECT COUNT(*), MAX(id) FROM notifications WHERE user_id = ? AND read_status = 0
+    ''', (user_id,)).fetchone()
+    return f'{user_id}-{count}-{newest or 0}'
+
+
+def format_event(notification):
+    if notification.get('kind') == 'announcement':
+        return f'event: notification\ndata: {json.dumps(notification)}\n\n'
+    return f'id: {notification["id"]}\nevent: notification\ndata: {json.dumps(notification)}\n\n'
+
+
+class StreamState:
+    """Cursors of one user's stream.
+
+    start() and resync() take a reader connection and return the chunks to
+    send; push() turns a broker message into a chunk, or None when the user
+    has already seen it or is not in its audience. The sync and async
+    streams differ only in how they wait for messages and reach the database.
+    """
+
+    def __init__(self, user_id, last_event_id=None):
+        self.user_id = user_id
+        self.last_event_id = last_event_id
+        self.last_id = 0
+        self.last_announcement = 0
+        self.keys = set()
+
+    def channels(self):
+        return channel(self.user_id), announcements.CHANNEL
+
+    def start(self, conn):
+        if self.last_event_id is None:
+            self.last_id = latest_id(conn, self.user_id)
+            backlog = []
+        else:
+            self.last_id = self.last_event_id
+            backlog = newer_than(conn, self.user_id, self.last_id)
+        since, self.keys = announcements.audience_keys(conn, self.user_id)
+        newest = announcements.visible(conn, since, self.keys, limit=1)
+        self.last_announcement = newest[0]['id'] if newest else 0
+        chunks = ['retry: 5000\n\n']
+        for row in backlog:
+            self.last_id = row['id']
+            chunks.append(format_event(dict(row)))
+        return chunks
+
+    def resync(self, conn):
+        rows = newer_than(conn, self.user_id, self.last_id)
+        # Bookings and route subscriptions change the audiences
+        since, self.keys = announcements.audience_keys(conn, self.user_id)
+        broadcast = announcements.visible(conn, since, self.keys, self.last_announcement)
+        chunks = []
+        for row in rows:
+            self.last_id = row['id']
+            chunks.append(format_event(dict(row)))
+        for row in reversed(broadcast):
+            self.last_announcement = row['id']
+            chunks.append(format_event(announcements.as_item(row, read=False)))
+        return chunks
+
+    def push(self, message):
+        if 'audiences' in message:
+            item = message['item']
+            if item['announcement_id'] > self.last_announcement and announcements.matches(self.keys, message['audiences']):
+                self.last_announcement = item['announcement_id']
+                return format_event(item)
+        elif message['id'] > self.last_id:
+            self.last_id = message['id']
+            return format_event(message)
+        return None
+
+
+def stream(pool, user_id, last_event_id=None, heartbeat=15.0, resync_interval=60.0):
+    """Generator of text/event-stream chunks for one user."""
+    state = StreamState(user_id, last_event_id)
+    subscription = broker.subscribe(*state.channels())
+    try:
+        conn = pool.acquire()
+        try:
+            chunks = state.start(conn)
+        finally:
+            pool.release(conn)
+        yield from chunks
+
+        idle = 0.0
+        while not subscription.overflowed:
+            try:
+                message = subscription.get(timeout=heartbeat)
+            except queue.Empty:
+                idle += heartbeat
+                if idle >= resync_interval:
+                    idle = 0.0
+                    conn = pool.acquire()
+                    try:
+                        chunks = state.resync(conn)
+                    finally:
+                        pool.release(conn)
+                    yield from chunks
+                yield ': keepalive\n\n'
+                continue
+            chunk = state.push(message)
+            if chunk is not None:
+                yield chunk
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def astream(run, user_id, last_event_id=None, heartbeat=15.0, resync_interval=60.0):
+    """Async generator of the same chunks for the ASGI server.
+
+    run(fn) is a coroutine that calls fn(conn) with a reader connection on a
+    worker thread, so the event loop never blocks on SQLite and an idle
+    stream holds no thread or connection.
+    """
+    state = StreamState(user_id, last_event_id)
+    subscription = broker.subscribe_async(*state.channels())
+    try:
+        for chunk in await run(state.start):
+            yield chunk
+
+        idle = 0.0
+        while not subscription.overflowed:
+            try:
+                message = await subscription.get(timeout=heartbeat)
+            except queue.Empty:
+                idle += heartbeat
+                if idle >= resync_interval:
+                    idle = 0.0
+                    for chunk in await run(state.resync):
+                        yield chunk
+                yield ': keepalive\n\n'
+                continue
+            chunk = state.push(message)
+            if chunk is not None:
+                yield chunk
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,396 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+
+from flask import Response, current_app, jsonify
+
+import db
+import sessions
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is only needed for frame feeds; event files work without it
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Seat occupancy from the camera feeds.
+#
+# Each active camera_feeds row is opened as a source according to its
+# feed_url:
+#   sim://<name>?seats=50    synthetic camera frames, for demos and tests
+#   <directory>              frame files plus background and seat mask
+#   <file>.jsonl             occupancy events, one JSON object per line
+# A scheduler thread hands every feed to a bounded worker pool at most once
+# at a time, so a slow or hung feed ties up one worker and never queues
+# behind itself. Results go into per-feed state (latest value plus a ring
+# buffer of history) and a JSON payload that is rebuilt on every update, so
+# /api/camera_status only returns bytes that are already there.
+
+FRAME_SUFFIXES = ('.npy', '.png', '.pgm', '.jpg', '.jpeg')
+BACKGROUND = 'background'
+SEAT_MASK = 'seats'
+
+logger = logging.getLogger(__name__)
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+class UnsupportedFeed(ValueError):
+    pass
+
+
+class SeatDetector:
+    """Counts occupied seats by differencing a frame against the empty room.
+
+    labels is an integer mask the size of the frame: 0 for pixels outside any
+    seat, k for pixels belonging to seat k. A seat is occupied when the mean
+    absolute difference over its pixels exceeds threshold.
+    """
+
+    def __init__(self, labels, background, threshold=25.0):
+        if labels.shape != background.shape:
+            raise UnsupportedFeed('Seat mask and background differ in size')
+        self.labels = labels.astype(np.intp).ravel()
+        self.background = background.astype(np.float32).ravel()
+        self.seats = int(self.labels.max())
+        area = np.bincount(self.labels, minlength=self.seats + 1)[1:]
+        self.limits = threshold * area
+
+    def count(self, frame):
+        diff = np.abs(frame.astype(np.float32).ravel() - self.background)
+        totals = np.bincount(self.labels, weights=diff, minlength=self.seats + 1)[1:]
+        return int(np.count_nonzero(totals > self.limits)), self.seats
+
+
+class SimulatedSource:
+    """Synthetic camera: a grid of seats whose occupants come and go."""
+
+    CELL = 12
+
+    def __init__(self, name, seats=40, churn=0.05, threshold=25.0):
+        if np is None:
+            raise UnsupportedFeed('NumPy is required for frame feeds')
+        self.rng = np.random.default_rng(zlib.crc32(name.encode()))
+        self.churn = churn
+        columns = math.ceil(math.sqrt(seats))
+        rows = math.ceil(seats / columns)
+        labels = np.zeros((rows * self.CELL, columns * self.CELL), dtype=np.int32)
+        for seat in range(seats):
+            row, column = divmod(seat, columns)
+            top, left = row * self.CELL + 2, column * self.CELL + 2
+            labels[top:top + self.CELL - 4, left:left + self.CELL - 4] = seat + 1
+        self.labels = labels
+        self.background = self.rng.integers(90, 110, labels.shape).astype(np.uint8)
+        self.occupied = self.rng.random(seats) < 0.4
+        self.detector = SeatDetector(labels, self.background, threshold)
+
+    def frame(self):
+        flips = self.rng.random(self.occupied.size) < self.churn
+        self.occupied ^= flips
+        frame = self.background.astype(np.int16) + self.rng.integers(-6, 7, self.labels.shape)
+        # Seated people show up as a bright blob over their seat
+        people = np.concatenate(([False], self.occupied))[self.labels]
+        frame[people] += 80
+        return np.clip(frame, 0, 255).astype(np.uint8)
+
+    def poll(self):
+        return self.detector.count(self.frame())
+
+
+def load_image(path):
+    if path.endswith('.npy'):
+        return np.load(path)
+    if Image is None:
+        raise UnsupportedFeed('Pillow is required for image frames')
+    with Image.open(path) as image:
+        return np.asarray(image.convert('L'))
+
+
+class FrameDirectorySource:
+    """Reads the newest frame dropped into a directory by a capture process.
+
+    The directory also holds background.* (the empty room) and seats.* (the
+    seat label mask). Frames are only read when a newer one has arrived.
+    """
+
+    def __init__(self, path, threshold=25.0):
+        if np is None:
+            raise UnsupportedFeed('NumPy is required for frame feeds')
+        self.path = path
+        files = self.frame_files()
+        try:
+            background = load_image(os.path.join(path, files[BACKGROUND]))
+            labels = load_image(os.path.join(path, files[SEAT_MASK]))
+        except KeyError as exc:
+            raise UnsupportedFeed(f'{path} has no {exc.args[0]} file')
+        self.detector = SeatDetector(labels, background, threshold)
+        self.last_frame = None
+
+    def frame_files(self):
+        files = {}
+        for name in os.listdir(self.path):
+            stem, suffix = os.path.splitext(name)
+            if suffix.lower() in FRAME_SUFFIXES:
+                files[stem if stem in (BACKGROUND, SEAT_MASK) else name] = name
+        return files
+
+    def poll(self):
+        frames = [name for key, name in self.frame_files().items() if key not in (BACKGROUND, SEAT_MASK)]
+        if not frames:
+            return None
+        newest = max(frames)
+        if newest == self.last_frame:
+            return None
+        result = self.detector.count(load_image(os.path.join(self.path, newest)))
+        self.last_frame = newest
+        return result
+
+
+class EventFileSource:
+    """Follows a JSON-lines file of {"occupied": n, "capacity": m} events."""
+
+    TAIL_BYTES = 4096
+
+    def __init__(self, path):
+        self.path = path
+        self.last_size = None
+
+    def poll(self):
+        size = os.path.getsize(self.path)
+        if size == self.last_size:
+            return None
+        self.last_size = size
+        with open(self.path, 'rb') as f:
+            f.seek(max(0, size - self.TAIL_BYTES))
+            lines = [line for line in f.read().splitlines() if line.strip()]
+        if not lines:
+            return None
+        event = json.loads(lines[-1])
+        return int(event['occupied']), int(event['capacity'])
+
+
+def open_source(feed_url, threshold=25.0):
+    if not feed_url:
+        raise UnsupportedFeed('No feed configured')
+    url = urlparse(feed_url)
+    if url.scheme == 'sim':
+        options = parse_qs(url.query)
+        seats = int(options.get('seats', ['40'])[0])
+        return SimulatedSource(url.netloc or url.path, seats=seats, threshold=threshold)
+    if url.scheme in ('', 'file'):
+        path = url.path if url.scheme == 'file' else feed_url
+        if os.path.isdir(path):
+            return FrameDirectorySource(path, threshold)
+        if os.path.isfile(path):
+            return EventFileSource(path)
+        raise UnsupportedFeed(f'{path} does not exist')
+    raise UnsupportedFeed(f'Unsupported feed scheme: {url.scheme}')
+
+
+class Feed:
+    def __init__(self, row, history):
+        self.id = row['id']
+        self.location = row['location']
+        self.feed_url = row['feed_url']
+        self.source = None
+        self.state = 'waiting'
+        self.error = None
+        self.occupied = None
+        self.capacity = None
+        self.updated_at = None
+        # (unix time, occupied, capacity), oldest first
+        self.history = deque(maxlen=history)
+        self.pending = None
+        self.started = 0.0
+
+    def record(self, occupied, capacity, now):
+        self.occupied, self.capacity = occupied, capacity
+        self.updated_at = now
+        self.history.append((now, occupied, capacity))
+        self.state = 'live'
+        self.error = None
+
+    def as_dict(self):
+        available = None if self.capacity is None else self.capacity - self.occupied
+        return {
+            'id': self.id,
+            'location': self.location,
+            'state': self.state,
+            'capacity': self.capacity,
+            'occupied': self.occupied,
+            'available': available,
+            'occupancy_rate': round(self.occupied / self.capacity, 3) if self.capacity else None,
+            'updated_at': (datetime.fromtimestamp(self.updated_at).isoformat(timespec='seconds')
+                           if self.updated_at else None),
+            'error': self.error,
+        }
+
+
+class OccupancyMonitor:
+    def __init__(self, database, workers=4, interval=2.0, history=300,
+                 stall_after=30.0, reload_interval=60.0, threshold=25.0):
+        self.database = database
+        self.interval = interval
+        self.history = history
+        self.stall_after = stall_after
+        self.reload_interval = reload_interval
+        self.threshold = threshold
+        self.settings = None
+        self._feeds = {}
+        self._lock = threading.Lock()
+        self._payload = b'[]'
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='occupancy')
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.reload()
+        self._thread = threading.Thread(target=self._run, name='occupancy-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def reload(self):
+        conn = db.connect(self.database)
+        try:
+            rows = conn.execute("SELECT id, location, feed_url FROM camera_feeds WHERE status = 'active'").fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            feeds = {}
+            for row in rows:
+                feed = self._feeds.get(row['id'])
+                if feed is None or feed.feed_url != row['feed_url']:
+                    feed = Feed(row, self.history)
+                    try:
+                        feed.source = open_source(row['feed_url'], self.threshold)
+                    except (UnsupportedFeed, OSError, ValueError) as exc:
+                        feed.state, feed.error = 'unsupported', str(exc)
+                feed.location = row['location']
+                feeds[row['id']] = feed
+            self._feeds = feeds
+        self._publish()
+
+    def _run(self):
+        next_reload = time.monotonic() + self.reload_interval
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= next_reload:
+                try:
+                    self.reload()
+                except Exception:
+                    logger.exception('Could not reload camera feeds')
+                next_reload = now + self.reload_interval
+            stalled = False
+            for feed in list(self._feeds.values()):
+                if feed.source is None:
+                    continue
+                if feed.pending is None or feed.pending.done():
+                    feed.started = now
+                    try:
+                        feed.pending = self._executor.submit(self._poll, feed)
+                    except RuntimeError:  # pool shut down: stop() or interpreter exit
+                        return
+                elif now - feed.started > self.stall_after and feed.state != 'stalled':
+                    feed.state = 'stalled'
+                    stalled = True
+            if stalled:
+                self._publish()
+            self._stop.wait(self.interval)
+
+    def _poll(self, feed):
+        try:
+            result = feed.source.poll()
+        except Exception as exc:
+            logger.warning('Camera feed %s failed: %s', feed.id, exc)
+            feed.state, feed.error = 'error', str(exc)
+        else:
+            if result is None:
+                if feed.state == 'stalled':
+                    feed.state = 'live' if feed.updated_at else 'waiting'
+                else:
+                    return
+            else:
+                feed.record(result[0], result[1], time.time())
+        self._publish()
+
+    def _publish(self):
+        with self._lock:
+            snapshot = [feed.as_dict() for _, feed in sorted(self._feeds.items())]
+            self._payload = json.dumps(snapshot).encode()
+
+    def payload(self):
+        return self._payload
+
+    def snapshot(self):
+        return json.loads(self._payload)
+
+    def feed_history(self, feed_id):
+        feed = self._feeds.get(feed_id)
+        if feed is None:
+            return None
+        return [{'time': datetime.fromtimestamp(t).isoformat(timespec='seconds'),
+                 'occupied': occupied, 'capacity': capacity}
+                for t, occupied, capacity in list(feed.history)]
+
+
+def get_monitor():
+    global _monitor
+    config = current_app.config
+    settings = (os.getpid(), config['DATABASE'])
+    # One monitor per worker process, started on first use
+    if _monitor is None or _monitor.settings != settings:
+        with _monitor_lock:
+            if _monitor is None or _monitor.settings != settings:
+                if _monitor is not None:
+                    _monitor.stop()
+                monitor = OccupancyMonitor(
+                    config['DATABASE'],
+                    workers=config['CAMERA_WORKERS'],
+                    interval=config['CAMERA_INTERVAL'],
+                    history=config['CAMERA_HISTORY'],
+                    stall_after=config['CAMERA_STALL_AFTER'],
+                    threshold=config['CAMERA_THRESHOLD'],
+                )
+                monitor.settings = settings
+                monitor.start()
+                _monitor = monitor
+    return _monitor
+
+
+@sessions.login_required(api=401)
+def camera_status():
+    return Response(get_monitor().payload(), mimetype='application/json')
+
+
+@sessions.login_required(api=401)
+def camera_history(feed_id):
+    history = get_monitor().feed_history(feed_id)
+    if history is None:
+        return jsonify({'error': 'Unknown camera feed'}), 404
+    return jsonify(history)
+
+
+def init_app(app):
+    app.config.setdefault('CAMERA_WORKERS', 4)
+    app.config.setdefault('CAMERA_INTERVAL', 2.0)
+    app.config.setdefault('CAMERA_HISTORY', 300)
+    app.config.setdefault('CAMERA_STALL_AFTER', 30.0)
+    app.config.setdefault('CAMERA_THRESHOLD', 25.0)
+    app.add_url_rule('/api/camera_status', 'camera_status', camera_status)
+    app.add_url_rule('/api/camera_status/<int:feed_id>/history', 'camera_history', camera_history)
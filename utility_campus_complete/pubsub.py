@@ -0,0 +1,114 @@
+import asyncio
+import queue
+import threading
+from collections import deque
+
+
+class Subscription:
+    def __init__(self, channels, maxsize):
+        self.channels = channels
+        self.queue = queue.Queue(maxsize=maxsize)
+        # Set when the subscriber fell behind and was dropped; the stream should
+        # end so the client reconnects and catches up with Last-Event-ID.
+        self.overflowed = False
+
+    def put_nowait(self, message):
+        self.queue.put_nowait(message)
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+class AsyncSubscription:
+    """Subscription read from an asyncio event loop; publishers may be any thread."""
+
+    def __init__(self, channels, maxsize, loop):
+        self.channels = channels
+        self.maxsize = maxsize
+        self.overflowed = False
+        self._loop = loop
+        self._messages = deque()
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+
+    def put_nowait(self, message):
+        with self._lock:
+            if len(self._messages) >= self.maxsize:
+                raise queue.Full
+            self._messages.append(message)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:  # loop closed: the stream is gone
+            raise queue.Full
+
+    async def get(self, timeout):
+        """Next message; raises queue.Empty after timeout seconds without one."""
+        while True:
+            with self._lock:
+                if self._messages:
+                    return self._messages.popleft()
+                self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise queue.Empty
+
+
+class Broker:
+    """In-process fan-out of messages to per-channel subscriber queues."""
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self._channels = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, *channels):
+        # One queue receives the messages of every channel, in publish order
+        return self._add(Subscription(channels, self.maxsize))
+
+    def subscribe_async(self, *channels):
+        """Like subscribe(), for a coroutine running on the current event loop."""
+        return self._add(AsyncSubscription(channels, self.maxsize, asyncio.get_running_loop()))
+
+    def _add(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+            self.published += 1
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(message)
+            except queue.Full:
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+                with self._lock:
+                    self.dropped += 1
+        return len(subscribers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'channels': len(self._channels),
+                'subscribers': sum(len(s) for s in self._channels.values()),
+                'published': self.published,
+                'dropped': self.dropped,
+            }
+
+
+broker = Broker()
@@ -0,0 +1,227 @@
+import atexit
+import logging
+import os
+import threading
+
+from flask import current_app
+
+import announcements
+import db
+import notifications
+
+# Read receipts for notifications and announcements.
+#
+# record() marks a batch of ids, and optionally everything up to a watermark,
+# read in one transaction. With NOTIFY_READ_BUFFER on, receipts are queued
+# in a per-process write-behind buffer instead and written by a background
+# thread every NOTIFY_READ_FLUSH_INTERVAL seconds, or as soon as
+# NOTIFY_READ_FLUSH_SIZE receipts are waiting, coalesced per user into one
+# transaction.
+#
+# Durability with the buffer on:
+# - A receipt is acknowledged before it is written. A crash or SIGKILL loses
+#   up to one flush interval of receipts; those notifications show as unread
+#   again. Normal interpreter exit flushes what is left.
+# - The worker that took a receipt hides the notification from its own
+#   /api/notifications answers straight away; other workers see it after
+#   the flush commits.
+# - A flush that fails is put back and retried on the next interval.
+#   Receipts are idempotent, so writing one twice is harmless.
+# - Clients that need the write on disk before the response send
+#   "sync": true, which writes directly like the unbuffered path.
+
+logger = logging.getLogger(__name__)
+
+
+class PendingReads:
+    __slots__ = ('ids', 'announcement_ids', 'up_to', 'announcements_up_to')
+
+    def __init__(self):
+        self.ids = set()
+        self.announcement_ids = set()
+        self.up_to = None
+        self.announcements_up_to = None
+
+    def merge(self, ids=(), announcement_ids=(), up_to=None, announcements_up_to=None):
+        self.ids.update(ids)
+        self.announcement_ids.update(announcement_ids)
+        if up_to is not None:
+            self.up_to = max(up_to, self.up_to or 0)
+        if announcements_up_to is not None:
+            self.announcements_up_to = max(announcements_up_to, self.announcements_up_to or 0)
+
+    def __len__(self):
+        return (len(self.ids) + len(self.announcement_ids)
+                + (self.up_to is not None) + (self.announcements_up_to is not None))
+
+    def covers(self, item):
+        if item.get('kind') == 'announcement':
+            announcement_id = item['announcement_id']
+            return (announcement_id in self.announcement_ids
+                    or announcement_id <= (self.announcements_up_to or 0))
+        return item['id'] in self.ids or item['id'] <= (self.up_to or 0)
+
+
+def write(conn, user_id, reads):
+    """Apply PendingReads for one user inside the caller's transaction; returns rows changed."""
+    updated = notifications.mark_read(conn, user_id, reads.ids, reads.up_to)
+    if reads.announcements_up_to is not None:
+        announcements.mark_all_read(conn, user_id, reads.announcements_up_to)
+    if reads.announcement_ids:
+        updated += announcements.mark_read(conn, user_id, reads.announcement_ids)
+    return updated
+
+
+class ReadBuffer:
+    def __init__(self, app, interval=1.0, max_pending=500):
+        self.app = app
+        self.interval = interval
+        self.max_pending = max_pending
+        self.flushes = 0
+        self.written = 0
+        self._pending = {}
+        self._flushing = {}
+        self._size = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='read-receipts', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self.flush()
+
+    def add(self, user_id, reads):
+        with self._lock:
+            self._pending.setdefault(user_id, PendingReads()).merge(
+                reads.ids, reads.announcement_ids, reads.up_to, reads.announcements_up_to)
+            self._size += len(reads)
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            if self._size >= self.max_pending:
+                self._wake.set()
+
+    def version(self, user_id):
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def hide_read(self, user_id, items):
+        """Drop items with a receipt that is queued or being written."""
+        with self._lock:
+            pending = [reads for reads in (self._pending.get(user_id), self._flushing.get(user_id)) if reads]
+        if not pending:
+            return items
+        return [item for item in items if not any(reads.covers(item) for reads in pending)]
+
+    def flush(self):
+        """Write every queued receipt in one transaction; returns rows changed."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending, self._size = self._pending, {}, 0
+                self._flushing = batch
+            if not batch:
+                return 0
+            try:
+                with self.app.app_context(), db.transaction() as conn:
+                    updated = sum(write(conn, user_id, reads) for user_id, reads in batch.items())
+            except Exception:
+                with self._lock:
+                    for user_id, reads in batch.items():
+                        self._pending.setdefault(user_id, PendingReads()).merge(
+                            reads.ids, reads.announcement_ids, reads.up_to, reads.announcements_up_to)
+                        self._size += len(reads)
+                    self._flushing = {}
+                raise
+            with self._lock:
+                self._flushing = {}
+            self.flushes += 1
+            self.written += updated
+            return updated
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write read receipts')
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """This worker's write-behind buffer, or None when buffering is off."""
+    global _buffer
+    app = current_app._get_current_object()
+    if not app.config['NOTIFY_READ_BUFFER']:
+        return None
+    settings = (os.getpid(), app.config['DATABASE'])
+    if _buffer is None or _buffer.settings != settings:
+        with _buffer_lock:
+            if _buffer is None or _buffer.settings != settings:
+                if _buffer is not None:
+                    _buffer.stop()
+                buffer = ReadBuffer(app, interval=app.config['NOTIFY_READ_FLUSH_INTERVAL'],
+                                    max_pending=app.config['NOTIFY_READ_FLUSH_SIZE'])
+                buffer.settings = settings
+                buffer.start()
+                atexit.register(buffer.stop)
+                _buffer = buffer
+    return _buffer
+
+
+def record(user_id, ids=(), up_to=None, everything=False, sync=False):
+    """Mark notifications read for a user.
+
+    ids may mix personal ids and 'announcement-<id>' ids; up_to marks every
+    personal notification up to that id; everything marks all current
+    notifications and announcements. Returns (queued, rows changed), where
+    rows changed is None for queued receipts.
+    """
+    personal, broadcast = notifications.split_ids(ids)
+    reads = PendingReads()
+    reads.merge(personal, broadcast, up_to)
+    buffer = None if sync else get_buffer()
+    if everything:
+        # Pin the watermarks now so a later flush does not swallow newer items
+        conn = db.get_db()
+        reads.merge(up_to=notifications.latest_id(conn, user_id),
+                    announcements_up_to=announcements.newest_id(conn))
+    if not len(reads):
+        return False, 0
+    if buffer is not None:
+        buffer.add(user_id, reads)
+        return True, None
+    with db.transaction() as conn:
+        return False, write(conn, user_id, reads)
+
+
+def poll(conn, user_id, limit=5):
+    """(etag, load) for a user's unread list; load() returns up to limit items.
+
+    The etag is a cheap check on the unread index, the announcement cursor
+    and this worker's buffered receipts, so an unchanged poll can answer 304
+    without loading the list.
+    """
+    etag = f'{notifications.unread_etag(conn, user_id)}-{announcements.unread_etag(conn, user_id)}'
+    buffer = get_buffer()
+    if buffer is None:
+        return etag, lambda: announcements.inbox(conn, user_id, limit=limit, unread_only=True)
+    # Receipts still in the write-behind buffer count as read
+    return (f'{etag}-{buffer.version(user_id)}',
+            lambda: buffer.hide_read(user_id, announcements.inbox(conn, user_id, limit=50, unread_only=True))[:limit])
+
+
+def init_app(app):
+    app.config.setdefault('NOTIFY_READ_BUFFER', False)
+    app.config.setdefault('NOTIFY_READ_FLUSH_INTERVAL', 1.0)
+    app.config.setdefault('NOTIFY_READ_FLUSH_SIZE', 500)
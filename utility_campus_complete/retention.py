@@ -0,0 +1,550 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app, jsonify
+from flask.cli import AppGroup
+
+import db
+import search
+import sessions
+import uploads
+from db import get_db, utc_timestamp
+
+# Data retention, archiving and compaction.
+#
+# Past bookings, read notifications and resolved or closed issues (with
+# their issue_events and maintenance_photos rows) older than RETENTION_DAYS
+# are moved out of campus.db into an archive: a SQLite database
+# (RETENTION_FORMAT 'sqlite', <RETENTION_ARCHIVE_DIR>/campus-archive.db) or
+# gzipped JSON lines, one file per table and month ('jsonl',
+# <dir>/<table>/<YYYY-MM>.jsonl.gz). Rows move RETENTION_BATCH at a time,
+# oldest first: each batch selects, writes to the archive and deletes inside
+# one short BEGIN IMMEDIATE transaction, and the job sleeps RETENTION_PAUSE
+# between batches so request writers queue behind a batch for milliseconds,
+# never behind the whole run. The job's connections checkpoint the WAL
+# between batches instead of inside a batch's COMMIT. The archive is written durably before the
+# delete commits, so a crash can at worst archive a row twice (the database
+# archive replaces by id; readers of the files keep the last copy of an id),
+# never lose one. The usual triggers keep the dashboard counters and search
+# indexes in step with the deletes.
+#
+# RETENTION_MAX_ROWS caps each hot table: when a table is still over its cap
+# after the age pass, its oldest archivable rows go too, whatever their age.
+# Upcoming bookings, unread notifications and open issues are never
+# archived, so only those can keep a table over its cap; the report lists
+# any such table under over_limit.
+#
+# After archiving, the job frees pages in chunks of RETENTION_VACUUM_PAGES
+# (databases created from schema version 14 on use auto_vacuum=INCREMENTAL;
+# `flask retention vacuum` converts an older one with a one-off full
+# VACUUM), merges the search indexes a step, runs PRAGMA optimize, and
+# deletes files in the upload folder that no maintenance_photos row refers
+# to and that are older than RETENTION_UPLOAD_GRACE seconds. Photos of
+# archived issues are kept under <archive dir>/uploads first.
+#
+# Every run is recorded in retention_runs with its report: rows archived per
+# table, bytes reclaimed from the database and the upload folder, the longest
+# write lock a batch held and the hot table sizes. Each worker checks every
+# few minutes whether RETENTION_INTERVAL seconds have passed since the last
+# run and claims the next one in a write transaction, so however many workers
+# there are, one of them runs it (0 turns the background job off; `flask
+# retention run` runs it at once).
+
+POLICIES = {
+    'bookings': {
+        'eligible': "booking_date < date('now', 'localtime')",
+        'age': 'booking_date',
+        'index': None,
+        'children': (),
+    },
+    'notifications': {
+        'eligible': 'read_status = 1',
+        'age': 'created_at',
+        'index': None,
+        'children': (),
+    },
+    'issues': {
+        'eligible': "status IN ('resolved', 'closed')",
+        'age': 'COALESCE(resolved_at, updated_at, created_at)',
+        # Without statistics the planner prefers idx_issues_status and a sort
+        'index': 'idx_issues_closed',
+        'children': (('issue_events', 'issue_id'), ('maintenance_photos', 'issue_id')),
+    },
+}
+FORMATS = ('sqlite', 'jsonl')
+ARCHIVE_DATABASE = 'campus-archive.db'
+ARCHIVE_PRAGMAS = db.CONNECTION_PRAGMAS + (('synchronous', 'FULL'),)
+INCREMENTAL = 2
+POLL_SECONDS = 300.0
+NO_CUTOFF = '9999-12-31'
+
+logger = logging.getLogger(__name__)
+
+
+def stored_columns(conn, table, schema='main'):
+    # Generated columns (hidden 2 and 3) are recomputed, not archived
+    return [row['name'] for row in conn.execute(f'PRAGMA {schema}.table_xinfo({table})') if row['hidden'] == 0]
+
+
+class DatabaseArchive:
+    """Archive rows into a SQLite database, one table per source table."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.conn = db.connect(os.path.join(directory, ARCHIVE_DATABASE), ARCHIVE_PRAGMAS)
+        self.conn.execute('PRAGMA wal_autocheckpoint = 0')
+        self._columns = {}
+
+    def _prepare(self, table, columns):
+        known = self._columns.get(table)
+        if known is None:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, archived_at TIMESTAMP)')
+            known = self._columns[table] = set(stored_columns(self.conn, table))
+        # Columns added to the live table since the archive table was created
+        for column in columns:
+            if column not in known:
+                self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column}')
+                known.add(column)
+
+    def write(self, table, columns, rows, months, archived_at):
+        self._prepare(table, columns)
+        placeholders = ', '.join('?' for _ in range(len(columns) + 1))
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany(f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}, archived_at) '
+                                  f'VALUES ({placeholders})', [tuple(row) + (archived_at,) for row in rows])
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def checkpoint(self):
+        self.conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    def close(self):
+        self.conn.close()
+
+
+class MonthlyFiles:
+    """Archive rows as gzipped JSON lines, one file per table and month."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def write(self, table, columns, rows, months, archived_at):
+        by_month = {}
+        for row, month in zip(rows, months):
+            by_month.setdefault(month, []).append(row)
+        os.makedirs(os.path.join(self.directory, table), exist_ok=True)
+        for month, month_rows in by_month.items():
+            lines = ''.join(json.dumps(dict(zip(columns, row), archived_at=archived_at), default=str) + '\n'
+                            for row in month_rows)
+            # Each batch is appended as its own gzip member; gzip readers
+            # decompress the concatenation as one stream
+            with open(os.path.join(self.directory, table, f'{month}.jsonl.gz'), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb') as out:
+                    out.write(lines.encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    def checkpoint(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def open_archive(config):
+    if config['RETENTION_FORMAT'] not in FORMATS:
+        raise ValueError(f"RETENTION_FORMAT must be one of {', '.join(FORMATS)}")
+    if config['RETENTION_FORMAT'] == 'jsonl':
+        return MonthlyFiles(config['RETENTION_ARCHIVE_DIR'])
+    return DatabaseArchive(config['RETENTION_ARCHIVE_DIR'])
+
+
+def keep_photos(upload_dir, archive_dir, photos):
+    # Hard links cost no space while the upload is still live; copy across filesystems
+    target_dir = os.path.join(archive_dir, 'uploads')
+    os.makedirs(target_dir, exist_ok=True)
+    for photo in photos:
+        source = os.path.join(upload_dir, photo['photo_path'])
+        target = os.path.join(target_dir, os.path.basename(photo['photo_path']))
+        if os.path.exists(target) or not os.path.isfile(source):
+            continue
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+
+def eligible_query(name, what, limit=False):
+    policy = POLICIES[name]
+    indexed = f' INDEXED BY {policy["index"]}' if policy['index'] else ''
+    return (f'SELECT {what} FROM {name}{indexed} WHERE {policy["eligible"]} AND {policy["age"]} < ?'
+            + (f' ORDER BY {policy["age"]} LIMIT ?' if limit else ''))
+
+
+def archive_batch(conn, archive, name, cutoff, limit, upload_dir=None):
+    """Move up to limit archivable rows of name older than cutoff; returns (rows moved, seconds locked)."""
+    policy = POLICIES[name]
+    columns = stored_columns(conn, name)
+    archived_at = utc_timestamp()
+    conn.execute('BEGIN IMMEDIATE')
+    started = time.perf_counter()
+    try:
+        rows = conn.execute(eligible_query(name, f'{policy["age"]}, {", ".join(columns)}', limit=True),
+                            (cutoff, limit)).fetchall()
+        if rows:
+            ids = [row['id'] for row in rows]
+            marks = ', '.join('?' for _ in ids)
+            months = {row['id']: str(row[0])[:7] for row in rows}
+            for child, key in policy['children']:
+                child_columns = stored_columns(conn, child)
+                child_rows = conn.execute(f'SELECT {", ".join(child_columns)} FROM {child} '
+                                          f'WHERE {key} IN ({marks})', ids).fetchall()
+                if child == 'maintenance_photos' and upload_dir:
+                    keep_photos(upload_dir, archive.directory, child_rows)
+                archive.write(child, child_columns, child_rows, [months[row[key]] for row in child_rows], archived_at)
+                conn.execute(f'DELETE FROM {child} WHERE {key} IN ({marks})', ids)
+            archive.write(name, columns, [tuple(row)[1:] for row in rows], [months[i] for i in ids], archived_at)
+            conn.execute(f'DELETE FROM {name} WHERE id IN ({marks})', ids)
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+    return len(rows), time.perf_counter() - started
+
+
+def table_rows(conn, name):
+    return conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+
+
+def database_size(conn):
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    pages = conn.execute('PRAGMA page_count').fetchone()[0]
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return pages * page_size, free * page_size
+
+
+def compact(conn, pages, merge_pages, pause=0.0):
+    """Merge search indexes a step, refresh statistics and free pages in chunks; returns pages freed."""
+    for name in search.SOURCES:
+        fts = search.fts_table(name)
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(f"INSERT INTO {fts} ({fts}, rank) VALUES ('merge', ?)", (merge_pages,))
+        conn.execute('COMMIT')
+    # optimize may ANALYZE; taking the write lock first lets it queue on
+    # busy_timeout instead of failing to upgrade a read transaction
+    conn.execute('PRAGMA analysis_limit = 400')
+    conn.executescript('BEGIN IMMEDIATE; PRAGMA optimize; COMMIT;')
+    freed = 0
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == INCREMENTAL:
+        while True:
+            before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not before:
+                break
+            # executescript steps the pragma to completion; execute() would free one page
+            conn.executescript(f'BEGIN IMMEDIATE; PRAGMA incremental_vacuum({int(pages)}); COMMIT;')
+            after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            freed += before - after
+            if after >= before:
+                break
+            time.sleep(pause)
+    conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+    return freed
+
+
+def sweep_uploads(conn, upload_dir, grace, dry_run=False):
+    """Delete upload files no photo row refers to; returns (files, bytes)."""
+    referenced = set()
+    for row in conn.execute('SELECT photo_path, thumb_path, preview_path FROM maintenance_photos'):
+        referenced.update(path for path in row if path)
+    # Uploads in flight are written, then recorded; the grace period covers them
+    cutoff = time.time() - grace
+    removed = freed = 0
+    for directory in ('', uploads.THUMB_DIR):
+        try:
+            entries = list(os.scandir(os.path.join(upload_dir, directory)))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            relative = f'{directory}/{entry.name}' if directory else entry.name
+            if relative in referenced or not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > cutoff:
+                continue
+            if not dry_run:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+            removed += 1
+            freed += stat.st_size
+    return removed, freed
+
+
+def archive_table(conn, archive, name, cutoff, batch_size, pause, limit=None, upload_dir=None):
+    moved = 0
+    longest = 0.0
+    while limit is None or moved < limit:
+        size = batch_size if limit is None else min(batch_size, limit - moved)
+        count, locked = archive_batch(conn, archive, name, cutoff, size, upload_dir)
+        moved += count
+        longest = max(longest, locked)
+        # Checkpoint between batches rather than in a batch's COMMIT
+        conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        archive.checkpoint()
+        if count < size:
+            break
+        time.sleep(pause)
+    return moved, longest
+
+
+def run(config, dry_run=False, now=None):
+    """Archive, sweep and compact once; returns the report."""
+    now = now or datetime.now(timezone.utc)
+    started = time.perf_counter()
+    report = {'started_at': utc_timestamp(now), 'dry_run': dry_run, 'format': config['RETENTION_FORMAT'],
+              'archived': {}, 'over_limit': [], 'max_lock_ms': 0.0}
+    conn = db.connect(config['DATABASE'])
+    conn.execute('PRAGMA wal_autocheckpoint = 0')
+    archive = None if dry_run else open_archive(config)
+    try:
+        before, _ = database_size(conn)
+        for name in POLICIES:
+            cutoff = utc_timestamp(now - timedelta(days=config['RETENTION_DAYS'][name]))
+            if dry_run:
+                aged = conn.execute(eligible_query(name, 'COUNT(*)'), (cutoff,)).fetchone()[0]
+                excess = table_rows(conn, name) - aged - config['RETENTION_MAX_ROWS'][name]
+                if excess > 0:
+                    archivable = conn.execute(eligible_query(name, 'COUNT(*)'), (NO_CUTOFF,)).fetchone()[0]
+                    aged += min(excess, archivable - aged)
+                report['archived'][name] = aged
+                continue
+            moved, longest = archive_table(conn, archive, name, cutoff, config['RETENTION_BATCH'],
+                                           config['RETENTION_PAUSE'], upload_dir=config['UPLOAD_FOLDER'])
+            excess = table_rows(conn, name) - config['RETENTION_MAX_ROWS'][name]
+            if excess > 0:
+                extra, extra_longest = archive_table(conn, archive, name, NO_CUTOFF, config['RETENTION_BATCH'],
+                                                     config['RETENTION_PAUSE'], excess, config['UPLOAD_FOLDER'])
+                moved += extra
+                longest = max(longest, extra_longest)
+            report['archived'][name] = moved
+            report['max_lock_ms'] = max(report['max_lock_ms'], round(longest * 1000, 2))
+
+        report['uploads_removed'], report['upload_bytes'] = sweep_uploads(
+            conn, config['UPLOAD_FOLDER'], config['RETENTION_UPLOAD_GRACE'], dry_run)
+        if not dry_run:
+            report['pages_freed'] = compact(conn, config['RETENTION_VACUUM_PAGES'],
+                                            config['RETENTION_MERGE_PAGES'], config['RETENTION_PAUSE'])
+        after, free_after = database_size(conn)
+        report['incremental_vacuum'] = conn.execute('PRAGMA auto_vacuum').fetchone()[0] == INCREMENTAL
+        report['database_bytes'] = after
+        report['free_bytes'] = free_after
+        report['reclaimed_bytes'] = before - after
+        report['hot_rows'] = {name: table_rows(conn, name) for name in POLICIES}
+        report['over_limit'] = [name for name, rows in report['hot_rows'].items()
+                                if rows > config['RETENTION_MAX_ROWS'][name]]
+    finally:
+        if archive is not None:
+            archive.close()
+        conn.close()
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def claim_run(conn, interval, dry_run=False, force=False):
+    """Record the start of a run, unless one started in the last interval seconds; returns its id."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if not force and conn.execute('''
+            SELECT 1 FROM retention_runs WHERE dry_run = 0 AND started_at > datetime('now', ?)
+        ''', (f'-{int(interval)} seconds',)).fetchone():
+            run_id = None
+        else:
+            run_id = conn.execute('INSERT INTO retention_runs (started_at, dry_run) VALUES (?, ?) RETURNING id',
+                                  (utc_timestamp(), int(dry_run))).fetchone()[0]
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+    return run_id
+
+
+def run_recorded(config, dry_run=False, force=False):
+    """Claim and run a recorded retention pass; returns its report, or None when one is not due."""
+    conn = db.connect(config['DATABASE'])
+    try:
+        run_id = claim_run(conn, config['RETENTION_INTERVAL'], dry_run, force)
+        if run_id is None:
+            return None
+        try:
+            report = run(config, dry_run)
+        except Exception as e:
+            report = {'error': str(e)}
+            raise
+        finally:
+            conn.execute('UPDATE retention_runs SET finished_at = ?, report = ? WHERE id = ?',
+                         (utc_timestamp(), json.dumps(report), run_id))
+    finally:
+        conn.close()
+    return report
+
+
+class RetentionJob:
+    def __init__(self, app, poll):
+        self.app = app
+        self.poll = poll
+        self.runs = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.poll):
+            try:
+                report = run_recorded(self.app.config)
+            except Exception:
+                logger.exception('Retention run failed')
+                continue
+            if report is not None:
+                self.runs += 1
+                logger.info('Retention run archived %s and reclaimed %d database and %d upload bytes',
+                            report['archived'], report['reclaimed_bytes'], report['upload_bytes'])
+
+
+_job = None
+_job_lock = threading.Lock()
+
+
+def start_retention_job():
+    """Start this worker's retention scheduler, unless RETENTION_INTERVAL is 0."""
+    global _job
+    app = current_app._get_current_object()
+    if not app.config['RETENTION_INTERVAL']:
+        return
+    settings = (os.getpid(), app.config['DATABASE'])
+    if _job is None or _job.settings != settings:
+        with _job_lock:
+            if _job is None or _job.settings != settings:
+                if _job is not None:
+                    _job.stop()
+                job = RetentionJob(app, min(POLL_SECONDS, app.config['RETENTION_INTERVAL']))
+                job.settings = settings
+                job.start()
+                atexit.register(job.stop)
+                _job = job
+
+
+def recent_runs(conn, limit=5):
+    return [dict(row, report=json.loads(row['report']) if row['report'] else None) for row in conn.execute('''
+        SELECT id, started_at, finished_at, dry_run, report FROM retention_runs ORDER BY id DESC LIMIT ?
+    ''', (limit,))]
+
+
+@sessions.login_required('admin', api=True)
+def retention_status():
+    conn = get_db()
+    size, free = database_size(conn)
+    limits = current_app.config['RETENTION_MAX_ROWS']
+    return jsonify({
+        'tables': {name: {'rows': table_rows(conn, name), 'max_rows': limits[name]} for name in POLICIES},
+        'database_bytes': size,
+        'free_bytes': free,
+        'incremental_vacuum': conn.execute('PRAGMA auto_vacuum').fetchone()[0] == INCREMENTAL,
+        'runs': recent_runs(conn),
+    })
+
+
+def format_report(report):
+    lines = [f"{name}: {count} {'archivable' if report['dry_run'] else 'archived'}"
+             for name, count in report['archived'].items()]
+    lines.append(f"uploads: {report['uploads_removed']} files, {report['upload_bytes']} bytes"
+                 + (' to delete' if report['dry_run'] else ' deleted'))
+    if not report['dry_run']:
+        lines.append(f"database: {report['reclaimed_bytes']} bytes reclaimed, now {report['database_bytes']} "
+                     f"({report['free_bytes']} free); longest batch lock {report['max_lock_ms']} ms")
+    if not report['incremental_vacuum']:
+        lines.append('auto_vacuum is off: run `flask retention vacuum` once to reclaim freed pages')
+    for name in report['over_limit']:
+        lines.append(f'{name} is still over RETENTION_MAX_ROWS ({report["hot_rows"][name]} rows)')
+    return lines
+
+
+retention_cli = AppGroup('retention', help='Data retention and compaction commands.')
+
+
+@retention_cli.command('run')
+@click.option('--dry-run', is_flag=True, help='Only count what would be archived and deleted.')
+def run_command(dry_run):
+    """Archive old rows, delete orphaned uploads and compact the database."""
+    report = run_recorded(current_app.config, dry_run, force=True)
+    for line in format_report(report):
+        click.echo(line)
+
+
+@retention_cli.command('status')
+def status_command():
+    """Show hot table sizes and the last retention runs."""
+    conn = db.connect(current_app.config['DATABASE'])
+    try:
+        for name in POLICIES:
+            click.echo(f"{name}: {table_rows(conn, name)} rows (max {current_app.config['RETENTION_MAX_ROWS'][name]})")
+        size, free = database_size(conn)
+        click.echo(f'database: {size} bytes, {free} free')
+        for entry in recent_runs(conn):
+            report = entry['report'] or {}
+            click.echo(f"run {entry['id']} at {entry['started_at']}{' (dry run)' if entry['dry_run'] else ''}: "
+                       + (report.get('error') or ('unfinished' if not entry['finished_at']
+                                                  else f"archived {report['archived']}, reclaimed "
+                                                  f"{report.get('reclaimed_bytes', 0)} + "
+                                                  f"{report['upload_bytes']} upload bytes")))
+    finally:
+        conn.close()
+
+
+@retention_cli.command('vacuum')
+def vacuum_command():
+    """Rewrite the database with auto_vacuum=INCREMENTAL (locks it for the whole rewrite)."""
+    conn = db.connect(current_app.config['DATABASE'])
+    try:
+        before, _ = database_size(conn)
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        after, _ = database_size(conn)
+    finally:
+        conn.close()
+    click.echo(f'Database rewritten: {before} -> {after} bytes, incremental vacuum on.')
+
+
+def init_app(app):
+    app.config.setdefault('RETENTION_FORMAT', os.environ.get('CAMPUS_RETENTION_FORMAT', 'sqlite'))
+    app.config.setdefault('RETENTION_ARCHIVE_DIR', os.environ.get('CAMPUS_ARCHIVE_DIR', 'archive'))
+    app.config.setdefault('RETENTION_DAYS', {'bookings': 180, 'notifications': 90, 'issues': 365})
+    app.config.setdefault('RETENTION_MAX_ROWS', {'bookings': 500000, 'notifications': 1000000, 'issues': 500000})
+    app.config.setdefault('RETENTION_INTERVAL', 24 * 60 * 60.0)
+    app.config.setdefault('RETENTION_BATCH', 500)
+    app.config.setdefault('RETENTION_PAUSE', 0.05)
+    app.config.setdefault('RETENTION_VACUUM_PAGES', 2000)
+    app.config.setdefault('RETENTION_MERGE_PAGES', 500)
+    app.config.setdefault('RETENTION_UPLOAD_GRACE', 60 * 60)
+    app.before_request(start_retention_job)
+    app.add_url_rule('/api/admin/retention', 'retention_status', retention_status)
+    app.cli.add_command(retention_cli)
@@ -0,0 +1,360 @@
+import bisect
+import heapq
+import html
+import itertools
+import re
+import sqlite3
+import unicodedata
+
+import click
+from flask import current_app, jsonify, request, session
+from flask.cli import AppGroup
+
+import db
+import issue_queue
+import sessions
+from db import get_db
+
+# Full-text search over issues, events and notifications.
+#
+# Each source has an FTS5 index (<table>_fts) over its text columns, with
+# the source table, or a <table>_search view over it, as external content,
+# so the index stores only terms and positions. Triggers generated from
+# SOURCES keep the index in step with every insert, delete and update of an
+# indexed column, whatever the write path. Besides the text, an index may
+# carry filter columns (the owner as 'u<user_id>', an issue's category) so
+# that "my notifications matching x" is one intersection of posting lists
+# inside the index rather than a post-filter over every match. User terms
+# are only matched against the text columns.
+#
+# /api/search ranks each source by bm25 and merges the sources on that
+# score; scores from different indexes are only roughly comparable, so a
+# client after one kind of result passes type=. Ranking every match of a
+# common word would cost time in proportion to the table, so each source
+# ranks its newest SEARCH_RANK_WINDOW matches (all of them for rarer terms)
+# and a query costs about the same at any table size. Only the rows of the
+# page being returned are read, and they are highlighted here with the
+# tokenizer's folding: FTS5's highlight() and snippet() run the whole query
+# again for every row. Pages are offsets into the ranked list, up to
+# MAX_OFFSET results deep.
+
+# name -> table, (text column, bm25 weight) pairs, the text columns shown as a
+# result's highlighted title and snippet, filter column -> expression with
+# {row} as the row alias (None when the index has no filters), and the columns
+# whose updates reindex a row
+SOURCES = {
+    'issues': {
+        'table': 'issues',
+        'text': (('description', 1.0), ('location', 2.0)),
+        'heading': 'location',
+        'body': 'description',
+        'filters': {'category': '{row}.category', 'owner': "'u' || {row}.user_id"},
+        'watched': ('description', 'location', 'category', 'user_id'),
+    },
+    'events': {
+        'table': 'events',
+        'text': (('title', 2.0), ('description', 1.0), ('location', 1.0)),
+        'heading': 'title',
+        'body': 'description',
+        'filters': None,
+        'watched': ('title', 'description', 'location'),
+    },
+    'notifications': {
+        'table': 'notifications',
+        'text': (('title', 2.0), ('message', 1.0)),
+        'heading': 'title',
+        'body': 'message',
+        'filters': {'owner': "'u' || {row}.user_id"},
+        'watched': ('title', 'message', 'user_id'),
+    },
+}
+TYPES = {'issue': 'issues', 'event': 'events', 'notification': 'notifications'}
+TOKEN = re.compile(r'\w+')
+QUERY_WORD = re.compile(r'(\w+)(\*)?')
+MAX_WORDS = 16
+SNIPPET_TOKENS = 16
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+MAX_OFFSET = 1000
+DEFAULT_WINDOW = 2000
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def fts_table(name):
+    return f'{name}_fts'
+
+
+def fts_columns(name):
+    source = SOURCES[name]
+    return [column for column, _ in source['text']] + list(source['filters'] or ())
+
+
+def content_table(name):
+    source = SOURCES[name]
+    return f'{source["table"]}_search' if source['filters'] else source['table']
+
+
+def _row_values(name, row):
+    source = SOURCES[name]
+    values = [f'{row}.{column}' for column, _ in source['text']]
+    values += [expr.format(row=row) for expr in (source['filters'] or {}).values()]
+    return ', '.join(values)
+
+
+def schema_statements():
+    statements = []
+    for name, source in SOURCES.items():
+        table, fts = source['table'], fts_table(name)
+        columns = fts_columns(name)
+        if source['filters']:
+            filters = ', '.join(f'{expr.format(row=table)} AS {column}' for column, expr in source['filters'].items())
+            statements.append(f'CREATE VIEW IF NOT EXISTS {content_table(name)} AS SELECT id, '
+                              f'{", ".join(column for column, _ in source["text"])}, {filters} FROM {table}')
+        statements.append(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({', '.join(columns)}, "
+                          f"content='{content_table(name)}', content_rowid='id', "
+                          f"tokenize='unicode61 remove_diacritics 2')")
+        insert = f'INSERT INTO {fts} (rowid, {", ".join(columns)}) VALUES (NEW.id, {_row_values(name, "NEW")});'
+        delete = (f"INSERT INTO {fts} ({fts}, rowid, {', '.join(columns)}) "
+                  f"VALUES ('delete', OLD.id, {_row_values(name, 'OLD')});")
+        statements.append(f'CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN\n{insert}\nEND')
+        statements.append(f'CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN\n{delete}\nEND')
+        statements.append(f'CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {", ".join(source["watched"])} '
+                          f'ON {table} BEGIN\n{delete}\n{insert}\nEND')
+        statements.append(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+    return statements
+
+
+def rebuild(conn, names=None):
+    """Rebuild and merge the indexes from their tables, inside the caller's transaction."""
+    for name in names or SOURCES:
+        fts = fts_table(name)
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize')")
+
+
+def check(conn, names=None):
+    """Names of the indexes that disagree with their tables."""
+    broken = []
+    for name in names or SOURCES:
+        fts = fts_table(name)
+        try:
+            conn.execute(f"INSERT INTO {fts} ({fts}, rank) VALUES ('integrity-check', 1)")
+        except sqlite3.DatabaseError:
+            broken.append(name)
+    return broken
+
+
+def query_words(query):
+    """(word, is prefix) pairs from a search box query; raises InvalidQuery when there are none.
+
+    A word ending in * matches as a prefix. Other punctuation and FTS5
+    operators in user input are dropped, so any string makes a valid
+    expression.
+    """
+    words = [(match.group(1), bool(match.group(2))) for match in QUERY_WORD.finditer(query or '')][:MAX_WORDS]
+    if not words:
+        raise InvalidQuery('Enter a word to search for')
+    return words
+
+
+def match_expression(words):
+    """FTS5 query matching all of words."""
+    return ' '.join(f'"{word}"*' if prefix else f'"{word}"' for word, prefix in words)
+
+
+def quoted(value):
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def scope_filter(name, scope):
+    """Filter-column expression limiting a source to what scope allows, '' for everything, None for nothing."""
+    clauses = []
+    for column, values in scope.get(name, {}).items():
+        if not values:
+            return None
+        clauses.append(f'{column} : ({" OR ".join(quoted(value) for value in values)})')
+    return ' AND '.join(clauses)
+
+
+def source_expression(name, terms, scope):
+    """MATCH expression for terms in one source's text columns within scope, or None when scope excludes it."""
+    restrict = scope_filter(name, scope)
+    if restrict is None:
+        return None
+    text_columns = [column for column, _ in SOURCES[name]['text']]
+    expression = f'{{{" ".join(text_columns)}}} : ({terms})'
+    return f'{restrict} AND {expression}' if restrict else expression
+
+
+def rank(conn, name, expression, limit, window):
+    """Up to limit (score, name, rowid) for the best of the newest window matches, best first."""
+    source = SOURCES[name]
+    fts = fts_table(name)
+    weights = [str(weight) for _, weight in source['text']] + ['0.0'] * len(source['filters'] or ())
+    # The index walks matches newest first and stops after the window, so only
+    # those are scored; sorting every match of a common word by bm25 would
+    # score them all
+    return [(row[1], name, row[0]) for row in conn.execute(f'''
+        SELECT rowid, score FROM (
+            SELECT rowid, bm25({fts}, {', '.join(weights)}) AS score FROM {fts}
+            WHERE {fts} MATCH ? ORDER BY rowid DESC LIMIT ?
+        ) ORDER BY score LIMIT ?
+    ''', (expression, window, limit))]
+
+
+def fold(token):
+    # The tokenizer's case folding and diacritic removal (remove_diacritics 2)
+    return ''.join(ch for ch in unicodedata.normalize('NFKD', token) if not unicodedata.combining(ch)).casefold()
+
+
+def term_matcher(words):
+    """Predicate for the tokens that query words match."""
+    exact = {fold(word) for word, prefix in words if not prefix}
+    prefixes = tuple(fold(word) for word, prefix in words if prefix)
+    return lambda token: token in exact or token.startswith(prefixes)
+
+
+def highlight(text, matches, size=None):
+    """HTML for text with matching tokens in <mark>; with size, the size-token stretch with most matches."""
+    if not text:
+        return text
+    tokens = list(TOKEN.finditer(text))
+    hits = [i for i, token in enumerate(tokens) if matches(fold(token.group()))]
+    start, end = 0, len(tokens)
+    if size is not None and len(tokens) > size:
+        # Window starting at the hit that has the most hits in the next size tokens
+        best = max(range(len(hits)), key=lambda n: bisect.bisect_left(hits, hits[n] + size) - n, default=None)
+        first = hits[best] if best is not None else 0
+        start = max(0, min(first - min(2, size // 2), len(tokens) - size))
+        end = start + size
+    begin = tokens[start].start() if start else 0
+    finish = tokens[end - 1].end() if end < len(tokens) else len(text)
+    parts, position = [], begin
+    for i in hits:
+        if start <= i < end:
+            token = tokens[i]
+            parts += [html.escape(text[position:token.start()]), '<mark>', html.escape(token.group()), '</mark>']
+            position = token.end()
+    parts.append(html.escape(text[position:finish]))
+    return ('...' if begin else '') + ''.join(parts) + ('...' if finish < len(text) else '')
+
+
+def load_results(conn, name, rowids, matches):
+    """Rows for rowids from one source as {rowid: result}, with highlights."""
+    source = SOURCES[name]
+    rows = conn.execute(f'''SELECT * FROM {source["table"]} WHERE id IN ({", ".join("?" * len(rowids))})''',
+                        rowids).fetchall()
+    return {row['id']: as_result(name, row, highlight(row[source['heading']], matches),
+                                 highlight(row[source['body']], matches, SNIPPET_TOKENS)) for row in rows}
+
+
+def as_result(name, row, title, snippet):
+    result = {'type': {value: key for key, value in TYPES.items()}[name], 'id': row['id'],
+              'title': title, 'snippet': snippet, 'created_at': row['created_at']}
+    if name == 'issues':
+        result.update(category=row['category'], priority=row['priority'], status=row['status'])
+    elif name == 'events':
+        result.update(event_date=row['event_date'], event_time=row['event_time'], location=row['location'])
+    else:
+        result.update(category=row['category'], read=bool(row['read_status']))
+    return result
+
+
+def user_scope(user_id, role):
+    """What a user may search: per source, filter column -> allowed values (absent means no limit)."""
+    if role == 'admin':
+        return {}
+    scope = {'notifications': {'owner': [f'u{user_id}']}}
+    is_staff, categories = issue_queue.staff_categories(role)
+    if is_staff and categories is not None:
+        scope['issues'] = {'category': list(categories)}
+    elif not is_staff:
+        scope['issues'] = {'owner': [f'u{user_id}']}
+    return scope
+
+
+def search(conn, query, scope, types=None, offset=0, limit=DEFAULT_LIMIT, window=DEFAULT_WINDOW):
+    """(results, more) for one page of query over the given types, best match first."""
+    words = query_words(query)
+    terms = match_expression(words)
+    names = [TYPES[kind] for kind in types] if types else list(SOURCES)
+    expressions = {name: source_expression(name, terms, scope) for name in names}
+    # Every source's best offset + limit + 1 covers this page of the merged list
+    wanted = offset + limit + 1
+    ranked = heapq.merge(*(rank(conn, name, expression, wanted, window)
+                           for name, expression in expressions.items() if expression is not None))
+    page = list(itertools.islice(ranked, offset, offset + limit + 1))
+    # Rows and highlights only for what is shown
+    matches = term_matcher(words)
+    loaded = {name: load_results(conn, name, [rowid for _, source, rowid in page[:limit] if source == name], matches)
+              for name in {name for _, name, _ in page[:limit]}}
+    results = []
+    for score, name, rowid in page[:limit]:
+        result = loaded[name].get(rowid)
+        if result is not None:
+            result['score'] = -score
+            results.append(result)
+    return results, len(page) > limit
+
+
+@sessions.login_required(api=True)
+def api_search():
+    types = [kind for value in request.args.getlist('type') for kind in value.split(',') if kind]
+    unknown = [kind for kind in types if kind not in TYPES]
+    if unknown:
+        return jsonify({'error': f'Unknown type: {unknown[0]}', 'types': sorted(TYPES)}), 400
+    try:
+        page = max(1, int(request.args.get('page') or 1))
+        limit = min(MAX_LIMIT, max(1, int(request.args.get('limit') or DEFAULT_LIMIT)))
+    except ValueError:
+        return jsonify({'error': 'page and limit must be whole numbers'}), 400
+    offset = (page - 1) * limit
+    if offset >= MAX_OFFSET:
+        return jsonify({'error': f'Results stop after {MAX_OFFSET}; refine the search'}), 400
+    query = request.args.get('q', '')
+    try:
+        results, more = search(get_db(), query, user_scope(session['user_id'], session['role']),
+                               types, offset, limit, current_app.config['SEARCH_RANK_WINDOW'])
+    except InvalidQuery as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'query': query, 'page': page, 'results': results,
+                    'next_page': page + 1 if more and offset + limit < MAX_OFFSET else None})
+
+
+search_cli = AppGroup('search', help='Full-text search index commands.')
+
+
+@search_cli.command('reindex')
+@click.option('--source', 'names', multiple=True, type=click.Choice(sorted(SOURCES)),
+              help='Only this index (repeatable); default all.')
+def reindex_command(names):
+    """Rebuild the full-text indexes from their tables."""
+    with db.transaction() as conn:
+        rebuild(conn, names)
+        counts = {name: conn.execute(f'SELECT COUNT(*) FROM {SOURCES[name]["table"]}').fetchone()[0]
+                  for name in names or SOURCES}
+    for name, count in counts.items():
+        click.echo(f'{fts_table(name)}: {count} rows indexed')
+
+
+@search_cli.command('check')
+def check_command():
+    """Report full-text indexes that are out of step with their tables."""
+    conn = db.connect(current_app.config['DATABASE'])
+    try:
+        broken = check(conn)
+    finally:
+        conn.close()
+    if broken:
+        raise click.ClickException(f'Out of date: {", ".join(fts_table(name) for name in broken)}; '
+                                   f'run `flask search reindex`.')
+    click.echo('All search indexes consistent.')
+
+
+def init_app(app):
+    app.config.setdefault('SEARCH_RANK_WINDOW', DEFAULT_WINDOW)
+    app.add_url_rule('/api/search', 'api_search', api_search)
+    app.cli.add_command(search_cli)
@@ -0,0 +1,126 @@
+from werkzeug.security import generate_password_hash
+
+# Sample data loaded by `flask seed` / `flask init-db`.
+# Seeding is idempotent: every row is only inserted if its natural key is
+# missing, and passwords are only hashed for users that do not exist yet.
+
+SAMPLE_USERS = [
+    ('admin', 'admin123', 'admin', 'admin@campus.com'),
+    ('student1', 'student123', 'student', 'student1@campus.com'),
+    ('faculty1', 'faculty123', 'faculty', 'faculty1@campus.com'),
+    ('chef1', 'chef123', 'chef', 'chef1@campus.com'),
+    ('buscoord1', 'bus123', 'buscoordinator', 'buscoord1@campus.com'),
+]
+
+SAMPLE_ROOMS = [
+    ('Room 101', 30, 'classroom', 'available'),
+    ('Room 102', 25, 'classroom', 'available'),
+    ('Lab A', 20, 'laboratory', 'available'),
+    ('Library', 50, 'library', 'available'),
+    ('Conference Room', 15, 'conference', 'available'),
+]
+
+SAMPLE_BUS_ROUTES = [
+    ('Route 1', '08:00', 'Downtown', 'active'),
+    ('Route 2', '08:30', 'Suburb', 'active'),
+    ('Route 3', '17:00', 'Downtown', 'active'),
+]
+
+SAMPLE_WASHROOMS = [
+    ('Block A - Ground Floor', 'clean'),
+    ('Block B - First Floor', 'clean'),
+    ('Library', 'clean'),
+]
+
+SAMPLE_MENU = [
+    ('Monday', 'lunch', 'Vegetable Biryani', 120.0),
+    ('Monday', 'dinner', 'Chicken Curry', 150.0),
+    ('Tuesday', 'lunch', 'Masala Dosa', 80.0),
+    ('Tuesday', 'dinner', 'Paneer Tikka', 130.0),
+]
+
+SAMPLE_ISSUES = [
+    (1, 'washroom', 'Block A washroom needs cleaning', 'Block A', 'high'),
+    (2, 'classroom', 'Projector not working in Room 101', 'Room 101', 'medium'),
+    (3, 'food', 'Canteen food quality issue', 'Canteen', 'low'),
+    (4, 'bus', 'Bus route 1 delayed', 'Bus Stop', 'high'),
+]
+
+SAMPLE_BOOKINGS = [
+    (1, 1, '2024-01-15', '09:00', '11:00', 'Class meeting'),
+    (2, 2, '2024-01-16', '14:00', '16:00', 'Study group'),
+    (3, 3, '2024-01-17', '10:00', '12:00', 'Lab session'),
+]
+
+SAMPLE_NOTIFICATIONS = [
+    (1, 'System Alert', 'Library maintenance scheduled for tomorrow', 'system', 0),
+    (2, 'Room Booking', 'Your room booking for Room 101 is confirmed', 'booking', 0),
+    (3, 'Issue Update', 'Your reported issue has been resolved', 'issue', 0),
+]
+
+# Simulated cameras (see occupancy.py); point feed_url at a frame directory
+# or an events file to use real counts
+SAMPLE_CAMERA_FEEDS = [
+    ('Library', 'sim://library?seats=50'),
+    ('Canteen', 'sim://canteen?seats=40'),
+    ('Computer Lab', 'sim://lab?seats=25'),
+    ('Study Hall', 'sim://study?seats=30'),
+]
+
+# Noise thresholds in dB, evaluated by noise.py against simulated microphones
+SAMPLE_AI_ALERTS = [
+    ('Library Main Hall', 'noise', 55.0, 'sim://library-main?level=45'),
+    ('Study Rooms', 'noise', 60.0, 'sim://study-rooms?level=50'),
+    ('Computer Section', 'noise', 65.0, 'sim://computer-section?level=55'),
+    ('Reading Area', 'noise', 50.0, 'sim://reading-area?level=40'),
+]
+
+# table -> (columns, natural key columns, rows)
+SAMPLE_TABLES = [
+    ('rooms', ('room_name', 'capacity', 'room_type', 'status'), ('room_name',), SAMPLE_ROOMS),
+    ('bus_routes', ('route_name', 'departure_time', 'destination', 'status'),
+     ('route_name', 'departure_time'), SAMPLE_BUS_ROUTES),
+    ('washroom_status', ('location', 'status'), ('location',), SAMPLE_WASHROOMS),
+    ('canteen_menu', ('day_of_week', 'meal_type', 'item_name', 'price'),
+     ('day_of_week', 'meal_type', 'item_name'), SAMPLE_MENU),
+    ('issues', ('user_id', 'category', 'description', 'location', 'priority'),
+     ('user_id', 'description'), SAMPLE_ISSUES),
+    ('bookings', ('room_id', 'user_id', 'booking_date', 'start_time', 'end_time', 'purpose'),
+     ('room_id', 'booking_date', 'start_time'), SAMPLE_BOOKINGS),
+    ('notifications', ('user_id', 'title', 'message', 'category', 'read_status'),
+     ('user_id', 'title', 'message'), SAMPLE_NOTIFICATIONS),
+    ('camera_feeds', ('location', 'feed_url'), ('location',), SAMPLE_CAMERA_FEEDS),
+    ('ai_alerts', ('location', 'alert_type', 'threshold', 'source_url'),
+     ('location', 'alert_type'), SAMPLE_AI_ALERTS),
+]
+
+
+def insert_missing(conn, table, columns, key, rows):
+    """executemany an INSERT that skips rows whose natural key already exists.
+
+    Returns the number of rows inserted.
+    """
+    placeholders = ', '.join('?' for _ in columns)
+    key_match = ' AND '.join(f'{col} = ?' for col in key)
+    sql = (f'INSERT INTO {table} ({", ".join(columns)}) '
+           f'SELECT {placeholders} WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {key_match})')
+    key_positions = [columns.index(col) for col in key]
+    params = [tuple(row) + tuple(row[i] for i in key_positions) for row in rows]
+    # rowcount leaves out rows written by the stats and search triggers
+    return conn.executemany(sql, params).rowcount
+
+
+def seed_db(conn):
+    """Insert the sample data into an open transaction. Returns rows inserted per table."""
+    inserted = {}
+
+    existing = {row[0] for row in conn.execute('SELECT username FROM users')}
+    new_users = [(username, generate_password_hash(password), role, email)
+                 for username, password, role, email in SAMPLE_USERS
+                 if username not in existing]
+    conn.executemany('INSERT INTO users (username, password, role, email) VALUES (?, ?, ?, ?)', new_users)
+    inserted['users'] = len(new_users)
+
+    for table, columns, key, rows in SAMPLE_TABLES:
+        inserted[table] = insert_missing(conn, table, columns, key, rows)
+    return inserted
@@ -0,0 +1,339 @@
+import functools
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import namedtuple
+
+import click
+from flask import current_app, g, jsonify, redirect, session, url_for
+from flask.cli import AppGroup
+from flask.sessions import SecureCookieSessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+import cache
+from db import after_commit, get_db, transaction
+
+# Server-side sessions and the per-request user context.
+#
+# The session cookie carries only a random token. The session itself is a
+# user_sessions row keyed by the token's SHA-256 (a copy of the table holds
+# no usable cookies) with the signed-in user's id and any other session keys
+# (flash messages, mostly) as compact tagged JSON, NULL when there are none.
+# Username and role are not stored; loading a session joins users, so a
+# deleted account has no session and a role change applies from the next
+# load. Rows expire PERMANENT_SESSION_LIFETIME after their last renewal, and
+# an active session is renewed at most every SESSION_RENEW_INTERVAL seconds,
+# so keeping it alive costs one write per interval, not one per request.
+#
+# Each worker keeps loaded sessions in an LRU (SESSION_CACHE_SIZE entries,
+# SESSION_CACHE_TTL seconds), so most requests open their session without a
+# query. Entries are tagged with one of SESSION_SLOTS version counters chosen
+# by the token hash -- cache.py's counters, in a memory-mapped file
+# (SESSION_VERSION_FILE) when CACHE_BACKEND is 'file' -- and every write,
+# logout or revocation bumps the session's slot after commit, so every
+# worker reloads it on its next request. Edits to users made outside the app
+# show within the TTL; `flask sessions revoke` applies them at once.
+#
+# login_required() checks the role and puts the user context (id, username,
+# role, email, created_at) in g.user, which the dashboards pass on instead
+# of querying users again. A new session id is issued whenever the session's
+# user changes, so a token seen before login is useless after it. With
+# SESSION_STORE 'cookie' Flask's signed-cookie sessions are used instead;
+# g.user is then read from users once per request and nothing can be revoked
+# before the cookie expires.
+
+IDENTITY_KEYS = ('user_id', 'username', 'role')
+USER_COLUMNS = ('id', 'username', 'role', 'email', 'created_at')
+
+Record = namedtuple('Record', 'user_id data expires_at user')
+
+
+def token_key(token):
+    return hashlib.sha256(token.encode()).digest()
+
+
+class SessionStore:
+    """Session rows read through an LRU tagged with per-slot version counters."""
+
+    def __init__(self, versions, slots, maxsize, ttl):
+        self.slots = slots
+        self.cache = cache.ReferenceCache(versions, maxsize=maxsize, ttl=ttl, tables=())
+        self.settings = None
+
+    def slot(self, key):
+        return int.from_bytes(key[:4], 'little') % self.slots
+
+    def lookup(self, key, connect=get_db):
+        """The unexpired Record for a token hash, or None; connect() is only called on a miss."""
+        record = self.cache.get_or_load(key, (self.slot(key),), lambda: load_record(connect(), key))
+        if record is None or record.expires_at <= time.time():
+            return None
+        return record
+
+    def forget(self, keys):
+        # Inside db.transaction(): the bump lands once the write is committed
+        slots = {self.slot(key) for key in keys}
+
+        def bump():
+            for slot in slots:
+                self.cache.invalidate(slot)
+        after_commit(bump)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    config = current_app.config
+    settings = (os.getpid(), config['CACHE_BACKEND'], config['SESSION_VERSION_FILE'], config['SESSION_SLOTS'],
+                config['SESSION_CACHE_SIZE'], config['SESSION_CACHE_TTL'])
+    # Rebuilt after a fork so every worker holds its own lock on the version file
+    if _store is None or _store.settings != settings:
+        with _store_lock:
+            if _store is None or _store.settings != settings:
+                slots = range(config['SESSION_SLOTS'])
+                if config['CACHE_BACKEND'] == 'file':
+                    versions = cache.FileVersions(config['SESSION_VERSION_FILE'], slots)
+                else:
+                    versions = cache.LocalVersions(slots)
+                _store = SessionStore(versions, len(slots), config['SESSION_CACHE_SIZE'], config['SESSION_CACHE_TTL'])
+                _store.settings = settings
+    return _store
+
+
+def load_record(conn, key):
+    row = conn.execute('''
+        SELECT s.user_id, s.data, s.expires_at, u.id, u.username, u.role, u.email, u.created_at
+        FROM user_sessions s LEFT JOIN users u ON u.id = s.user_id
+        WHERE s.id = ?
+    ''', (key,)).fetchone()
+    if row is None:
+        return None
+    user = None
+    if row['user_id'] is not None:
+        if row['id'] is None:
+            # The account is gone, and the session with it
+            return None
+        user = {column: row[column] for column in USER_COLUMNS}
+    # data stays serialized: each request decodes its own copy
+    return Record(row['user_id'], row['data'], row['expires_at'], user)
+
+
+def save_record(conn, key, user_id, data, expires_at, now):
+    conn.execute('''
+        INSERT INTO user_sessions (id, user_id, data, created_at, expires_at) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET user_id = excluded.user_id, data = excluded.data,
+                                       expires_at = excluded.expires_at
+    ''', (key, user_id, data, now, expires_at))
+
+
+def delete_records(conn, keys):
+    conn.executemany('DELETE FROM user_sessions WHERE id = ?', [(key,) for key in keys])
+    get_store().forget(keys)
+
+
+def purge_expired(conn, limit=None, now=None):
+    """Delete expired sessions (at most limit of them); returns how many went."""
+    now = int(time.time()) if now is None else now
+    return conn.execute('''
+        DELETE FROM user_sessions WHERE id IN (
+            SELECT id FROM user_sessions WHERE expires_at <= ? ORDER BY expires_at LIMIT ?
+        )
+    ''', (now, -1 if limit is None else limit)).rowcount
+
+
+def user_session_keys(conn, user_id):
+    return [row[0] for row in conn.execute('SELECT id FROM user_sessions WHERE user_id = ?', (user_id,))]
+
+
+def revoke_user(conn, user_id):
+    """Sign a user out everywhere, inside the caller's transaction; returns the sessions ended."""
+    keys = user_session_keys(conn, user_id)
+    delete_records(conn, keys)
+    return len(keys)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, token=None, key=None, record=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.token = token
+        self.key = key
+        self.record = record
+        self.modified = False
+        self.accessed = False
+
+    @property
+    def user(self):
+        return self.record.user if self.record is not None else None
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class ServerSessionInterface(SecureCookieSessionInterface):
+    """Sessions in user_sessions; falls back to signed cookies with SESSION_STORE 'cookie'."""
+
+    def open_session(self, app, request):
+        if app.config['SESSION_STORE'] == 'cookie':
+            return super().open_session(app, request)
+        token = request.cookies.get(self.get_cookie_name(app))
+        if not token:
+            return ServerSession()
+        key = token_key(token)
+        record = get_store().lookup(key)
+        if record is None:
+            # Expired or revoked: starts over, and the stale cookie is dropped unless a new id replaces it
+            return ServerSession(token=token)
+        initial = session_json_serializer.loads(record.data) if record.data else {}
+        if record.user is not None:
+            initial.update(user_id=record.user['id'], username=record.user['username'], role=record.user['role'])
+        return ServerSession(initial, token, key, record)
+
+    def save_session(self, app, session, response):
+        if not isinstance(session, ServerSession):
+            return super().save_session(app, session, response)
+        name = self.get_cookie_name(app)
+        cookie = {'domain': self.get_cookie_domain(app), 'path': self.get_cookie_path(app),
+                  'secure': self.get_cookie_secure(app), 'samesite': self.get_cookie_samesite(app),
+                  'httponly': self.get_cookie_httponly(app)}
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.key is not None:
+                with transaction() as conn:
+                    delete_records(conn, [session.key])
+            if session.token is not None:
+                response.delete_cookie(name, **cookie)
+                response.vary.add('Cookie')
+            return
+
+        now = int(time.time())
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        record = session.record
+        user_id = dict.get(session, 'user_id')
+        rotate = record is None or record.user_id != user_id
+        renew = record is not None and record.expires_at - now < lifetime - app.config['SESSION_RENEW_INTERVAL']
+        if not (rotate or renew or session.modified):
+            return
+
+        extra = {k: v for k, v in session.items() if k not in IDENTITY_KEYS}
+        data = session_json_serializer.dumps(extra) if extra else None
+        with transaction() as conn:
+            if rotate:
+                if session.key is not None:
+                    delete_records(conn, [session.key])
+                session.token = secrets.token_urlsafe(32)
+                session.key = token_key(session.token)
+                purge_expired(conn, app.config['SESSION_PURGE_BATCH'], now)
+            save_record(conn, session.key, user_id, data, now + lifetime, now)
+            get_store().forget([session.key])
+        # The token only changes on rotation; a permanent cookie's expiry moves with each renewal
+        if rotate or (renew and session.permanent):
+            response.set_cookie(name, session.token, expires=self.get_expiration_time(app, session), **cookie)
+            response.vary.add('Cookie')
+
+
+def load_user():
+    if isinstance(session, ServerSession):
+        return session.user
+    if 'user_id' not in session:
+        return None
+    row = get_db().execute(f'SELECT {", ".join(USER_COLUMNS)} FROM users WHERE id = ?',
+                           (session['user_id'],)).fetchone()
+    return dict(row) if row else None
+
+
+def current_user():
+    """The signed-in user's id, username, role, email and created_at, loaded once per request."""
+    if 'user' not in g:
+        g.user = load_user()
+    return g.user
+
+
+def login_required(*roles, api=False, denied=None):
+    """Let a view run only for a signed-in user (with one of roles, if any are given).
+
+    Others are sent to the login page, or get a JSON error from api views:
+    403, or the status api names (api=401). denied() replaces that response
+    for views whose callers expect another shape.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            user = current_user()
+            if user is None or (roles and user['role'] not in roles):
+                if denied is not None:
+                    return denied()
+                if api:
+                    return jsonify({'error': 'Unauthorized'}), 403 if api is True else api
+                return redirect(url_for('login'))
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+@login_required('admin', api=True)
+def session_stats():
+    conn = get_db()
+    now = int(time.time())
+    row = conn.execute('''
+        SELECT COUNT(*) AS sessions, COUNT(DISTINCT user_id) AS users,
+               COALESCE(SUM(expires_at <= ?), 0) AS expired
+        FROM user_sessions
+    ''', (now,)).fetchone()
+    return jsonify({'store': current_app.config['SESSION_STORE'], **dict(row), 'cache': get_store().cache.stats()})
+
+
+sessions_cli = AppGroup('sessions', help='Server-side session commands.')
+
+
+@sessions_cli.command('revoke')
+@click.argument('username')
+def revoke_command(username):
+    """Sign a user out of every session now."""
+    with transaction() as conn:
+        user = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+        if user is None:
+            raise click.ClickException(f'No user named {username}.')
+        ended = revoke_user(conn, user['id'])
+    click.echo(f'Ended {ended} session(s) of {username}.')
+
+
+@sessions_cli.command('purge')
+def purge_command():
+    """Delete every expired session."""
+    with transaction() as conn:
+        purged = purge_expired(conn)
+    click.echo(f'Deleted {purged} expired session(s).')
+
+
+def init_app(app):
+    app.config.setdefault('SESSION_STORE', os.environ.get('CAMPUS_SESSION_STORE', 'server'))
+    app.config.setdefault('SESSION_VERSION_FILE',
+                          os.environ.get('CAMPUS_SESSION_VERSION_FILE', 'campus.session-versions'))
+    app.config.setdefault('SESSION_SLOTS', 4096)
+    app.config.setdefault('SESSION_CACHE_SIZE', 10000)
+    app.config.setdefault('SESSION_CACHE_TTL', 60)
+    app.config.setdefault('SESSION_RENEW_INTERVAL', 60 * 60)
+    app.config.setdefault('SESSION_PURGE_BATCH', 100)
+    app.session_interface = ServerSessionInterface()
+    app.add_url_rule('/api/admin/session_stats', 'session_stats', session_stats)
+    app.cli.add_command(sessions_cli)
@@ -0,0 +1,164 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+import db
+
+# Materialized dashboard counters.
+#
+# stats_counters holds one row per (scope, key), e.g. ('issues.status', 'open').
+# Triggers generated from COUNTERS keep it current on every insert, delete and
+# relevant update, whatever the write path, so reading a dashboard's numbers is
+# a handful of primary-key lookups instead of loading the tables.
+
+# (scope, table, watched columns, key expression with {row} as the row alias)
+COUNTERS = [
+    ('users.total', 'users', (), "''"),
+    ('users.role', 'users', ('role',), "COALESCE({row}.role, '')"),
+    ('issues.total', 'issues', (), "''"),
+    ('issues.status', 'issues', ('status',), "COALESCE({row}.status, '')"),
+    ('issues.category', 'issues', ('category',), "COALESCE({row}.category, '')"),
+    ('issues.priority', 'issues', ('priority',), "COALESCE({row}.priority, '')"),
+    ('issues.category_status', 'issues', ('category', 'status'),
+     "COALESCE({row}.category, '') || ':' || COALESCE({row}.status, '')"),
+    ('bookings.total', 'bookings', (), "''"),
+    ('bookings.status', 'bookings', ('status',), "COALESCE({row}.status, '')"),
+    ('bookings.date', 'bookings', ('booking_date',), "COALESCE({row}.booking_date, '')"),
+]
+
+COUNTED_TABLES = ('users', 'issues', 'bookings')
+
+
+def _increment(scope, key_sql, delta):
+    return (f"INSERT INTO stats_counters (scope, key, value) VALUES ('{scope}', {key_sql}, {delta}) "
+            f"ON CONFLICT (scope, key) DO UPDATE SET value = value + {delta};")
+
+
+def schema_statements():
+    statements = ['''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID
+    ''']
+    for table in COUNTED_TABLES:
+        counters = [c for c in COUNTERS if c[1] == table]
+        inserts = '\n'.join(_increment(scope, expr.format(row='NEW'), 1) for scope, _, _, expr in counters)
+        deletes = '\n'.join(_increment(scope, expr.format(row='OLD'), -1) for scope, _, _, expr in counters)
+        watched = sorted({col for c in counters for col in c[2]})
+        updates = '\n'.join(
+            _increment(scope, expr.format(row='OLD'), -1) + '\n' + _increment(scope, expr.format(row='NEW'), 1)
+            for scope, _, columns, expr in counters if columns
+        )
+        statements.append(f'CREATE TRIGGER IF NOT EXISTS stats_{table}_insert AFTER INSERT ON {table} '
+                          f'BEGIN\n{inserts}\nEND')
+        statements.append(f'CREATE TRIGGER IF NOT EXISTS stats_{table}_delete AFTER DELETE ON {table} '
+                          f'BEGIN\n{deletes}\nEND')
+        statements.append(f'CREATE TRIGGER IF NOT EXISTS stats_{table}_update '
+                          f'AFTER UPDATE OF {", ".join(watched)} ON {table} BEGIN\n{updates}\nEND')
+    return statements + rebuild_statements()
+
+
+def expected_counts_sql(scope, table, expr):
+    return (f"SELECT '{scope}' AS scope, {expr.format(row='t')} AS key, COUNT(*) AS value "
+            f"FROM {table} t GROUP BY 2")
+
+
+def rebuild_statements():
+    return ['DELETE FROM stats_counters'] + [
+        f'INSERT INTO stats_counters (scope, key, value) {expected_counts_sql(scope, table, expr)}'
+        for scope, table, _, expr in COUNTERS
+    ]
+
+
+def rebuild(conn):
+    # Caller provides the transaction (db.transaction() or a migration)
+    for statement in rebuild_statements():
+        conn.execute(statement)
+
+
+def check(conn):
+    """Compare stored counters with a full recount; returns [(scope, key, stored, actual)]."""
+    stored = {(row['scope'], row['key']): row['value']
+              for row in conn.execute('SELECT scope, key, value FROM stats_counters')}
+    actual = {}
+    for scope, table, _, expr in COUNTERS:
+        for row in conn.execute(expected_counts_sql(scope, table, expr)):
+            actual[(row['scope'], row['key'])] = row['value']
+    mismatches = []
+    for scope_key in sorted(set(stored) | set(actual)):
+        have, want = stored.get(scope_key, 0), actual.get(scope_key, 0)
+        if have != want:
+            mismatches.append((scope_key[0], scope_key[1], have, want))
+    return mismatches
+
+
+def counter(conn, scope, key=''):
+    row = conn.execute('SELECT value FROM stats_counters WHERE scope = ? AND key = ?', (scope, key)).fetchone()
+    return row[0] if row else 0
+
+
+def summary(conn, day):
+    """Dashboard numbers from stats_counters.
+
+    bookings.date has a key per day and grows without bound, so only the
+    requested day is read from it; every other scope has a handful of keys.
+    """
+    rows = conn.execute('''
+        SELECT scope, key, value FROM stats_counters
+        WHERE scope != 'bookings.date' OR key = ?
+    ''', (day,)).fetchall()
+    by_scope = {}
+    for row in rows:
+        by_scope.setdefault(row['scope'], {})[row['key']] = row['value']
+    return {
+        'users': {
+            'total': by_scope.get('users.total', {}).get('', 0),
+            'by_role': by_scope.get('users.role', {}),
+        },
+        'issues': {
+            'total': by_scope.get('issues.total', {}).get('', 0),
+            'by_status': by_scope.get('issues.status', {}),
+            'by_category': by_scope.get('issues.category', {}),
+            'by_priority': by_scope.get('issues.priority', {}),
+            'by_category_status': by_scope.get('issues.category_status', {}),
+        },
+        'bookings': {
+            'total': by_scope.get('bookings.total', {}).get('', 0),
+            'by_status': by_scope.get('bookings.status', {}),
+            'date': day,
+            'on_date': by_scope.get('bookings.date', {}).get(day, 0),
+        },
+    }
+
+
+stats_cli = AppGroup('stats', help='Dashboard counter commands.')
+
+
+@stats_cli.command('rebuild')
+def rebuild_command():
+    """Recount every dashboard counter from the tables."""
+    with db.transaction() as conn:
+        rebuild(conn)
+    click.echo('Dashboard counters rebuilt.')
+
+
+@stats_cli.command('check')
+def check_command():
+    """Report counters that disagree with a full recount."""
+    conn = db.connect(current_app.config['DATABASE'])
+    try:
+        mismatches = check(conn)
+    finally:
+        conn.close()
+    for scope, key, stored, actual in mismatches:
+        click.echo(f'{scope} [{key}]: stored {stored}, actual {actual}')
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} counters out of date; run `flask stats rebuild`.')
+    click.echo('All counters consistent.')
+
+
+def init_app(app):
+    app.cli.add_command(stats_cli)
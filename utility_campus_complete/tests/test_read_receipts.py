@@ -0,0 +1,117 @@
+"""Durability rules of the read-receipt write-behind buffer.
+
+    python -m unittest discover tests
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+from unittest import mock
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import receipts  # noqa: E402
+from app import create_app  # noqa: E402
+
+
+def wait_for(check, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class ReadBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.database = os.path.join(self.tmp.name, 'test.db')
+        conn = db.connect(self.database)
+        migrations.upgrade(conn)
+        conn.executemany("INSERT INTO users (username, password, role, email) VALUES (?, 'x', 'student', ?)",
+                         [(f'user{i}', f'user{i}@campus.edu') for i in range(2)])
+        conn.executemany("INSERT INTO notifications (user_id, title, message, category) VALUES (?, 'T', 'M', 'info')",
+                         [(user_id,) for user_id in (1, 2) for _ in range(5)])
+        self.ids = [row[0] for row in conn.execute('SELECT id FROM notifications WHERE user_id = 1 ORDER BY id')]
+        conn.close()
+        self.app = create_app({'DATABASE': self.database, 'NOISE_MONITOR': False})
+
+    def unread(self):
+        conn = db.connect(self.database)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM notifications WHERE read_status = 0').fetchone()[0]
+        finally:
+            conn.close()
+
+    def buffer(self, **kwargs):
+        buffer = receipts.ReadBuffer(self.app, **kwargs)
+        self.addCleanup(buffer.stop)
+        return buffer
+
+    def queue(self, buffer, user_id, ids=(), up_to=None):
+        reads = receipts.PendingReads()
+        reads.merge(ids, up_to=up_to)
+        buffer.add(user_id, reads)
+
+    def test_flushes_on_interval(self):
+        buffer = self.buffer(interval=0.05, max_pending=1000)
+        buffer.start()
+        self.queue(buffer, 1, self.ids[:2])
+        self.assertTrue(wait_for(lambda: self.unread() == 8))
+        self.assertEqual(buffer.written, 2)
+
+    def test_flushes_when_full(self):
+        buffer = self.buffer(interval=3600, max_pending=3)
+        buffer.start()
+        self.queue(buffer, 1, self.ids[:2])
+        time.sleep(0.1)
+        self.assertEqual(self.unread(), 10)
+        self.queue(buffer, 1, self.ids[2:3])
+        self.assertTrue(wait_for(lambda: self.unread() == 7))
+        self.assertEqual(buffer.flushes, 1)
+
+    def test_failed_flush_is_put_back(self):
+        buffer = self.buffer(interval=3600)
+        self.queue(buffer, 1, up_to=self.ids[-1])
+        self.queue(buffer, 2, [self.ids[-1] + 1])
+        with mock.patch.object(receipts, 'write', side_effect=RuntimeError('simulated write failure')):
+            with self.assertRaises(RuntimeError):
+                buffer.flush()
+        self.assertEqual(self.unread(), 10)
+        # Still hidden from this worker while it waits for the retry
+        self.assertEqual(buffer.hide_read(1, [{'id': notification_id} for notification_id in self.ids]), [])
+        self.assertEqual(buffer.flush(), 6)
+        self.assertEqual(self.unread(), 4)
+
+    def test_stop_flushes(self):
+        buffer = self.buffer(interval=3600)
+        buffer.start()
+        self.queue(buffer, 1, self.ids)
+        buffer.stop()
+        self.assertEqual(self.unread(), 5)
+
+    def test_interpreter_exit_flushes(self):
+        script = textwrap.dedent(f"""
+            import sys
+            sys.path.insert(0, {APP_DIR!r})
+            import receipts
+            from app import create_app
+            app = create_app({{'DATABASE': {self.database!r}, 'NOISE_MONITOR': False,
+                               'NOTIFY_READ_BUFFER': True, 'NOTIFY_READ_FLUSH_INTERVAL': 3600}})
+            with app.app_context():
+                assert receipts.record(1, {self.ids!r}) == (True, None)
+        """)
+        subprocess.run([sys.executable, '-c', script], cwd=self.tmp.name, check=True)
+        self.assertEqual(self.unread(), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,416 @@
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+
+from flask import flash, jsonify, redirect, request, session, url_for
+
+import announcements
+import bookings
+import cache
+import sessions
+from availability import DAYS
+from db import get_db, transaction
+
+# Bus timetable engine.
+#
+# A route is a bus_routes row; its stops are bus_route_stops rows in
+# stop_sequence order, each offset_min minutes after the bus leaves the
+# first stop. A schedule is one recurring trip: a departure time from the
+# first stop and a weekday mask (bit 0 = Monday). A trip is a schedule on one
+# service date, and bus_trip_updates holds the coordinator's delay or
+# cancellation for it.
+#
+# The static part is folded into sorted departure arrays, one per stop and
+# weekday, with stop None meaning "from each route's first stop"; arrays for
+# a single route are filtered from those on first use. "Next N departures from stop S after T" is a bisect into the arrays
+# of T's weekday and the following days. Delays are applied at query time:
+# the search starts the largest delay of the day early, and since a delay
+# never makes a bus leave before its scheduled time, it stops once the next
+# scheduled time is past the N-th expected one.
+#
+# The arrays are kept in the reference cache under the bus_routes,
+# bus_stops (stops and route stops) and bus_schedules versions, and each
+# day's trip updates under bus_trip_updates, so edits in any worker show up
+# on the next query.
+
+ALL_DAYS = 0b1111111
+MINUTES_PER_DAY = 24 * 60
+MAX_DELAY = 12 * 60
+MAX_LIMIT = 50
+TIMETABLE_TABLES = ('bus_routes', 'bus_stops', 'bus_schedules')
+NO_DEPARTURES = ((), ())
+
+
+class InvalidTimetable(ValueError):
+    pass
+
+
+def parse_days(values):
+    """Weekday mask from day names ('Monday', 'mon') or 'daily', 'weekdays', 'weekends'."""
+    if isinstance(values, str):
+        values = values.replace(',', ' ').split()
+    days = 0
+    for value in values:
+        name = str(value).strip().lower()
+        if name == 'daily':
+            days |= ALL_DAYS
+        elif name == 'weekdays':
+            days |= 0b0011111
+        elif name == 'weekends':
+            days |= 0b1100000
+        else:
+            matches = [i for i, day in enumerate(DAYS) if len(name) >= 3 and day.lower().startswith(name)]
+            if not matches:
+                raise InvalidTimetable(f'Unknown day: {value!r}')
+            days |= 1 << matches[0]
+    if not days:
+        raise InvalidTimetable('Pick at least one day')
+    return days
+
+
+def format_days(days):
+    if days == ALL_DAYS:
+        return 'Daily'
+    if days == 0b0011111:
+        return 'Mon-Fri'
+    if days == 0b1100000:
+        return 'Sat-Sun'
+    return ', '.join(day[:3] for i, day in enumerate(DAYS) if days >> i & 1)
+
+
+class Timetable:
+    def __init__(self, routes, stops, route_stops, schedules):
+        self.routes = {row['id']: dict(row) for row in routes}
+        self.stops = {row['id']: row['name'] for row in stops}
+        self.route_stops = {}
+        for row in route_stops:
+            self.route_stops.setdefault(row['route_id'], []).append((row['stop_id'], row['offset_min']))
+        self.schedules = {row['id']: dict(row) for row in schedules}
+
+        lists = {}
+        for schedule in self.schedules.values():
+            route_id = schedule['route_id']
+            route = self.routes.get(route_id)
+            if route is None or route['status'] != 'active' or schedule['departure_min'] is None:
+                continue
+            days = [day for day in range(7) if schedule['days'] >> day & 1]
+            for position, (stop_id, offset) in enumerate(self.route_stops.get(route_id, ())):
+                # A trip late in the evening can reach later stops after midnight
+                shift, minute = divmod(schedule['departure_min'] + offset, MINUTES_PER_DAY)
+                trip = (minute, schedule['id'], stop_id, shift, route_id)
+                for day in days:
+                    weekday = (day + shift) % 7
+                    lists.setdefault((stop_id, weekday), []).append(trip)
+                    if position == 0:
+                        lists.setdefault((None, weekday), []).append(trip)
+        self.departures = {}
+        for key, trips in lists.items():
+            trips.sort()
+            self.departures[key] = ([trip[0] for trip in trips], [trip[1:] for trip in trips])
+        # Arrays for one route at a stop, derived on first use
+        self._route_departures = {}
+
+    def arrays(self, stop_id, route_id, weekday):
+        """(sorted minutes, [(schedule_id, stop_id, day shift, route_id)]) at a stop on a weekday."""
+        if route_id is None:
+            return self.departures.get((stop_id, weekday), NO_DEPARTURES)
+        key = (stop_id, route_id, weekday)
+        arrays = self._route_departures.get(key)
+        if arrays is None:
+            times, trips = self.departures.get((stop_id, weekday), NO_DEPARTURES)
+            picked = [i for i, trip in enumerate(trips) if trip[3] == route_id]
+            arrays = self._route_departures[key] = ([times[i] for i in picked], [trips[i] for i in picked])
+        return arrays
+
+    def route_list(self):
+        """Routes by name, each with its schedules in time order."""
+        routes = []
+        for route in sorted(self.routes.values(), key=lambda route: (route['route_name'] or '', route['id'])):
+            schedules = sorted((schedule for schedule in self.schedules.values() if schedule['route_id'] == route['id']),
+                               key=lambda schedule: schedule['departure_min'] or 0)
+            stops = [{'id': stop_id, 'name': self.stops.get(stop_id), 'offset_min': offset}
+                     for stop_id, offset in self.route_stops.get(route['id'], ())]
+            routes.append(dict(route, schedules=[dict(schedule, days_label=format_days(schedule['days']))
+                                                 for schedule in schedules], stops=stops))
+        return routes
+
+    def active_route_count(self):
+        return sum(1 for route in self.routes.values() if route['status'] == 'active')
+
+    def next(self, start, limit, updates, stop_id=None, route_id=None):
+        """Up to limit departures at or after start, in expected time order.
+
+        updates(service_date) returns {schedule_id: (delay_min, cancelled, note)}
+        for that day's trips. Cancelled trips are listed at their scheduled time.
+        """
+        base = start.date()
+        now = start.hour * 60 + start.minute
+        found = []
+        threshold = None
+        for offset in range(-1, 8):
+            day = base + timedelta(days=offset)
+            times, trips = self.arrays(stop_id, route_id, day.weekday())
+            if not times:
+                continue
+            day_start = offset * MINUTES_PER_DAY
+            if threshold is not None and day_start >= threshold:
+                break
+            # Trips reaching this stop today left the first stop today or yesterday
+            service = {0: updates(day), 1: updates(day - timedelta(days=1))}
+            slack = max((update[0] for changes in service.values() for update in changes.values() if not update[1]),
+                        default=0)
+            lower = now - slack - day_start
+            if lower >= MINUTES_PER_DAY:
+                continue
+            for i in range(bisect_left(times, max(lower, 0)), len(times)):
+                scheduled = day_start + times[i]
+                if threshold is not None and scheduled >= threshold:
+                    break
+                schedule_id, trip_stop, shift, _ = trips[i]
+                delay, cancelled, note = service[shift].get(schedule_id, (0, False, None))
+                expected = scheduled if cancelled else scheduled + delay
+                if expected < now:
+                    continue
+                found.append((expected, scheduled, day, times[i], schedule_id, trip_stop,
+                              day - timedelta(days=shift), delay, cancelled, note))
+                if len(found) >= limit:
+                    threshold = sorted(item[0] for item in found)[limit - 1]
+        found.sort(key=lambda item: (item[0], item[1], item[4]))
+        return [self.describe(*item[1:]) for item in found[:limit]]
+
+    def describe(self, scheduled, day, minute, schedule_id, stop_id, service_date, delay, cancelled, note):
+        route = self.routes[self.schedules[schedule_id]['route_id']]
+        expected = minute + (0 if cancelled else delay)
+        return {
+            'schedule_id': schedule_id,
+            'route_id': route['id'],
+            'route_name': route['route_name'],
+            'destination': route['destination'],
+            'stop_id': stop_id,
+            'stop_name': self.stops.get(stop_id),
+            'date': day.isoformat(),
+            'service_date': service_date.isoformat(),
+            'scheduled': bookings.format_minutes(minute),
+            'expected': bookings.format_minutes(expected % MINUTES_PER_DAY),
+            'delay_minutes': 0 if cancelled else delay,
+            'cancelled': bool(cancelled),
+            'note': note,
+        }
+
+
+def load(conn):
+    return Timetable(
+        conn.execute('SELECT id, route_name, destination, status FROM bus_routes').fetchall(),
+        conn.execute('SELECT id, name FROM bus_stops').fetchall(),
+        conn.execute('SELECT * FROM bus_route_stops ORDER BY route_id, stop_sequence').fetchall(),
+        conn.execute('SELECT id, route_id, departure_time, departure_min, days FROM bus_schedules').fetchall(),
+    )
+
+
+def get_timetable(conn):
+    return cache.get_cache().get_or_load(('bus-timetable',), TIMETABLE_TABLES, lambda: load(conn))
+
+
+def trip_updates(conn, service_date):
+    """{schedule_id: (delay_min, cancelled, note)} for one service date."""
+    return cache.get_cache().get_or_load(
+        ('bus-trip-updates', service_date.isoformat()), ('bus_trip_updates',),
+        lambda: {row['schedule_id']: (row['delay_min'], bool(row['cancelled']), row['note']) for row in conn.execute(
+            'SELECT schedule_id, delay_min, cancelled, note FROM bus_trip_updates WHERE service_date = ?',
+            (service_date.isoformat(),))})
+
+
+def next_departures(conn, stop_id=None, route_id=None, at=None, limit=5):
+    """Next departures from a stop (default: each route's first stop) at or after at (default: now)."""
+    timetable = get_timetable(conn)
+    start = at or datetime.now()
+    return timetable.next(start, limit, lambda day: trip_updates(conn, day), stop_id=stop_id, route_id=route_id)
+
+
+def add_schedule(conn, route_id, departure_time, days):
+    """Add a recurring departure, or change the days of an existing one, inside the caller's transaction."""
+    try:
+        departure_time = bookings.format_minutes(bookings.to_minutes(departure_time))
+    except bookings.InvalidBooking as e:
+        raise InvalidTimetable(str(e))
+    if conn.execute('SELECT 1 FROM bus_routes WHERE id = ?', (route_id,)).fetchone() is None:
+        raise InvalidTimetable('Unknown route')
+    conn.execute('''
+        INSERT INTO bus_schedules (route_id, departure_time, days) VALUES (?, ?, ?)
+        ON CONFLICT (route_id, departure_time) DO UPDATE SET days = excluded.days
+    ''', (route_id, departure_time, days))
+    cache.invalidate('bus_schedules')
+
+
+def delete_schedule(conn, schedule_id):
+    conn.execute('DELETE FROM bus_trip_updates WHERE schedule_id = ?', (schedule_id,))
+    deleted = conn.execute('DELETE FROM bus_schedules WHERE id = ?', (schedule_id,)).rowcount
+    cache.invalidate('bus_schedules', 'bus_trip_updates')
+    return deleted
+
+
+def add_stop(conn, route_id, stop_name, offset_min):
+    """Append a stop to a route offset_min minutes after its first stop."""
+    stop_name = (stop_name or '').strip()
+    if not stop_name:
+        raise InvalidTimetable('Stop name is required')
+    if not 0 <= offset_min <= MINUTES_PER_DAY:
+        raise InvalidTimetable('Minutes after departure must be between 0 and 1440')
+    if conn.execute('SELECT 1 FROM bus_routes WHERE id = ?', (route_id,)).fetchone() is None:
+        raise InvalidTimetable('Unknown route')
+    conn.execute('INSERT OR IGNORE INTO bus_stops (name) VALUES (?)', (stop_name,))
+    stop_id = conn.execute('SELECT id FROM bus_stops WHERE name = ?', (stop_name,)).fetchone()[0]
+    last = conn.execute('SELECT MAX(stop_sequence), MAX(offset_min) FROM bus_route_stops WHERE route_id = ?',
+                        (route_id,)).fetchone()
+    if last[0] is not None and offset_min < last[1]:
+        raise InvalidTimetable('Stops are added in order: the offset must not be before the last stop')
+    conn.execute('INSERT INTO bus_route_stops (route_id, stop_sequence, stop_id, offset_min) VALUES (?, ?, ?, ?)',
+                 (route_id, (last[0] if last[0] is not None else -1) + 1, stop_id, offset_min))
+    cache.invalidate('bus_stops')
+    return stop_id
+
+
+def update_trip(conn, schedule_id, service_date, delay_min=0, cancelled=False, note=None, updated_by=None):
+    """Record a delay or cancellation for one trip; returns the schedule row, or None if unknown."""
+    if not 0 <= delay_min <= MAX_DELAY:
+        raise InvalidTimetable(f'Delay must be between 0 and {MAX_DELAY} minutes')
+    schedule = conn.execute('''
+        SELECT s.*, r.route_name, r.destination FROM bus_schedules s JOIN bus_routes r ON s.route_id = r.id
+        WHERE s.id = ?
+    ''', (schedule_id,)).fetchone()
+    if schedule is None:
+        return None
+    if not delay_min and not cancelled:
+        conn.execute('DELETE FROM bus_trip_updates WHERE schedule_id = ? AND service_date = ?',
+                     (schedule_id, service_date.isoformat()))
+    else:
+        conn.execute('''
+            INSERT INTO bus_trip_updates (schedule_id, service_date, delay_min, cancelled, note, updated_by)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (service_date, schedule_id) DO UPDATE SET
+                delay_min = excluded.delay_min, cancelled = excluded.cancelled, note = excluded.note,
+                updated_by = excluded.updated_by, updated_at = CURRENT_TIMESTAMP
+        ''', (schedule_id, service_date.isoformat(), delay_min, int(bool(cancelled)), note, updated_by))
+    cache.invalidate('bus_trip_updates')
+    return schedule
+
+
+def parse_int(value, name, default=None):
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidTimetable(f'{name} must be a whole number')
+
+
+@sessions.login_required(api=401)
+def bus_next():
+    try:
+        stop_id = parse_int(request.args.get('stop'), 'stop')
+        route_id = parse_int(request.args.get('route'), 'route')
+        limit = min(MAX_LIMIT, max(1, parse_int(request.args.get('limit'), 'limit', 5)))
+        at = request.args.get('at')
+        start = datetime.fromisoformat(at) if at else None
+    except (InvalidTimetable, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    conn = get_db()
+    timetable = get_timetable(conn)
+    if stop_id is not None and stop_id not in timetable.stops:
+        return jsonify({'error': 'Unknown stop'}), 404
+    if start is None:
+        # Everyone asking "what leaves next" in the same minute gets the same answer
+        start = datetime.now().replace(second=0, microsecond=0)
+        departures = cache.get_cache().get_or_load(
+            ('bus-next', stop_id, route_id, limit, start), TIMETABLE_TABLES + ('bus_trip_updates',),
+            lambda: next_departures(conn, stop_id, route_id, start, limit))
+    else:
+        departures = next_departures(conn, stop_id, route_id, start, limit)
+    response = jsonify({
+        'at': start.strftime('%Y-%m-%dT%H:%M'),
+        'stop': {'id': stop_id, 'name': timetable.stops[stop_id]} if stop_id is not None else None,
+        'departures': departures,
+    })
+    response.headers['Cache-Control'] = 'private, max-age=30'
+    return response
+
+
+@sessions.login_required(api=401)
+def bus_stops():
+    timetable = get_timetable(get_db())
+    return jsonify([{'id': stop_id, 'name': name} for stop_id, name in sorted(timetable.stops.items(),
+                                                                             key=lambda item: item[1])])
+
+
+@sessions.login_required('buscoordinator', 'admin', api=True)
+def trip_update(schedule_id):
+    data = request.get_json(silent=True) or request.form
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Send a JSON object or form fields'}), 400
+    try:
+        service_date = date.fromisoformat(data.get('date') or date.today().isoformat())
+        delay_min = parse_int(data.get('delay_minutes'), 'delay_minutes', 0)
+        cancelled = str(data.get('cancelled', '')).lower() in ('1', 'true', 'on', 'yes')
+        note = (data.get('note') or '').strip() or None
+        notify = str(data.get('notify', '')).lower() in ('1', 'true', 'on', 'yes')
+        with transaction() as conn:
+            schedule = update_trip(conn, schedule_id, service_date, delay_min, cancelled, note, session['user_id'])
+            if schedule is None:
+                return jsonify({'error': 'Unknown trip'}), 404
+            if notify and (delay_min or cancelled):
+                # Riders who follow the route hear about it straight away
+                status = 'cancelled' if cancelled else f'delayed by {delay_min} min'
+                message = f"The {schedule['departure_time']} to {schedule['destination']} on {service_date.isoformat()} is {status}."
+                if note:
+                    message += f' {note}'
+                announcements.create(conn, f"{schedule['route_name']}: {status}", message,
+                                     [('route', str(schedule['route_id']))], created_by=session['user_id'])
+    except (InvalidTimetable, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'schedule_id': schedule_id, 'date': service_date.isoformat(),
+                    'delay_minutes': 0 if cancelled else delay_min, 'cancelled': cancelled})
+
+
+@sessions.login_required('buscoordinator')
+def add_route_schedule(route_id):
+    try:
+        with transaction() as conn:
+            add_schedule(conn, route_id, request.form.get('departure_time'),
+                         parse_days(request.form.getlist('days')))
+    except InvalidTimetable as e:
+        flash(str(e), 'error')
+    else:
+        flash('Departure saved.', 'success')
+    return redirect(url_for('bus_routes'))
+
+
+@sessions.login_required('buscoordinator')
+def remove_route_schedule(schedule_id):
+    with transaction() as conn:
+        delete_schedule(conn, schedule_id)
+    flash('Departure removed.', 'success')
+    return redirect(url_for('bus_routes'))
+
+
+@sessions.login_required('buscoordinator')
+def add_route_stop(route_id):
+    try:
+        with transaction() as conn:
+            add_stop(conn, route_id, request.form.get('stop_name'),
+                     parse_int(request.form.get('offset_min'), 'Minutes after departure', 0))
+    except InvalidTimetable as e:
+        flash(str(e), 'error')
+    else:
+        flash('Stop added.', 'success')
+    return redirect(url_for('bus_routes'))
+
+
+def init_app(app):
+    app.add_url_rule('/api/bus/next', 'bus_next', bus_next)
+    app.add_url_rule('/api/bus/stops', 'bus_stops', bus_stops)
+    app.add_url_rule('/api/bus/trips/<int:schedule_id>/update', 'trip_update', trip_update, methods=['POST'])
+    app.add_url_rule('/bus_routes/<int:route_id>/schedules', 'add_route_schedule', add_route_schedule,
+                     methods=['POST'])
+    app.add_url_rule('/bus_routes/schedules/<int:schedule_id>/delete', 'remove_route_schedule',
+                     remove_route_schedule, methods=['POST'])
+    app.add_url_rule('/bus_routes/<int:route_id>/stops', 'add_route_stop', add_route_stop, methods=['POST'])
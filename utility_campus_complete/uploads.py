@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it photos are served full size
+    Image = None
+
+# Photo upload pipeline.
+#
+# Uploads are streamed to disk in chunks while being hashed, and stored under
+# their SHA-256 digest, so re-uploading the same photo reuses the existing
+# file. Thumbnail and preview generation is handed to a small background
+# pool; when it finishes it records the derived files and sizes on every
+# maintenance_photos row with that digest.
+
+CHUNK_SIZE = 64 * 1024
+
+# name -> longest edge in pixels
+DERIVED_SIZES = {'thumb': 320, 'preview': 1280}
+THUMB_DIR = 'thumbs'
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def save_stream(stream, upload_dir, extension, max_bytes):
+    """Copy stream into upload_dir as <sha256>.<extension>.
+
+    Returns (filename, digest, size, is_new).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=upload_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f'File is larger than {max_bytes // (1024 * 1024)} MB')
+                digest.update(chunk)
+                out.write(chunk)
+        filename = f'{digest.hexdigest()}.{extension}'
+        final_path = os.path.join(upload_dir, filename)
+        if os.path.exists(final_path):
+            os.remove(temp_path)
+            # Reused: restart the retention sweep's grace period for the file
+            os.utime(final_path)
+            return filename, digest.hexdigest(), size, False
+        os.replace(temp_path, final_path)
+        return filename, digest.hexdigest(), size, True
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def derived_name(digest, name):
+    return f'{THUMB_DIR}/{digest}_{name}.jpg'
+
+
+def generate_derivatives(upload_dir, filename, digest):
+    """Write thumbnail and preview JPEGs; returns (width, height, {name: path})."""
+    os.makedirs(os.path.join(upload_dir, THUMB_DIR), exist_ok=True)
+    with Image.open(os.path.join(upload_dir, filename)) as image:
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        paths = {}
+        for name, edge in DERIVED_SIZES.items():
+            relative = derived_name(digest, name)
+            target = os.path.join(upload_dir, relative)
+            if os.path.exists(target):
+                os.utime(target)
+            else:
+                copy = image.copy()
+                copy.thumbnail((edge, edge))
+                temp_target = target + '.part'
+                copy.save(temp_target, 'JPEG', quality=82, optimize=True, progressive=True)
+                os.replace(temp_target, target)
+            paths[name] = relative
+    return width, height, paths
+
+
+def process_photo(database, upload_dir, filename, digest):
+    # Runs on the background pool, outside any request or app context
+    try:
+        width, height, paths = generate_derivatives(upload_dir, filename, digest)
+        values = (width, height, paths['thumb'], paths['preview'], 'ready', digest)
+    except Exception:
+        logger.exception('Could not generate thumbnails for %s', filename)
+        values = (None, None, None, None, 'failed', digest)
+    conn = db.connect(database)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('''
+            UPDATE maintenance_photos
+            SET width = ?, height = ?, thumb_path = ?, preview_path = ?, thumb_status = ?
+            WHERE content_hash = ?
+        ''', values)
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+
+def get_executor(workers):
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbs')
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def schedule_derivatives(database, upload_dir, filename, digest, workers=2):
+    if Image is None:
+        return None
+    return get_executor(workers).submit(process_photo, database, upload_dir, filename, digest)
@@ -0,0 +1,4 @@
+from app import create_app
+
+# WSGI entry point: gunicorn -w 4 wsgi:app
+app = create_app()